@@ -2,16 +2,62 @@
 FastAPI application main module.
 """
 
-from pathlib import Path
+import asyncio
+from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
-from app.routes import detection, health, upload
+from app.routes import detection, health, metrics, upload
+from app.utils.cleanup import get_garbage_collector
+from app.utils.http_caching import CachedStaticFiles
+from app.utils.http_client import close_http_client, start_http_client
+from app.utils.image_index import get_image_index
+from app.utils.jobs import get_job_manager
+from app.utils.label_rendering import get_label_renderer
+from app.utils.metrics import PrometheusMiddleware, get_loop_lag_monitor, \
+    mark_worker_exited
+from app.utils.render_pool import get_render_pool, shutdown_render_pool
+from app.utils.shared_state import get_shared_state, shared_state_enabled
+from app.utils.storage import PROCESSED_DIR, UPLOAD_DIR, get_storage
 from fastapi import FastAPI
 
 # Load environment variables from .env file at startup
 load_dotenv()
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+
+# How long a worker that died can keep others from reconciling (seconds)
+RECONCILE_LEASE_SECONDS = 60.0
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared resources on startup and release them on shutdown."""
+    # One pooled HTTP client for all outbound Azure calls
+    await start_http_client()
+    # Pick up files added or removed while the service was down; with
+    # several workers only the first to start does
+    if not shared_state_enabled() or await asyncio.to_thread(
+            get_shared_state().acquire_lease, "startup:reconcile",
+            RECONCILE_LEASE_SECONDS):
+        await asyncio.to_thread(get_image_index().reconcile, UPLOAD_DIR,
+                                PROCESSED_DIR)
+    get_render_pool()
+    # Load the label font once (render workers load their own copy)
+    get_label_renderer()
+    get_job_manager().start()
+    get_loop_lag_monitor().start()
+    # Reclaim space from deleted and abandoned files every interval
+    get_garbage_collector().start()
+    yield
+    await get_garbage_collector().stop()
+    await get_loop_lag_monitor().stop()
+    await get_job_manager().stop()
+    await close_http_client()
+    shutdown_render_pool()
+    get_storage().close()
+    if shared_state_enabled():
+        get_shared_state().release_lease("startup:reconcile")
+    mark_worker_exited()
+
 
 app = FastAPI(
     title="Bootcamp FastAPI Backend",
@@ -20,8 +66,13 @@ app = FastAPI(
     version="0.1.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
+# Cut off oversized uploads while the body arrives (inside CORS, so the
+# 413 carries CORS headers)
+app.add_middleware(upload.UploadSizeLimitMiddleware, paths=["/api/upload"])
+
 # Configure CORS for frontend integration
 app.add_middleware(
     CORSMiddleware,
@@ -33,7 +84,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Record request count, latency and in-flight requests per route
+app.add_middleware(PrometheusMiddleware)
+
 # Include routers
+app.include_router(metrics.router, tags=["metrics"])
 app.include_router(health.router, prefix="/api", tags=["health"])
 app.include_router(upload.router, prefix="/api", tags=["upload"])
 app.include_router(detection.router, prefix="/api", tags=["detection"])
@@ -42,17 +97,25 @@ app.include_router(detection.router, prefix="/api", tags=["detection"])
 from app.routes import images
 app.include_router(images.router, prefix="/api", tags=["images"])
 
-# Mount uploads directory for serving uploaded files
-UPLOAD_DIR = Path("uploads")
-PROCESSED_DIR = Path("processed_uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
-PROCESSED_DIR.mkdir(exist_ok=True)
-
-# Mount directories for serving files
-app.mount("/api/uploads", StaticFiles(directory=str(UPLOAD_DIR)),
-          name="uploads")
-app.mount("/api/processed_uploads", StaticFiles(directory=str(PROCESSED_DIR)),
-          name="processed_uploads")
+# Import and include background jobs router
+from app.routes import jobs
+app.include_router(jobs.router, prefix="/api", tags=["jobs"])
+
+if get_storage().local:
+    UPLOAD_DIR.mkdir(exist_ok=True)
+    PROCESSED_DIR.mkdir(exist_ok=True)
+
+    # Mount directories for serving files (with ETags derived from file
+    # metadata, so unchanged files revalidate with a bodyless 304)
+    app.mount("/api/uploads", CachedStaticFiles(directory=str(UPLOAD_DIR)),
+              name="uploads")
+    app.mount("/api/processed_uploads",
+              CachedStaticFiles(directory=str(PROCESSED_DIR)),
+              name="processed_uploads")
+else:
+    # Remote storage: redirect to presigned URLs at the same paths
+    from app.routes import files
+    app.include_router(files.router, prefix="/api", tags=["files"])
 
 
 @app.get("/")
@@ -2,18 +2,40 @@
 Azure Computer Vision Object Detection endpoint.
 """
 
-import io
+import asyncio
+import json
 import logging
+import mimetypes
 import os
+import time
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 
-import httpx
 from dotenv import load_dotenv
-from fastapi import APIRouter, HTTPException, status
-from fastapi.responses import StreamingResponse
-from PIL import Image, ImageDraw, ImageFont
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field
+
+from app.utils.concurrency import SingleFlight, bounded_as_completed
+from app.utils.derivatives import ensure_derivatives
+from app.utils.detection_cache import get_detection_cache
+from app.utils.detectors import get_detector
+from app.utils.http_caching import REVALIDATE_CACHE_CONTROL, etag_matches, \
+    http_date, not_modified_response, strong_etag, versioned_url
+from app.utils.image_index import PROCESSED_PREFIX, DetectionRecord, \
+    ImageRecord, get_image_index
+from app.utils.image_preprocessing import PreparedImage, image_size, \
+    prepare_for_detection
+from app.utils.image_encoding import DEFAULT_FORMAT, FORMATS, \
+    negotiate_format
+from app.utils.image_processing import render_boxes
+from app.utils.jobs import Job, get_job_manager
+from app.utils.metrics import InstrumentedRoute, observe_stage, \
+    stage_timer
+from app.utils.render_pool import RenderPoolSaturated, get_render_pool
+from app.utils.shared_state import new_single_flight
+from app.utils.storage import PROCESSED_DIR, UPLOAD_DIR, get_storage, \
+    storage_call
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -32,12 +54,11 @@ vision_key = os.getenv("VISION_KEY")
 logger.info(f"VISION_ENDPOINT loaded: {'Yes' if vision_endpoint else 'No'}")
 logger.info(f"VISION_KEY loaded: {'Yes' if vision_key else 'No'}")
 
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
 
-# Upload and processed images directories
-UPLOAD_DIR = Path("uploads")
-PROCESSED_DIR = Path("processed_uploads")
-PROCESSED_DIR.mkdir(exist_ok=True)
+# Maximum images processed at the same time by the batch endpoint
+BATCH_DETECTION_CONCURRENCY = int(os.getenv("BATCH_DETECTION_CONCURRENCY",
+                                            "4"))
 
 
 class BoundingBox(BaseModel):
@@ -53,77 +74,36 @@ class BoundingBox(BaseModel):
 class DetectionResponse(BaseModel):
     """Response model for object detection results."""
     processed_image_url: str
+    boxes_url: Optional[str] = None
 
 
-async def call_azure_computer_vision(image_data: bytes) -> Dict[str, Any]:
+class DetectionBoxesResponse(BaseModel):
+    """Bounding boxes of an image, for clients that draw overlays."""
+    image_id: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    boxes: List[BoundingBox]
+
+
+class BatchDetectionRequest(BaseModel):
+    """Request model for batch object detection."""
+    image_ids: List[str] = Field(..., min_length=1, max_length=1000)
+
+
+async def run_detector(image_data: bytes) -> Dict[str, Any]:
     """
-    Call Azure Computer Vision v3.2 Object Detection API.
+    Detect objects with the configured detector backend.
 
     Args:
-        image_data: Raw image bytes
+        image_data: Image bytes to analyze
 
     Returns:
-        dict: Azure Computer Vision API response
+        dict: Azure Computer Vision-style response
 
     Raises:
-        HTTPException: If API call fails
+        HTTPException: If detection fails
     """
-    vision_endpoint = os.getenv("VISION_ENDPOINT")
-    vision_key = os.getenv("VISION_KEY")
-
-    if not vision_endpoint or not vision_key:
-        logger.error("Azure Computer Vision credentials not configured")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Azure Computer Vision service not configured. "
-                   "Please set VISION_ENDPOINT and VISION_KEY env vars."
-        )
-
-    # Construct the API URL
-    analyze_url = f"{vision_endpoint.rstrip('/')}/vision/v3.2/analyze"
-
-    headers = {
-        "Ocp-Apim-Subscription-Key": vision_key,
-        "Content-Type": "application/octet-stream"
-    }
-
-    params = {
-        "visualFeatures": "Objects"
-    }
-
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                analyze_url,
-                headers=headers,
-                params=params,
-                content=image_data
-            )
-
-            if response.status_code == 200:
-                return response.json()
-            else:
-                error_msg = f"Azure Computer Vision API error: " \
-                    f"{response.status_code}"
-                logger.error(f"{error_msg} - {response.text}")
-                raise HTTPException(
-                    status_code=status.HTTP_502_BAD_GATEWAY,
-                    detail=error_msg
-                )
-
-    except httpx.TimeoutException:
-        logger.error("Azure Computer Vision API timeout")
-        raise HTTPException(
-            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
-            detail="Azure Computer Vision API timeout"
-        )
-    except httpx.RequestError as e:
-        logger.error(f"Azure Computer Vision API request error: {str(e)}")
-        logger.error(f"Attempting to connect to: {analyze_url}")
-        raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail=f"Failed to connect to Azure Computer Vision API: {str(e)}"
-        )
+    return await get_detector().detect(image_data)
 
 
 def normalize_detection_response(azure_response: Dict[str, Any]) -> \
@@ -173,72 +153,497 @@ def normalize_detection_response(azure_response: Dict[str, Any]) -> \
     return boxes
 
 
-@router.get("/detections/{image_id}", response_model=DetectionResponse)
-async def detect_objects(image_id: str):
+def rescale_boxes(boxes: List[BoundingBox],
+                  prepared: PreparedImage) -> List[BoundingBox]:
     """
-    Analyze an uploaded image for object detection using Azure Computer Vision.
+    Map bounding boxes detected on a downscaled image to the original.
 
     Args:
-        image_id: The filename/ID of the uploaded image
+        boxes: Boxes in the coordinates of the image sent to Azure
+        prepared: The prepared image with its scale factors
 
     Returns:
-        DetectionResponse: Normalized object detection results and URL to processed image
+        List[BoundingBox]: Boxes in original image coordinates
+    """
+    if not prepared.resized:
+        return boxes
+    return [box.model_copy(update={
+        "x": box.x * prepared.scale_x,
+        "y": box.y * prepared.scale_y,
+        "w": box.w * prepared.scale_x,
+        "h": box.h * prepared.scale_y,
+    }) for box in boxes]
+
+
+def find_uploaded_image(image_id: str) -> ImageRecord:
+    """
+    Resolve an image ID to its uploaded original via the image index.
+
+    Files written before the index existed are picked up by an exact-name
+    lookup in storage, which is also constant-time.
+
+    Args:
+        image_id: The ID of the uploaded image
+
+    Returns:
+        ImageRecord: The indexed image
 
     Raises:
-        HTTPException: If image not found or detection fails
+        HTTPException: If the image does not exist
     """
-    try:
-        # Find the image file in the upload directory
-        image_path = None
-        for file_path in UPLOAD_DIR.iterdir():
-            if file_path.is_file() and image_id in file_path.name:
-                image_path = file_path
-                break
-
-        if not image_path or not image_path.exists():
-            logger.error(f"Image not found: {image_id}")
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Image with ID '{image_id}' not found"
-            )
+    index = get_image_index()
+    storage = get_storage()
+    record = index.resolve(image_id)
+
+    if record is None and "/" not in image_id and \
+            not image_id.startswith("."):
+        candidate = storage.stat(str(UPLOAD_DIR / image_id))
+        # A file whose record is being purged is not registered again
+        if candidate is not None:
+            record = index.add_if_absent(ImageRecord(
+                id=image_id,
+                original_path=candidate.key,
+                size=candidate.size,
+                mtime=candidate.mtime,
+                content_type=mimetypes.guess_type(image_id)[0],
+                uploaded_at=candidate.mtime,
+            ))
+
+    if (record is None or not record.original_path or
+            not storage.exists(record.original_path)):
+        logger.error(f"Image not found: {image_id}")
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Image with ID '{image_id}' not found"
+        )
+    return record
 
-        # Read the image file
-        try:
-            with open(image_path, "rb") as f:
-                image_data = f.read()
-        except IOError as e:
-            logger.error(f"Failed to read image file {image_path}: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to read image file"
-            )
 
-        # Call Azure Computer Vision API
-        azure_response = await call_azure_computer_vision(image_data)
+async def get_detections_for_image(image_data: bytes,
+                                   image_hash: Optional[str] = None) -> \
+        Tuple[str, List[BoundingBox]]:
+    """
+    Return normalized detections for an image, running the detector only on
+    a miss.
 
-        # Normalize the response
-        boxes = normalize_detection_response(azure_response)
+    Args:
+        image_data: Raw image bytes
+        image_hash: Content hash of the image if already known
 
-        # Process the image and save it
-        processed_image_data = draw_bounding_boxes_on_image(image_data, boxes)
-        processed_image_path = PROCESSED_DIR / f"processed_{image_id}"
-        
+    Returns:
+        tuple: Content hash of the image and its bounding boxes
+    """
+    cache = get_detection_cache()
+    if image_hash is None:
+        image_hash = cache.hash_image(image_data)
+
+    cache_key = get_detector().cache_key(image_hash)
+    cached_boxes = await cache.get_boxes(cache_key)
+    if cached_boxes is not None:
+        logger.info(f"Detection cache hit for image hash {image_hash[:12]}")
+        return image_hash, [BoundingBox(**box) for box in cached_boxes]
+
+    async def stored_boxes() -> Optional[List[BoundingBox]]:
+        # Boxes another worker detected while this one waited
+        boxes = await cache.get_boxes(cache_key)
+        return [BoundingBox(**box) for box in boxes] \
+            if boxes is not None else None
+
+    boxes = await get_detection_flights().do(
+        cache_key, lambda: detect_uncached(image_data, cache_key),
+        cached=stored_boxes)
+    return image_hash, boxes
+
+
+async def detect_uncached(image_data: bytes,
+                          cache_key: str) -> List[BoundingBox]:
+    """
+    Run the detector on an image and cache the boxes.
+
+    Args:
+        image_data: Raw image bytes
+        cache_key: Detector cache key of the image
+
+    Returns:
+        list: Bounding boxes in original image coordinates
+    """
+    # Send a downscaled copy and map the boxes back to the original size
+    with stage_timer("preprocess"):
+        prepared = await asyncio.to_thread(prepare_for_detection, image_data)
+    with stage_timer("detect"):
+        detector_response = await run_detector(prepared.data)
+    with stage_timer("normalize"):
+        boxes = rescale_boxes(
+            normalize_detection_response(detector_response), prepared)
+    await get_detection_cache().put_boxes(
+        cache_key, [box.model_dump() for box in boxes])
+    return boxes
+
+
+# Detector calls for the same image content, across all workers when state
+# is shared
+_detection_flights: Optional[SingleFlight] = None
+
+
+def get_detection_flights() -> SingleFlight:
+    """
+    Return the single-flight group that coalesces detector calls.
+
+    Returns:
+        SingleFlight: The shared group
+    """
+    global _detection_flights
+    if _detection_flights is None:
+        _detection_flights = new_single_flight()
+    return _detection_flights
+
+
+async def render_detections(image_hash: str, image_data: bytes,
+                            boxes: List[BoundingBox],
+                            output_format: str = DEFAULT_FORMAT) -> bytes:
+    """
+    Return the image with bounding boxes drawn, reusing a cached render.
+
+    Rendering (decode, draw and encode) runs on the render pool, so it never
+    blocks the event loop. Renders are cached per output format.
+
+    Args:
+        image_hash: Content hash of the original image
+        image_data: Original image as bytes
+        boxes: Bounding boxes to draw
+        output_format: Encoded format (JPEG by default)
+
+    Returns:
+        bytes: Processed image in the requested format
+
+    Raises:
+        HTTPException: 429 if the render pool is saturated
+    """
+    cache = get_detection_cache()
+    cache_key = get_detector().cache_key(image_hash)
+    rendered = await cache.get_rendered(cache_key, output_format)
+    if rendered is None:
         try:
-            with open(processed_image_path, "wb") as f:
-                f.write(processed_image_data)
-        except IOError as e:
-            logger.error(f"Failed to save processed image: {e}")
+            started = time.perf_counter()
+            rendered, timings = await get_render_pool().run(
+                render_detection_image, image_data, boxes, output_format)
+            observe_stage("render", time.perf_counter() - started)
+            for stage, seconds in timings.items():
+                observe_stage(stage, seconds)
+        except RenderPoolSaturated as e:
+            logger.warning(str(e))
             raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to save processed image"
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Image rendering is at capacity, please retry shortly",
+                headers={"Retry-After": "1"}
             )
+        await cache.put_rendered(cache_key, rendered, output_format)
+    return rendered
+
+
+def persist_detections(record: ImageRecord, image_hash: str,
+                       image_data: bytes,
+                       boxes: List[BoundingBox]) -> DetectionRecord:
+    """
+    Store the detections of an image in the image index.
+
+    Args:
+        record: The indexed image
+        image_hash: Content hash of the image
+        image_data: The original image bytes (for its pixel size)
+        boxes: Detected boxes in original image coordinates
+
+    Returns:
+        DetectionRecord: The stored detections
+    """
+    size = image_size(image_data)
+    detection = DetectionRecord(
+        image_id=record.id,
+        detector_key=get_detector().cache_key(image_hash),
+        boxes=[box.model_dump() for box in boxes],
+        width=size[0] if size else None,
+        height=size[1] if size else None,
+    )
+    get_image_index().set_detections(detection)
+    return detection
+
+
+def load_stored_detections(record: ImageRecord) -> \
+        Optional[DetectionRecord]:
+    """
+    Return the stored detections of a record, if they are still valid.
+
+    Stored detections are valid for the image content and detector they
+    were produced with; a changed original (which clears the hash) or a
+    different detector backend makes them stale.
+
+    Args:
+        record: The indexed image
+
+    Returns:
+        DetectionRecord | None: The stored detections, if valid
+    """
+    if not record.hash:
+        return None
+    detection = get_image_index().get_detections(record.id)
+    if detection is None or \
+            detection.detector_key != get_detector().cache_key(record.hash):
+        return None
+    return detection
+
+
+def load_persisted_render(record: ImageRecord) -> Optional[bytes]:
+    """
+    Return the processed image saved for a record, if it is still valid.
+
+    The saved file is valid when it exists, is not empty and is not older
+    than the original (an original replaced after processing needs a new
+    render).
+
+    Args:
+        record: The indexed image
+
+    Returns:
+        bytes | None: The processed image, or None if it must be rendered
+    """
+    if not record.processed_path or not record.original_path:
+        return None
+    storage = get_storage()
+    try:
+        processed = storage.stat(record.processed_path)
+        original = storage.stat(record.original_path)
+        if processed is None or original is None or processed.size == 0 or \
+                processed.mtime < original.mtime:
+            return None
+        return storage.read(record.processed_path)
+    except OSError:
+        return None
+
+
+def read_original(record: ImageRecord) -> bytes:
+    """
+    Read the original bytes of an uploaded image.
+
+    Args:
+        record: The indexed image
+
+    Returns:
+        bytes: The original image
+
+    Raises:
+        HTTPException: 500 if the file cannot be read
+    """
+    try:
+        with stage_timer("read"):
+            return get_storage().read(record.original_path)
+    except IOError as e:
+        logger.error(f"Failed to read image file {record.original_path}: "
+                     f"{e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to read image file"
+        )
+
+
+async def detect_and_render(record: ImageRecord,
+                            image_data: Optional[bytes] = None) -> bytes:
+    """
+    Detect objects in an image, draw them and persist the processed image.
+
+    Args:
+        record: The indexed image
+        image_data: The image bytes if already in memory (skips the disk
+                    read)
+
+    Returns:
+        bytes: The processed image
+
+    Raises:
+        HTTPException: If reading, detection, rendering or saving fails
+    """
+    # Read the image file unless the caller already has the bytes
+    if image_data is None:
+        image_data = await storage_call(read_original, record)
+
+    # Detect objects (cached by image content hash)
+    image_hash, boxes = await get_detections_for_image(
+        image_data, record.hash)
+    if record.hash != image_hash:
+        await asyncio.to_thread(get_image_index().update, record.id,
+                                hash=image_hash)
+    await asyncio.to_thread(persist_detections, record, image_hash,
+                            image_data, boxes)
+
+    # Draw bounding boxes on the image (or reuse the cached render)
+    processed_image_data = await render_detections(
+        image_hash, image_data, boxes)
+
+    # Save it atomically so concurrent readers never see a partial file
+    processed_key = str(PROCESSED_DIR / f"{PROCESSED_PREFIX}{record.id}")
+    try:
+        with stage_timer("save"):
+            await storage_call(get_storage().write, processed_key,
+                               processed_image_data)
+        await asyncio.to_thread(get_image_index().set_processed, record.id,
+                                processed_key)
+    except IOError as e:
+        logger.error(f"Failed to save processed image: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to save processed image"
+        )
 
-        logger.info(f"Successfully detected {len(boxes)} objects in "
-                    f"image {image_id} and saved processed image")
-        
-        # Return only the URL to the processed image
+    # Thumbnails are a convenience; the listing falls back to generating
+    # them lazily if this fails
+    try:
+        await ensure_derivatives(processed_key, processed_image_data)
+    except (RenderPoolSaturated, OSError) as e:
+        logger.warning(f"Failed to generate derivatives for image "
+                       f"{record.id}: {e}")
+
+    logger.info(f"Successfully detected {len(boxes)} objects in "
+                f"image {record.id} and saved processed image")
+    return processed_image_data
+
+
+# Concurrent requests for the same image share one detection and render
+_render_flights = SingleFlight()
+
+
+async def get_processed_image(record: ImageRecord,
+                              image_data: Optional[bytes] = None) -> bytes:
+    """
+    Return the processed image for a record, rendering it at most once.
+
+    A valid persisted processed image is reused as-is. Otherwise concurrent
+    misses for the same image are coalesced, so a burst of requests causes
+    a single Azure call and a single render.
+
+    Args:
+        record: The indexed image
+        image_data: The image bytes if already in memory
+
+    Returns:
+        bytes: The processed image
+    """
+    with stage_timer("load_persisted"):
+        persisted = await storage_call(load_persisted_render, record)
+    if persisted is not None:
+        return persisted
+    return await _render_flights.do(
+        record.id, lambda: detect_and_render(record, image_data))
+
+
+async def render_variant(record: ImageRecord, output_format: str) -> bytes:
+    """
+    Render the processed image of a record in a non-default format.
+
+    Detections come from the cache when the image was processed before, so
+    only the draw and encode steps run again.
+
+    Args:
+        record: The indexed image
+        output_format: Encoded format
+
+    Returns:
+        bytes: The processed image in ``output_format``
+    """
+    image_data = await storage_call(read_original, record)
+    image_hash, boxes = await get_detections_for_image(
+        image_data, record.hash)
+    if record.hash != image_hash:
+        await asyncio.to_thread(get_image_index().update, record.id,
+                                hash=image_hash)
+    return await render_detections(image_hash, image_data, boxes,
+                                   output_format)
+
+
+async def get_processed_variant(record: ImageRecord,
+                                output_format: str) -> bytes:
+    """
+    Return the processed image for a record in the given format.
+
+    JPEG is the saved processed file; other formats are cached per format
+    and rendered at most once for concurrent requests.
+
+    Args:
+        record: The indexed image
+        output_format: Encoded format
+
+    Returns:
+        bytes: The processed image in ``output_format``
+    """
+    if output_format == DEFAULT_FORMAT:
+        return await get_processed_image(record)
+    if record.hash:
+        cached = await get_detection_cache().get_rendered(
+            get_detector().cache_key(record.hash), output_format)
+        if cached is not None:
+            return cached
+    return await _render_flights.do(
+        f"{record.id}:{output_format}",
+        lambda: render_variant(record, output_format))
+
+
+async def detect_boxes(record: ImageRecord) -> DetectionRecord:
+    """
+    Detect objects in an image and store the boxes, without rendering.
+
+    Args:
+        record: The indexed image
+
+    Returns:
+        DetectionRecord: The stored detections
+    """
+    image_data = await storage_call(read_original, record)
+    image_hash, boxes = await get_detections_for_image(
+        image_data, record.hash)
+    if record.hash != image_hash:
+        await asyncio.to_thread(get_image_index().update, record.id,
+                                hash=image_hash)
+        record.hash = image_hash
+    return await asyncio.to_thread(persist_detections, record, image_hash,
+                                   image_data, boxes)
+
+
+async def process_detection(image_id: str,
+                            image_data: Optional[bytes] = None) -> \
+        DetectionResponse:
+    """
+    Detect objects in an uploaded image and save the processed image.
+
+    Shared by the single-image, batch and job-based detection endpoints.
+
+    Args:
+        image_id: The filename/ID of the uploaded image
+        image_data: The image bytes if already in memory (skips the disk
+                    read)
+
+    Returns:
+        DetectionResponse: URL to the processed image
+
+    Raises:
+        HTTPException: If image not found or detection fails
+    """
+    try:
+        # Resolve the image through the index (no directory scan)
+        with stage_timer("resolve"):
+            record = await storage_call(find_uploaded_image, image_id)
+        processed_image_data = await get_processed_image(record, image_data)
+
+        # Return only the URL to the processed image; the version in the
+        # URL (the stored file's ETag) lets browsers cache it as immutable
+        processed_key = str(PROCESSED_DIR / f"{PROCESSED_PREFIX}{record.id}")
+        stored = await storage_call(get_storage().stat, processed_key)
+        if stored is not None and stored.etag:
+            etag = stored.etag
+        else:
+            etag = await asyncio.to_thread(strong_etag, processed_image_data)
         return DetectionResponse(
-            processed_image_url=f"/api/processed_uploads/processed_{image_id}"
+            processed_image_url=versioned_url(
+                f"/api/processed_uploads/{PROCESSED_PREFIX}{record.id}",
+                etag),
+            boxes_url=f"/api/detections/{record.id}/boxes"
         )
 
     except HTTPException:
@@ -253,6 +658,101 @@ async def detect_objects(image_id: str):
         )
 
 
+@router.get("/detections/{image_id}", response_model=DetectionResponse)
+async def detect_objects(image_id: str):
+    """
+    Analyze an uploaded image for object detection using Azure Computer Vision.
+
+    Args:
+        image_id: The filename/ID of the uploaded image
+
+    Returns:
+        DetectionResponse: Normalized object detection results and URL to processed image
+
+    Raises:
+        HTTPException: If image not found or detection fails
+    """
+    return await process_detection(image_id)
+
+
+async def _run_detection_job(job: Job) -> Dict[str, Any]:
+    """Job handler running a detection in the background."""
+    result = await process_detection(job.payload["image_id"], job.data)
+    return result.model_dump()
+
+
+get_job_manager().register("detection", _run_detection_job)
+
+
+@router.post("/detections/{image_id}/jobs",
+             status_code=status.HTTP_202_ACCEPTED)
+async def create_detection_job(image_id: str):
+    """
+    Queue object detection for an uploaded image and return immediately.
+
+    Poll ``status_url`` (or follow ``events_url`` as server-sent events)
+    until the job has ``succeeded`` or ``failed``; on success the job
+    result holds the ``processed_image_url``.
+
+    Args:
+        image_id: The filename/ID of the uploaded image
+
+    Returns:
+        dict: Job ID, status and URLs to follow the job
+
+    Raises:
+        HTTPException: If the image does not exist
+    """
+    record = await storage_call(find_uploaded_image, image_id)
+    job = await get_job_manager().submit("detection", {"image_id": record.id})
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events",
+    }
+
+
+@router.post("/detections/batch")
+async def detect_objects_batch(batch: BatchDetectionRequest):
+    """
+    Run object detection on many uploaded images in one request.
+
+    Images are processed concurrently (at most ``BATCH_DETECTION_CONCURRENCY``
+    at a time, with Azure calls paced by the shared rate limiter). One JSON
+    line is streamed back per image as soon as it completes, in completion
+    order.
+
+    Args:
+        batch: The IDs of the images to analyze
+
+    Returns:
+        StreamingResponse: NDJSON lines with either ``processed_image_url``
+                           or ``error`` for each image
+    """
+    # Drop duplicate IDs while keeping the requested order
+    image_ids = list(dict.fromkeys(batch.image_ids))
+
+    async def results():
+        async for image_id, result, error in bounded_as_completed(
+                image_ids, process_detection, BATCH_DETECTION_CONCURRENCY):
+            if error is None:
+                line = {"image_id": image_id, "status": "ok",
+                        "processed_image_url": result.processed_image_url}
+            elif isinstance(error, HTTPException):
+                line = {"image_id": image_id, "status": "error",
+                        "status_code": error.status_code,
+                        "error": error.detail}
+            else:
+                logger.error(f"Batch detection failed for {image_id}: {error}")
+                line = {"image_id": image_id, "status": "error",
+                        "status_code": 500,
+                        "error": "Object detection failed"}
+            yield json.dumps(line) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
 def draw_bounding_boxes_on_image(image_data: bytes, boxes: List[BoundingBox]) -> bytes:
     """
     Draw bounding boxes on an image and return the modified image as bytes.
@@ -264,156 +764,149 @@ def draw_bounding_boxes_on_image(image_data: bytes, boxes: List[BoundingBox]) ->
     Returns:
         bytes: Modified image with bounding boxes drawn
     """
-    # Open the image
-    image = Image.open(io.BytesIO(image_data))
-
-    # Convert to RGB if necessary (for JPEG output)
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
-
-    # Create a drawing context
-    draw = ImageDraw.Draw(image)
-
-    # Get image dimensions
-    img_width, img_height = image.size
-
-    # Define colors for different object types
-    colors = [
-        '#FF0000',  # Red
-        '#00FF00',  # Green
-        '#0000FF',  # Blue
-        '#FFFF00',  # Yellow
-        '#FF00FF',  # Magenta
-        '#00FFFF',  # Cyan
-        '#FFA500',  # Orange
-        '#800080',  # Purple
-        '#FFC0CB',  # Pink
-        '#A52A2A',  # Brown
-    ]
-
-    # Try to load a font, fall back to default if not available
-    try:
-        # Try to use a larger font for better visibility
-        font = ImageFont.truetype("arial.ttf", 16)
-    except (OSError, IOError):
-        try:
-            # Try default font
-            font = ImageFont.load_default()
-        except:
-            font = None
-
-    # Draw each bounding box
-    for i, box in enumerate(boxes):
-        # Convert normalized coordinates to pixel coordinates
-        # Note: Azure CV returns absolute pixel coordinates, not normalized
-        x1 = int(box.x)
-        y1 = int(box.y)
-        x2 = int(box.x + box.w)
-        y2 = int(box.y + box.h)
-
-        # Choose color based on object index
-        color = colors[i % len(colors)]
-
-        # Draw the bounding box rectangle
-        draw.rectangle([x1, y1, x2, y2], outline=color, width=3)
-
-        # Prepare label text
-        label_text = f"{box.label} ({box.score:.2f})"
-
-        # Calculate text size and position
-        if font:
-            bbox = draw.textbbox((0, 0), label_text, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-        else:
-            # Estimate text size if no font available
-            text_width = len(label_text) * 8
-            text_height = 12
-
-        # Position label above the box, or below if there's no space above
-        label_x = x1
-        label_y = y1 - text_height - 5 if y1 - text_height - 5 > 0 else y2 + 5
-
-        # Draw background rectangle for text
-        draw.rectangle(
-            [label_x, label_y, label_x + text_width + 4, label_y + text_height + 4],
-            fill=color,
-            outline=color
-        )
+    return render_detection_image(image_data, boxes)[0]
 
-        # Draw the text
-        draw.text(
-            (label_x + 2, label_y + 2),
-            label_text,
-            fill='white',
-            font=font
-        )
 
-    # Save the modified image to bytes
-    output_buffer = io.BytesIO()
-    image.save(output_buffer, format='JPEG', quality=95)
-    output_buffer.seek(0)
+def render_detection_image(image_data: bytes, boxes: List[BoundingBox],
+                           output_format: str = DEFAULT_FORMAT) -> \
+        Tuple[bytes, Dict[str, float]]:
+    """
+    Draw bounding boxes on an image and report how long each step took.
+
+    Runs in render pool workers, which may be separate processes, so the
+    step timings are returned for the caller to record.
+
+    Args:
+        image_data: Original image as bytes
+        boxes: List of bounding boxes to draw
+        output_format: Encoded format (JPEG by default)
 
-    return output_buffer.getvalue()
+    Returns:
+        tuple: The encoded image and seconds spent in the ``decode``,
+               ``draw`` and ``encode`` steps
+    """
+    return render_boxes(image_data, boxes, output_format=output_format)
 
 
-@router.get("/detections/{image_id}/image")
-async def get_image_with_detections(image_id: str):
+@router.get("/detections/{image_id}/boxes",
+            response_model=DetectionBoxesResponse)
+async def get_detection_boxes(image_id: str, request: Request):
     """
-    Analyze an uploaded image for object detection and return the image with bounding boxes drawn.
+    Return the bounding boxes detected in an uploaded image as JSON.
+
+    Boxes are in original image pixels, so clients can draw them over the
+    original (or a scaled derivative) themselves. Stored detections are
+    served straight from the image index; otherwise the image is detected
+    once (the detection cache still applies) and nothing is rendered.
 
     Args:
         image_id: The filename/ID of the uploaded image
+        request: Incoming request (for conditional headers)
 
     Returns:
-        StreamingResponse: Image with bounding boxes drawn on it
+        Response: Image size and boxes as JSON, or 304 Not Modified
 
     Raises:
         HTTPException: If image not found or detection fails
     """
     try:
-        # Find the image file in the upload directory
-        image_path = None
-        for file_path in UPLOAD_DIR.iterdir():
-            if file_path.is_file() and image_id in file_path.name:
-                image_path = file_path
-                break
-
-        if not image_path or not image_path.exists():
-            logger.error(f"Image not found: {image_id}")
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Image with ID '{image_id}' not found"
-            )
+        with stage_timer("resolve"):
+            record = await storage_call(find_uploaded_image, image_id)
+
+        detection = await asyncio.to_thread(load_stored_detections, record)
+        if detection is None:
+            detection = await _render_flights.do(
+                f"{record.id}:boxes", lambda: detect_boxes(record))
+
+        payload = DetectionBoxesResponse(
+            image_id=record.id,
+            width=detection.width,
+            height=detection.height,
+            boxes=[BoundingBox(**box) for box in detection.boxes],
+        ).model_dump()
+        body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        etag = strong_etag(body)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return not_modified_response(etag, REVALIDATE_CACHE_CONTROL)
+        return Response(content=body, media_type="application/json", headers={
+            "ETag": etag,
+            "Cache-Control": REVALIDATE_CACHE_CONTROL,
+        })
 
-        # Read the image file
-        try:
-            with open(image_path, "rb") as f:
-                image_data = f.read()
-        except IOError as e:
-            logger.error(f"Failed to read image file {image_path}: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to read image file"
-            )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error in object detection: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Object detection failed due to an unexpected error"
+        )
 
-        # Call Azure Computer Vision API
-        azure_response = await call_azure_computer_vision(image_data)
 
-        # Normalize the response
-        boxes = normalize_detection_response(azure_response)
+@router.get("/detections/{image_id}/image")
+async def get_image_with_detections(image_id: str, request: Request):
+    """
+    Analyze an uploaded image for object detection and return the image with bounding boxes drawn.
+
+    The response carries a strong ETag of the rendered image. A request whose
+    ``If-None-Match`` matches a render still held in the cache is answered
+    with 304 without reading the file, calling Azure or redrawing.
 
-        # Draw bounding boxes on the image
-        processed_image_data = draw_bounding_boxes_on_image(image_data, boxes)
+    Args:
+        image_id: The filename/ID of the uploaded image
+        request: Incoming request (for conditional headers)
 
-        logger.info(f"Successfully processed image {image_id} with {len(boxes)} objects")
+    Returns:
+        Response: Image with bounding boxes drawn on it, or 304 Not Modified
 
-        # Return the processed image
-        return StreamingResponse(
-            io.BytesIO(processed_image_data),
-            media_type="image/jpeg",
-            headers={"Content-Disposition": f"inline; filename=processed_{image_id}"}
-        )
+    Raises:
+        HTTPException: If image not found or detection fails
+    """
+    try:
+        # Resolve the image through the index (no directory scan)
+        with stage_timer("resolve"):
+            record = await storage_call(find_uploaded_image, image_id)
+        last_modified = record.uploaded_at or record.mtime
+
+        # Pick WebP/AVIF/JPEG from the Accept header
+        output_format = FORMATS[negotiate_format(
+            request.headers.get("accept"))]
+
+        # Conditional GET: revalidate against the cached render's ETag
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and record.hash:
+            cached_etag = get_detection_cache().peek_rendered_etag(
+                get_detector().cache_key(record.hash), output_format.name)
+            if cached_etag and etag_matches(if_none_match, cached_etag):
+                return not_modified_response(
+                    cached_etag, REVALIDATE_CACHE_CONTROL, last_modified,
+                    vary="Accept")
+
+        # Reuse the persisted or cached render, or detect and render once
+        processed_image_data = await get_processed_variant(
+            record, output_format.name)
+
+        etag = await asyncio.to_thread(strong_etag, processed_image_data)
+        if etag_matches(if_none_match, etag):
+            return not_modified_response(etag, REVALIDATE_CACHE_CONTROL,
+                                         last_modified, vary="Accept")
+
+        filename = f"{PROCESSED_PREFIX}{record.id}"
+        if output_format.name != DEFAULT_FORMAT:
+            filename = f"{PROCESSED_PREFIX}{Path(record.id).stem}." \
+                f"{output_format.extension}"
+
+        # Return the processed image (already in memory, so no streaming)
+        headers = {
+            "Content-Disposition": f"inline; filename={filename}",
+            "ETag": etag,
+            "Cache-Control": REVALIDATE_CACHE_CONTROL,
+            "Vary": "Accept",
+        }
+        if last_modified:
+            headers["Last-Modified"] = http_date(last_modified)
+        return Response(content=processed_image_data,
+                        media_type=output_format.media_type, headers=headers)
 
     except HTTPException:
         # Re-raise HTTP exceptions as-is
@@ -0,0 +1,72 @@
+"""
+Stored file endpoints for remote storage backends.
+
+With local storage, ``/api/uploads`` and ``/api/processed_uploads`` are
+static mounts. With a remote backend these routes take their place at the
+same URLs: they redirect to a presigned URL, or stream the file through the
+service when presigning is disabled.
+"""
+
+import mimetypes
+from pathlib import PurePosixPath
+
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import RedirectResponse, StreamingResponse
+
+from app.utils.http_caching import REVALIDATE_CACHE_CONTROL
+from app.utils.metrics import InstrumentedRoute
+from app.utils.storage import PROCESSED_DIR, UPLOAD_DIR, get_storage, \
+    storage_call
+
+router = APIRouter(route_class=InstrumentedRoute)
+
+
+async def serve_stored_file(directory: str, file_path: str):
+    """
+    Serve a stored file by redirect or by streaming it.
+
+    Args:
+        directory: Key prefix of the file
+        file_path: Path of the file below the prefix
+
+    Returns:
+        Response: 307 to a presigned URL, or the streamed file
+
+    Raises:
+        HTTPException: 404 if the path is invalid or the file does not exist
+    """
+    parts = PurePosixPath(file_path).parts
+    if not parts or any(part in ("", "..") or part.startswith(".")
+                        for part in parts):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Not Found")
+    key = f"{directory}/{file_path}"
+    storage = get_storage()
+
+    presigned = storage.presigned_url(key)
+    if presigned:
+        return RedirectResponse(presigned, status_code=307)
+
+    stored = await storage_call(storage.stat, key)
+    if stored is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Not Found")
+    media_type = mimetypes.guess_type(stored.name)[0] or \
+        "application/octet-stream"
+    return StreamingResponse(storage.iter_read(key), media_type=media_type,
+                             headers={
+                                 "Content-Length": str(stored.size),
+                                 "Cache-Control": REVALIDATE_CACHE_CONTROL,
+                             })
+
+
+@router.get("/uploads/{file_path:path}")
+async def get_uploaded_file(file_path: str):
+    """Serve an uploaded original from storage."""
+    return await serve_stored_file(str(UPLOAD_DIR), file_path)
+
+
+@router.get("/processed_uploads/{file_path:path}")
+async def get_processed_file(file_path: str):
+    """Serve a processed image or derivative from storage."""
+    return await serve_stored_file(str(PROCESSED_DIR), file_path)
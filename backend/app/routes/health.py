@@ -2,9 +2,22 @@
 Health check endpoint for monitoring the service status.
 """
 
+import os
+
 from fastapi import APIRouter
 
-router = APIRouter()
+from app.utils.cleanup import get_garbage_collector
+from app.utils.detection_cache import get_detection_cache
+from app.utils.detectors import get_detector
+from app.utils.http_client import get_pool_stats
+from app.utils.jobs import get_job_manager
+from app.utils.metrics import InstrumentedRoute
+from app.utils.rate_limiter import get_azure_rate_limiter
+from app.utils.render_pool import get_render_pool
+from app.utils.shared_state import get_shared_state, shared_state_enabled, \
+    worker_count
+
+router = APIRouter(route_class=InstrumentedRoute)
 
 
 @router.get("/health")
@@ -16,3 +29,30 @@ async def health_check():
         dict: Status information indicating the service is healthy
     """
     return {"status": "ok"}
+
+
+@router.get("/health/stats")
+async def health_stats():
+    """
+    Runtime statistics for shared resources.
+
+    Returns:
+        dict: Connection-pool usage of the shared HTTP client, detection
+              cache hit/miss counters, detector backend, render pool
+              occupancy, Azure rate limiter usage, job queue state, the
+              last garbage collection and the worker process that answered
+    """
+    workers = {"pid": os.getpid(), "count": worker_count(),
+               "shared_state": shared_state_enabled()}
+    if workers["shared_state"]:
+        workers.update(get_shared_state().stats())
+    return {
+        "workers": workers,
+        "http_client": get_pool_stats(),
+        "detection_cache": get_detection_cache().stats(),
+        "detector": get_detector().stats(),
+        "render_pool": get_render_pool().stats(),
+        "azure_rate_limiter": get_azure_rate_limiter().stats(),
+        "jobs": await get_job_manager().stats(),
+        "gc": get_garbage_collector().stats(),
+    }
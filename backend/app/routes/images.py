@@ -1,65 +1,219 @@
-from fastapi import APIRouter, Query, HTTPException, status
-from typing import List, Optional
+from fastapi import APIRouter, Query, HTTPException, Request, status
+from fastapi.responses import RedirectResponse, Response
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import base64
+import json
 import os
 from datetime import datetime
 from pathlib import Path
 
-router = APIRouter()
+from app.utils.cleanup import delete_images, get_garbage_collector, \
+    purge_image
+from app.utils.derivatives import DERIVATIVE_SIZES, derivative_path, \
+    derivative_url, ensure_derivatives, fresh_derivative
+from app.utils.http_caching import REVALIDATE_CACHE_CONTROL, etag_matches, \
+    not_modified_response, strong_etag
+from app.utils.image_index import ImageRecord, get_image_index
+from app.utils.jobs import Job, get_job_manager
+from app.utils.metrics import InstrumentedRoute
+from app.utils.render_pool import RenderPoolSaturated
+from app.utils.storage import PROCESSED_DIR, UPLOAD_DIR, get_storage, \
+    storage_call
+
+router = APIRouter(route_class=InstrumentedRoute)
+
+UPLOADS_DIR = PROCESSED_DIR
+ORIGINAL_UPLOADS_DIR = UPLOAD_DIR
+
+# Bulk deletes remove this many images per worker-thread hop
+BULK_DELETE_BATCH_SIZE = int(os.getenv("BULK_DELETE_BATCH_SIZE", "200"))
+BULK_DELETE_MAX_IDS = int(os.getenv("BULK_DELETE_MAX_IDS", "1000"))
+
+
+class BulkDeleteRequest(BaseModel):
+    """Images to delete, by ID or by upload time."""
+    ids: Optional[List[str]] = Field(default=None, min_length=1,
+                                     max_length=BULK_DELETE_MAX_IDS)
+    older_than: Optional[datetime] = None
+
+
+def encode_cursor(record: ImageRecord) -> str:
+    """Encode the listing position of an image as an opaque cursor."""
+    raw = json.dumps([record.uploaded_at, record.id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """
+    Decode a cursor produced by :func:`encode_cursor`.
+
+    Raises:
+        HTTPException: If the cursor is malformed
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        uploaded_at, image_id = json.loads(base64.urlsafe_b64decode(padded))
+        return float(uploaded_at), str(image_id)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
+
+
+def image_list_item(record: ImageRecord) -> dict:
+    """
+    Build the listing entry for a processed image.
+
+    URLs are built from the index record alone, without storage lookups.
+    With a remote storage backend files are linked by presigned URL.
+    Derivatives the index records as up to date are linked directly; other
+    derivatives point at the endpoint that serves them (generating them on
+    first request).
+    """
+    storage = get_storage()
+    filename = Path(record.processed_path).name
+    image_id = Path(filename).stem  # Processed filename without extension
+    item = {
+        "id": image_id,
+        "filename": filename,
+        "uploadDate": datetime.fromtimestamp(record.uploaded_at).isoformat(),
+        "url": storage.presigned_url(record.processed_path) or
+        f"/api/processed_uploads/{filename}"
+    }
+    fresh = record.derivatives_fresh
+    for name in DERIVATIVE_SIZES:
+        if fresh:
+            url = storage.presigned_url(
+                str(derivative_path(record.processed_path, name))) or \
+                derivative_url(record.processed_path, name)
+        else:
+            url = f"/api/images/{image_id}/derivatives/{name}"
+        item[f"{name}_url"] = url
+    return item
 
-UPLOADS_DIR = Path("processed_uploads")
-ORIGINAL_UPLOADS_DIR = Path("uploads")
 
 @router.get("/images")
 async def list_images(
     page: int = Query(default=1, ge=1),
-    page_size: int = Query(default=10, ge=1, le=100)
+    page_size: int = Query(default=10, ge=1, le=100),
+    after: Optional[str] = Query(default=None)
 ):
     """
-    Get a paginated list of all processed images
+    Get a paginated list of all processed images, newest upload first.
+
+    Pages are read from the image index, in a worker thread. Pass the
+    ``next_cursor`` of a response as ``after`` for keyset pagination, which
+    costs the same on every page; otherwise ``page`` selects the page by
+    offset.
     """
     try:
-        # Ensure uploads directory exists
-        if not UPLOADS_DIR.exists():
-            return {"items": [], "total": 0, "page": page, "page_size": page_size}
-        
-        # List all files in processed_uploads directory
-        all_files = []
-        for file_path in UPLOADS_DIR.glob("*"):
-            if file_path.is_file() and file_path.suffix.lower() in [".jpg", ".jpeg", ".png"]:
-                stats = file_path.stat()
-                all_files.append({
-                    "id": str(file_path.stem),  # Using filename without extension as ID
-                    "filename": file_path.name,
-                    "uploadDate": datetime.fromtimestamp(stats.st_mtime).isoformat(),
-                    "url": f"/api/processed_uploads/{file_path.name}"
-                })
-        
-        # Sort files by upload date (newest first)
-        all_files.sort(key=lambda x: x["uploadDate"], reverse=True)
-        
-        # Calculate pagination
-        total_items = len(all_files)
-        start_idx = (page - 1) * page_size
-        end_idx = start_idx + page_size
-        
-        # Get paginated items
-        items = all_files[start_idx:end_idx]
-        
+        index = get_image_index()
+
+        if after is not None:
+            records = await asyncio.to_thread(
+                index.list_processed, page_size, after=decode_cursor(after))
+        else:
+            records = await asyncio.to_thread(
+                index.list_processed, page_size,
+                offset=(page - 1) * page_size)
+
+        items = [image_list_item(record) for record in records]
+        next_cursor = None
+        if len(records) == page_size:
+            next_cursor = encode_cursor(records[-1])
+
         return {
             "items": items,
-            "total": total_items,
+            "total": await asyncio.to_thread(index.count_processed),
             "page": page,
-            "page_size": page_size
+            "page_size": page_size,
+            "next_cursor": next_cursor
         }
-        
+
+    except HTTPException:
+        raise
     except Exception as e:
         return {"error": str(e)}
 
 
+@router.get("/images/{image_id}/derivatives/{name}")
+async def get_image_derivative(image_id: str, name: str, request: Request):
+    """
+    Get a thumbnail or preview of a processed image.
+
+    Derivatives are generated and saved on first request if image processing
+    did not already create them; later listings link the saved files. Saved
+    derivatives in remote storage are served by redirect to a presigned URL.
+
+    Args:
+        image_id: The ID of the image
+        name: Derivative name (``thumbnail`` or ``preview``)
+        request: Incoming request (for conditional headers)
+
+    Returns:
+        Response: The derivative as JPEG, a redirect to it, or 304 Not
+                  Modified
+
+    Raises:
+        HTTPException: If the image, its processed version or the derivative
+                       name does not exist, or generation fails
+    """
+    if name not in DERIVATIVE_SIZES:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown derivative '{name}'"
+        )
+
+    storage = get_storage()
+    record = await asyncio.to_thread(get_image_index().resolve, image_id)
+    if record is None or not record.processed_path or \
+            not await storage_call(storage.exists, record.processed_path):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Processed image with ID '{image_id}' not found"
+        )
+
+    try:
+        path = await storage_call(fresh_derivative, record.processed_path,
+                                  name)
+        presigned = storage.presigned_url(str(path)) if path else None
+        if presigned:
+            return RedirectResponse(presigned, status_code=307)
+        if path is not None:
+            data = await storage_call(storage.read, str(path))
+        else:
+            data = (await ensure_derivatives(record.processed_path))[name]
+    except RenderPoolSaturated:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Image rendering is at capacity, please retry shortly",
+            headers={"Retry-After": "1"}
+        )
+    except OSError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to generate {name}: {str(e)}"
+        )
+
+    etag = strong_etag(data)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified_response(etag, REVALIDATE_CACHE_CONTROL)
+    return Response(content=data, media_type="image/jpeg", headers={
+        "ETag": etag,
+        "Cache-Control": REVALIDATE_CACHE_CONTROL,
+    })
+
+
 @router.delete("/images/{image_id}")
 async def delete_image(image_id: str):
     """
     Delete an image by ID. This will remove both the original and processed versions.
+
+    An image that several uploads resolved to only loses one reference; its
+    files are removed with the last one.
     
     Args:
         image_id: The ID of the image to delete (filename without extension)
@@ -71,36 +225,38 @@ async def delete_image(image_id: str):
         HTTPException: If image not found or deletion fails
     """
     try:
-        # Find and delete processed image
-        processed_deleted = False
-        original_deleted = False
-        
-        # Look for processed image
-        for file_path in UPLOADS_DIR.glob("*"):
-            if file_path.is_file() and (file_path.stem == image_id or image_id in file_path.name):
-                try:
-                    file_path.unlink()
-                    processed_deleted = True
-                    break
-                except OSError as e:
-                    raise HTTPException(
-                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                        detail=f"Failed to delete processed image: {str(e)}"
-                    )
-        
-        # Look for original image in uploads directory
-        for file_path in ORIGINAL_UPLOADS_DIR.glob("*"):
-            if file_path.is_file() and image_id in file_path.name:
-                try:
-                    file_path.unlink()
-                    original_deleted = True
-                    break
-                except OSError as e:
-                    raise HTTPException(
-                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                        detail=f"Failed to delete original image: {str(e)}"
-                    )
-        
+        # Resolve the image through the index (no directory scan)
+        index = get_image_index()
+        record = await asyncio.to_thread(index.resolve, image_id)
+        if record is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Image with ID '{image_id}' not found"
+            )
+
+        # Images shared by duplicate uploads keep their files until the
+        # last reference is deleted
+        references_remaining = await asyncio.to_thread(index.release,
+                                                       record.id)
+        if references_remaining > 0:
+            return {
+                "message": f"Image '{image_id}' deleted successfully",
+                "processed_deleted": False,
+                "original_deleted": False,
+                "references_remaining": references_remaining
+            }
+
+        # Delete processed image, its thumbnails and the original
+        try:
+            result = await storage_call(purge_image, record)
+        except OSError as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to delete image files: {str(e)}"
+            )
+        processed_deleted = result["processed_deleted"]
+        original_deleted = result["original_deleted"]
+
         # Check if any files were deleted
         if not processed_deleted and not original_deleted:
             raise HTTPException(
@@ -111,7 +267,8 @@ async def delete_image(image_id: str):
         return {
             "message": f"Image '{image_id}' deleted successfully",
             "processed_deleted": processed_deleted,
-            "original_deleted": original_deleted
+            "original_deleted": original_deleted,
+            "references_remaining": 0
         }
         
     except HTTPException:
@@ -121,4 +278,126 @@ async def delete_image(image_id: str):
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to delete image: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+
+def _merge_totals(totals: Dict[str, Any], batch: Dict[str, Any]) -> None:
+    for key in ("deleted", "released", "bytes_reclaimed"):
+        totals[key] += batch[key]
+    totals["failed"].extend(batch["failed"])
+
+
+async def _run_bulk_delete(job: Job) -> Dict[str, Any]:
+    """Job handler deleting images in batches."""
+    index = get_image_index()
+    totals: Dict[str, Any] = {"deleted": 0, "released": 0, "failed": [],
+                              "bytes_reclaimed": 0}
+    if "ids" in job.payload:
+        ids = job.payload["ids"]
+        for start in range(0, len(ids), BULK_DELETE_BATCH_SIZE):
+            batch = ids[start:start + BULK_DELETE_BATCH_SIZE]
+            records = await asyncio.to_thread(
+                lambda: [record for record in map(index.get, batch)
+                         if record is not None])
+            _merge_totals(totals, await asyncio.to_thread(
+                delete_images, records, True))
+        return totals
+
+    # Filter: page through matching images in upload order; deleted images
+    # drop out of the index, failed ones are stepped over
+    cutoff = job.payload["older_than"]
+    after = None
+    while True:
+        records = await asyncio.to_thread(
+            index.list_uploaded_before, cutoff, BULK_DELETE_BATCH_SIZE, after)
+        if not records:
+            return totals
+        _merge_totals(totals, await asyncio.to_thread(
+            delete_images, records, False))
+        after = (records[-1].uploaded_at, records[-1].id)
+
+
+async def _run_garbage_collection(job: Job) -> Dict[str, Any]:
+    """Job handler running a garbage collection."""
+    return await get_garbage_collector().run_once(force=True)
+
+
+get_job_manager().register("bulk_delete", _run_bulk_delete)
+get_job_manager().register("gc", _run_garbage_collection)
+
+
+def _job_response(job: Job) -> Dict[str, Any]:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events",
+    }
+
+
+@router.delete("/images", status_code=status.HTTP_202_ACCEPTED)
+async def delete_images_bulk(request: BulkDeleteRequest):
+    """
+    Delete many images in the background.
+
+    Give either ``ids`` (each loses one reference, like a single delete) or
+    ``older_than`` (every image uploaded before that time is removed,
+    whatever its references). IDs are resolved through the index now; the
+    files are removed by a background job in batches. Follow the job for
+    the number of images deleted and the bytes reclaimed.
+
+    Args:
+        request: The IDs or filter selecting the images
+
+    Returns:
+        dict: Number of images matched, IDs not found and the job to follow
+
+    Raises:
+        HTTPException: 400 unless exactly one of ``ids`` and ``older_than``
+                       is given
+    """
+    if (request.ids is None) == (request.older_than is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide either 'ids' or 'older_than'"
+        )
+
+    index = get_image_index()
+    not_found: List[str] = []
+    if request.ids is not None:
+        records = await asyncio.to_thread(
+            lambda: [index.resolve(image_id) for image_id in request.ids])
+        resolved: Dict[str, None] = {}  # Keeps order, drops duplicates
+        for image_id, record in zip(request.ids, records):
+            if record is None:
+                not_found.append(image_id)
+            else:
+                resolved[record.id] = None
+        payload: Dict[str, Any] = {"ids": list(resolved)}
+        matched = len(resolved)
+    else:
+        older_than = request.older_than
+        if older_than.tzinfo is None:
+            older_than = older_than.astimezone()  # Local time, like mtimes
+        payload = {"older_than": older_than.timestamp()}
+        matched = await asyncio.to_thread(index.count_uploaded_before,
+                                          payload["older_than"])
+
+    job = await get_job_manager().submit("bulk_delete", payload)
+    return {"matched": matched, "not_found": not_found,
+            **_job_response(job)}
+
+
+@router.post("/images/gc", status_code=status.HTTP_202_ACCEPTED)
+async def collect_garbage():
+    """
+    Run a garbage collection now instead of waiting for the next one.
+
+    The job result reports the files removed per kind and the bytes
+    reclaimed.
+
+    Returns:
+        dict: The job to follow
+    """
+    job = await get_job_manager().submit("gc", {})
+    return _job_response(job)
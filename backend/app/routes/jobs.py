@@ -0,0 +1,87 @@
+"""
+Status endpoints for background jobs.
+"""
+
+import asyncio
+import json
+import os
+
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
+
+from app.utils.jobs import TERMINAL_STATES, Job, get_job_manager
+from app.utils.metrics import InstrumentedRoute
+
+router = APIRouter(route_class=InstrumentedRoute)
+
+# How often the event stream checks for job updates (seconds)
+JOB_EVENTS_POLL_INTERVAL = float(os.getenv("JOB_EVENTS_POLL_INTERVAL", "0.25"))
+
+
+async def _get_job_or_404(job_id: str) -> Job:
+    job = await get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Job '{job_id}' not found"
+        )
+    return job
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Get the current state of a background job.
+
+    Args:
+        job_id: ID returned when the job was created
+
+    Returns:
+        dict: Job status, timestamps and result or error
+
+    Raises:
+        HTTPException: If the job does not exist (or has expired)
+    """
+    job = await _get_job_or_404(job_id)
+    return job.to_dict()
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """
+    Follow a background job as server-sent events.
+
+    An event is sent whenever the job status changes; the stream ends after
+    the job has succeeded or failed.
+
+    Args:
+        job_id: ID returned when the job was created
+
+    Returns:
+        StreamingResponse: ``text/event-stream`` of job states
+
+    Raises:
+        HTTPException: If the job does not exist (or has expired)
+    """
+    job = await _get_job_or_404(job_id)
+
+    async def events():
+        current = job
+        last_status = None
+        while True:
+            if current.status != last_status:
+                last_status = current.status
+                yield f"event: {current.status}\n" \
+                      f"data: {json.dumps(current.to_dict())}\n\n"
+            if current.status in TERMINAL_STATES:
+                return
+            await asyncio.sleep(JOB_EVENTS_POLL_INTERVAL)
+            current = await get_job_manager().get(job_id)
+            if current is None:
+                return
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
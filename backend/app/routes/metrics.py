@@ -0,0 +1,21 @@
+"""
+Prometheus metrics endpoint.
+"""
+
+from fastapi import APIRouter, Response
+
+from app.utils.metrics import METRICS_CONTENT_TYPE, InstrumentedRoute, \
+    render_metrics
+
+router = APIRouter(route_class=InstrumentedRoute)
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Expose application metrics for Prometheus to scrape.
+
+    Returns:
+        Response: Metrics in the Prometheus text exposition format
+    """
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
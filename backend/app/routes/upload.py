@@ -1,71 +1,240 @@
 """
 File upload endpoint for handling multipart form data.
+
+Uploads are content-addressed: each file is hashed while it streams in and
+stored as ``<sha256><extension>``. Re-uploading content that is already
+stored resolves to the existing image (and its detections) and only adds a
+reference to it.
 """
 
+import asyncio
+import hashlib
 import os
-import uuid
-from pathlib import Path
-from typing import List
+from typing import List, Optional, Tuple
+
+from fastapi import APIRouter, File, HTTPException, Query, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.utils.cleanup import purge_image
+from app.utils.image_index import ImageRecord, get_image_index
+from app.utils.jobs import get_job_manager
+from app.utils.metrics import InstrumentedRoute
+from app.utils.storage import UPLOAD_DIR, StorageWriter, get_storage, \
+    staging_key
+
+router = APIRouter(route_class=InstrumentedRoute)
+
+# Streaming settings (bytes)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_FILE_SIZE = int(os.getenv("UPLOAD_MAX_FILE_BYTES",
+                              str(50 * 1024 * 1024)))
+MAX_REQUEST_SIZE = int(os.getenv("UPLOAD_MAX_REQUEST_BYTES",
+                                 str(200 * 1024 * 1024)))
+# Room for multipart boundaries and part headers on top of the file bytes
+MULTIPART_OVERHEAD = 64 * 1024
+# With detect=true, files up to this size are handed to detection from
+# memory; larger ones are re-read from disk by the detection job
+DETECT_INLINE_MAX_SIZE = int(os.getenv("UPLOAD_DETECT_INLINE_MAX_BYTES",
+                                       str(20 * 1024 * 1024)))
+
+
+def _too_large_detail() -> str:
+    return f"Request exceeds the upload size limit of {MAX_REQUEST_SIZE} bytes"
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware capping the size of upload request bodies.
+
+    The multipart body is parsed (and file parts spooled to temporary
+    files) before the endpoint runs, so the limit is enforced here, on the
+    body as it arrives: a declared ``Content-Length`` over the limit is
+    rejected before anything is read, and a body that grows past it is cut
+    off at the chunk that crosses it.
+    """
+
+    def __init__(self, app: ASGIApp, paths: List[str]):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        limit = MAX_REQUEST_SIZE + MULTIPART_OVERHEAD
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse({"detail": _too_large_detail()},
+                                    status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413,
+                                        detail=_too_large_detail())
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def _write_chunk(out: StorageWriter, digest: "hashlib._Hash",
+                 chunk: bytes) -> None:
+    """Hash and write one chunk (runs in a worker thread)."""
+    digest.update(chunk)
+    out.write(chunk)
+
+
+async def stream_upload_to_storage(file: UploadFile, destination: str,
+                                   max_bytes: int, keep_bytes: int = 0) -> \
+        Tuple[int, str, Optional[bytes]]:
+    """
+    Stream an uploaded file to storage in fixed-size chunks.
+
+    Chunks are written by a worker thread, so the event loop never blocks on
+    storage I/O and memory use stays bounded by the chunk size (or the S3
+    part size). The file becomes visible only once complete, so readers
+    never see partial uploads.
+
+    Args:
+        file: The uploaded file
+        destination: Storage key of the file
+        max_bytes: Maximum number of bytes accepted for this file
+        keep_bytes: Also return the content if the file is no larger than
+                    this (0 keeps nothing in memory)
 
-from fastapi import APIRouter, File, HTTPException, UploadFile
+    Returns:
+        tuple: File size in bytes, SHA-256 hex digest of the content and the
+               content itself (or None if it was not kept)
 
-router = APIRouter()
+    Raises:
+        HTTPException: If the file exceeds ``max_bytes``
+    """
+    digest = hashlib.sha256()
+    size = 0
+    kept: Optional[List[bytes]] = [] if keep_bytes > 0 else None
 
-# Define upload directory
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
+    out = await asyncio.to_thread(get_storage().open_writer, destination)
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File {file.filename} exceeds the upload size "
+                           f"limit of {max_bytes} bytes"
+                )
+            await asyncio.to_thread(_write_chunk, out, digest, chunk)
+            if kept is not None:
+                if size <= keep_bytes:
+                    kept.append(chunk)
+                else:
+                    kept = None  # Too large to hold; detection re-reads it
+
+        await asyncio.to_thread(out.commit)
+    except BaseException:
+        await asyncio.to_thread(out.abort)
+        raise
+
+    content = b"".join(kept) if kept is not None else None
+    return size, digest.hexdigest(), content
 
 
 @router.post("/upload")
-async def upload_files(files: List[UploadFile] = File(..., alias="files[]")):
+async def upload_files(files: List[UploadFile] = File(..., alias="files[]"),
+                       detect: bool = Query(default=False)):
     """
     Upload endpoint that accepts multiple files via multipart/form-data.
 
+    Files are streamed to storage chunk by chunk. Each file is limited to
+    ``UPLOAD_MAX_FILE_BYTES`` and the whole request to
+    ``UPLOAD_MAX_REQUEST_BYTES``; if either limit is exceeded, nothing from
+    the request is kept. The request limit is enforced on the body as it
+    arrives by :class:`UploadSizeLimitMiddleware`, before the multipart
+    parser spools the files.
+
+    A file whose content is already stored is not kept twice: its entry
+    names the existing image (``duplicate`` is true), whose detections are
+    reused.
+
+    With ``detect=true``, object detection for every uploaded image starts
+    in the background straight from the bytes just received; each file
+    entry then carries the ``detection_job_id`` to follow.
+
     Args:
         files: List of uploaded files (sent as 'files[]' from frontend)
+        detect: Start object detection for uploaded images right away
 
     Returns:
         dict: Information about uploaded files including filenames, sizes, and
               saved paths
 
     Raises:
-        HTTPException: If no files are provided or other upload errors occur
+        HTTPException: If no files are provided, a size limit is exceeded or
+                       other upload errors occur
     """
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
 
     uploaded_files = []
+    request_bytes = 0
+    detection_inputs = []
+    # Image IDs this request holds a reference to
+    references: List[str] = []
 
     for file in files:
         if not file.filename:
             continue
 
-        # Generate unique filename to prevent conflicts
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = UPLOAD_DIR / unique_filename
+        # Stream to a hidden staging file; the name depends on the content
+        file_extension = os.path.splitext(file.filename)[1].lower()
+        staged_key = staging_key(UPLOAD_DIR, file_extension)
 
         try:
-            # Read file content
-            content = await file.read()
-            file_size = len(content)
+            max_bytes = min(MAX_FILE_SIZE, MAX_REQUEST_SIZE - request_bytes)
+            wants_detection = detect and _is_image(file)
+            file_size, content_hash, content = \
+                await stream_upload_to_storage(
+                    file, staged_key, max_bytes,
+                    keep_bytes=DETECT_INLINE_MAX_SIZE if wants_detection
+                    else 0)
+            request_bytes += file_size
 
-            # Save file to disk
-            with open(file_path, "wb") as buffer:
-                buffer.write(content)
+            record, duplicate = await asyncio.to_thread(
+                store_blob, staged_key, content_hash, file_extension,
+                file_size, file.content_type)
+            references.append(record.id)
+            if wants_detection:
+                detection_inputs.append((len(uploaded_files), content))
 
             uploaded_files.append({
                 "original_filename": file.filename,
-                "saved_filename": unique_filename,
-                "file_path": str(file_path),
+                "saved_filename": record.id,
+                "file_path": record.original_path,
                 "size": file_size,
-                "content_type": file.content_type
+                "content_type": file.content_type,
+                "content_hash": content_hash,
+                "duplicate": duplicate
             })
 
         except Exception as e:
-            # Clean up partial file if it exists
-            if file_path.exists():
-                os.unlink(file_path)
+            # Drop everything this request stored so far
+            await asyncio.to_thread(_discard_uploads, references, staged_key)
+            if isinstance(e, HTTPException):
+                raise
             raise HTTPException(
                 status_code=500,
                 detail=f"Failed to save file {file.filename}: {str(e)}"
@@ -74,9 +243,90 @@ async def upload_files(files: List[UploadFile] = File(..., alias="files[]")):
     if not uploaded_files:
         raise HTTPException(status_code=400, detail="No valid files uploaded")
 
+    # Start detection only once the whole request is stored
+    for position, content in detection_inputs:
+        entry = uploaded_files[position]
+        job = await get_job_manager().submit(
+            "detection", {"image_id": entry["saved_filename"]}, data=content)
+        entry["detection_job_id"] = job.id
+        entry["detection_status_url"] = f"/api/jobs/{job.id}"
+
     return {
         "message": "Files uploaded successfully",
         "files_count": len(uploaded_files),
         "files": uploaded_files,
         "upload_directory": str(UPLOAD_DIR.absolute())
     }
+
+
+def store_blob(staged_key: str, content_hash: str, extension: str,
+               size: int, content_type: Optional[str]) -> \
+        Tuple[ImageRecord, bool]:
+    """
+    Move a fully received upload into content-addressed storage.
+
+    The upload is registered in the index before its file is moved into
+    place, so the index alone decides which image it belongs to; the
+    reconciliation of the index with storage leaves originals registered
+    that recently alone.
+
+    Args:
+        staged_key: Storage key of the complete upload
+        content_hash: SHA-256 hex digest of the content
+        extension: Lower-case file extension of the upload
+        size: Size of the content in bytes
+        content_type: Content type declared by the client
+
+    Returns:
+        tuple: The image the upload resolved to and whether it already
+               existed (in which case the staged copy is dropped)
+    """
+    storage = get_storage()
+    blob_name = f"{content_hash}{extension}"
+    # Decide through the index first: it knows whether the stored blob is
+    # referenced or about to be purged, which its existence alone does not
+    record, duplicate = get_image_index().register_upload(ImageRecord(
+        id=blob_name,
+        original_path=str(UPLOAD_DIR / blob_name),
+        size=size,
+        content_type=content_type,
+        hash=content_hash,
+    ))
+    if duplicate:
+        # The first upload of this content may still be moving its copy
+        # into place (or have failed to); the content is identical, so this
+        # copy completes the image rather than leaving it without a file
+        if storage.exists(record.original_path):
+            storage.delete(staged_key)
+        else:
+            storage.move(staged_key, record.original_path)
+        return record, True
+
+    try:
+        storage.move(staged_key, record.original_path)
+    except BaseException:
+        index = get_image_index()
+        if index.release(record.id) == 0:
+            index.delete_released(record.id)
+        raise
+    stored = storage.stat(record.original_path)
+    if stored is not None:
+        record.mtime = stored.mtime
+        get_image_index().update(record.id, mtime=stored.mtime)
+    return record, False
+
+
+def _is_image(file: UploadFile) -> bool:
+    """Whether an uploaded file looks like an image."""
+    return bool(file.content_type and file.content_type.startswith("image/"))
+
+
+def _discard_uploads(image_ids: List[str], staged_key: str) -> None:
+    """Release references taken by a failed request, removing unused blobs."""
+    get_storage().delete(staged_key)
+    index = get_image_index()
+    for image_id in image_ids:
+        record = index.get(image_id)
+        if record is None or index.release(image_id) > 0:
+            continue
+        purge_image(record)
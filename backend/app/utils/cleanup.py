@@ -0,0 +1,281 @@
+"""
+Removal of stored images: bulk deletion and periodic garbage collection.
+
+Images are resolved through the index and their files (derivatives,
+processed image, original) removed through the storage backend, so
+deleting never scans a directory. The garbage collector periodically
+reconciles the index with storage and removes what nothing refers to any
+more: images whose deletion was interrupted, abandoned staging files,
+derivatives of processed images that are gone and expired detection cache
+files. Optionally it also removes images left with only one of their files
+(an original never processed, or a processed image without its original).
+"""
+
+import asyncio
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+from app.utils.derivatives import DERIVATIVE_DIR_NAME, DERIVATIVE_SIZES, \
+    derivative_path
+from app.utils.detection_cache import get_detection_cache
+from app.utils.image_index import ImageRecord, get_image_index
+from app.utils.metrics import GC_BYTES_RECLAIMED, GC_FILES_REMOVED, GC_RUNS
+from app.utils.shared_state import get_shared_state, shared_state_enabled
+from app.utils.storage import PROCESSED_DIR, UPLOAD_DIR, get_storage
+
+logger = logging.getLogger(__name__)
+
+
+def purge_image(record: ImageRecord) -> Dict[str, Any]:
+    """
+    Delete every stored file of an image and then its index record.
+
+    The record is first turned into a tombstone (all references released),
+    so an upload of the same content arriving meanwhile is stored under its
+    own key instead of resolving to files about to be removed.
+    Its cached detections and renders are invalidated along with the files.
+
+    Args:
+        record: The indexed image
+
+    Returns:
+        dict: Whether the processed image and the original were deleted,
+              and the bytes freed (derivatives included)
+
+    Raises:
+        OSError: If a file cannot be deleted (the tombstone is kept, so a
+                 later garbage collection finishes the job)
+    """
+    storage = get_storage()
+    index = get_image_index()
+    reclaimed = 0
+    processed_size = original_size = None
+    # Paths as stored now; the record may predate the last processing
+    record = index.tombstone(record.id) or record
+    if record.processed_path:
+        for name in DERIVATIVE_SIZES:
+            reclaimed += storage.remove(
+                str(derivative_path(record.processed_path, name))) or 0
+        processed_size = storage.remove(record.processed_path)
+    if record.original_path:
+        original_size = storage.remove(record.original_path)
+    if record.hash:
+        get_detection_cache().invalidate(record.hash)
+    index.delete_released(record.id)
+    return {
+        "processed_deleted": processed_size is not None,
+        "original_deleted": original_size is not None,
+        "bytes_reclaimed": reclaimed + (processed_size or 0) +
+        (original_size or 0),
+    }
+
+
+def delete_images(records: Iterable[ImageRecord],
+                  release: bool = True) -> Dict[str, Any]:
+    """
+    Delete a batch of images.
+
+    Args:
+        records: The indexed images
+        release: Drop one reference per image like a single delete (images
+                 other uploads still refer to keep their files); otherwise
+                 remove the images whatever their references
+
+    Returns:
+        dict: Images deleted, images that only lost a reference, IDs that
+              could not be deleted and bytes freed
+    """
+    index = get_image_index()
+    totals: Dict[str, Any] = {"deleted": 0, "released": 0, "failed": [],
+                              "bytes_reclaimed": 0}
+    for record in records:
+        if release and index.release(record.id) > 0:
+            totals["released"] += 1
+            continue
+        try:
+            result = purge_image(record)
+        except OSError as e:
+            logger.warning(f"Failed to delete image {record.id}: {e}")
+            totals["failed"].append(record.id)
+            continue
+        totals["deleted"] += 1
+        totals["bytes_reclaimed"] += result["bytes_reclaimed"]
+    return totals
+
+
+class GarbageCollector:
+    """Periodically removes stored files that nothing refers to."""
+
+    def __init__(self, interval: float = 3600, staged_max_age: float = 3600,
+                 orphan_max_age: float = 0,
+                 original_dir: Path = UPLOAD_DIR,
+                 processed_dir: Path = PROCESSED_DIR):
+        self.interval = interval
+        self.staged_max_age = staged_max_age
+        # 0 keeps images that have only one of their files
+        self.orphan_max_age = orphan_max_age
+        self.original_dir = original_dir
+        self.processed_dir = processed_dir
+        self.runs = 0
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def collect(self) -> Dict[str, Any]:
+        """
+        Run one collection (blocking; call it from a worker thread).
+
+        Returns:
+            dict: Index reconciliation stats, files removed per kind and
+                  bytes reclaimed
+        """
+        started = time.time()
+        storage = get_storage()
+        index = get_image_index()
+        removed = {"released_images": 0, "orphaned_images": 0,
+                   "staged_files": 0, "derivatives": 0,
+                   "detection_cache_files": 0}
+        reclaimed = 0
+
+        reconciled = index.reconcile(self.original_dir, self.processed_dir,
+                                     storage)
+
+        # Images whose last reference was dropped but whose files survived
+        # (e.g. the process stopped halfway through a delete)
+        released = delete_images(index.list_released(), release=False)
+        removed["released_images"] = released["deleted"]
+        reclaimed += released["bytes_reclaimed"]
+
+        if self.orphan_max_age > 0:
+            orphans = delete_images(
+                index.list_orphans(started - self.orphan_max_age),
+                release=False)
+            removed["orphaned_images"] = orphans["deleted"]
+            reclaimed += orphans["bytes_reclaimed"]
+
+        # Staged uploads and temporary files of interrupted writes
+        derivative_dir = self.processed_dir / DERIVATIVE_DIR_NAME
+        cutoff = started - self.staged_max_age
+        for directory in (self.original_dir, self.processed_dir,
+                          derivative_dir):
+            for obj in storage.list(str(directory), include_hidden=True):
+                if obj.name.startswith(".") and obj.mtime < cutoff:
+                    size = storage.remove(obj.key)
+                    if size is not None:
+                        removed["staged_files"] += 1
+                        reclaimed += size
+
+        # Derivatives of processed images that no longer exist
+        expected = {str(derivative_path(path, name))
+                    for path in index.processed_paths()
+                    for name in DERIVATIVE_SIZES}
+        for obj in storage.list(str(derivative_dir)):
+            if obj.key not in expected and obj.mtime < started:
+                size = storage.remove(obj.key)
+                if size is not None:
+                    removed["derivatives"] += 1
+                    reclaimed += size
+
+        files, size = get_detection_cache().purge_expired()
+        removed["detection_cache_files"] = files
+        reclaimed += size
+
+        report = {
+            "started_at": started,
+            "duration_seconds": round(time.time() - started, 3),
+            "reconciled": reconciled,
+            "removed": removed,
+            "bytes_reclaimed": reclaimed,
+        }
+        GC_RUNS.inc()
+        GC_BYTES_RECLAIMED.inc(reclaimed)
+        for kind, count in removed.items():
+            GC_FILES_REMOVED.labels(kind).inc(count)
+        self.runs += 1
+        self.last_report = report
+        logger.info(f"Garbage collection reclaimed {reclaimed} bytes: "
+                    f"{removed}")
+        return report
+
+    async def run_once(self, force: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Run one collection in a worker thread.
+
+        With several workers, scheduled runs take a lease so that only one
+        worker collects per interval.
+
+        Args:
+            force: Run even if another worker collected recently
+
+        Returns:
+            dict | None: The report, or None if another worker has the turn
+        """
+        if not force and shared_state_enabled():
+            acquired = await asyncio.to_thread(
+                get_shared_state().acquire_lease, "gc", self.interval * 0.9)
+            if not acquired:
+                return None
+        return await asyncio.to_thread(self.collect)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Garbage collection failed: {e}")
+
+    def start(self) -> None:
+        """Start collecting periodically on the running event loop."""
+        if self.interval <= 0:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop collecting."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report the collector's schedule and its last run.
+
+        Returns:
+            dict: Interval, completed runs and the last report
+        """
+        return {
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "last_report": self.last_report,
+        }
+
+
+_collector: Optional[GarbageCollector] = None
+
+
+def get_garbage_collector() -> GarbageCollector:
+    """
+    Return the process-wide garbage collector, configured from the
+    environment.
+
+    Returns:
+        GarbageCollector: The shared collector
+    """
+    global _collector
+    if _collector is None:
+        _collector = GarbageCollector(
+            interval=float(os.getenv("GC_INTERVAL_SECONDS", "3600")),
+            staged_max_age=float(os.getenv("GC_STAGED_MAX_AGE_SECONDS",
+                                           "3600")),
+            orphan_max_age=float(os.getenv("GC_ORPHAN_MAX_AGE_SECONDS",
+                                           "0")),
+        )
+    return _collector
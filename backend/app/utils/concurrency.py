@@ -0,0 +1,108 @@
+"""
+Helpers for running many async jobs with bounded concurrency and for
+coalescing duplicate concurrent work.
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, \
+    Iterable, Optional, Tuple
+
+
+async def bounded_as_completed(
+        items: Iterable[Any],
+        func: Callable[[Any], Awaitable[Any]],
+        concurrency: int) -> AsyncIterator[Tuple[Any, Any, Exception]]:
+    """
+    Run ``func`` for every item with at most ``concurrency`` running at once.
+
+    Results are yielded as soon as each job finishes, not in input order.
+    If the consumer stops early (for example because the client
+    disconnected), outstanding jobs are cancelled.
+
+    Args:
+        items: Inputs to process
+        func: Coroutine function called with each item
+        concurrency: Maximum number of jobs running at the same time
+
+    Yields:
+        tuple: ``(item, result, error)``; exactly one of result and error
+               is set
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(item: Any) -> Tuple[Any, Any, Exception]:
+        async with semaphore:
+            try:
+                return item, await func(item), None
+            except Exception as e:
+                return item, None, e
+
+    tasks = [asyncio.create_task(run(item)) for item in items]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one execution.
+
+    While a call for a key is in flight, further callers with that key wait
+    for its result instead of starting their own, so a burst of identical
+    requests does the expensive work (an Azure call, a render) only once.
+    The work runs in its own task and is not cancelled when a caller goes
+    away, so the remaining callers still get the result.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, "asyncio.Task[Any]"] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]],
+                 cached: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+        """
+        Run ``func`` for ``key`` unless a call for it is already running.
+
+        Args:
+            key: Identity of the work (e.g. an image ID)
+            func: Coroutine function performing the work
+            cached: Coroutine function looking up a result stored by an
+                    execution elsewhere; only groups that span processes
+                    consult it
+
+        Returns:
+            Any: The result of the single execution; its exception is
+                 raised to every waiting caller
+        """
+        task = self._calls.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            self.executed += 1
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: "asyncio.Task[Any]") -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # Mark retrieved if every caller went away
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report how many calls ran and how many were coalesced.
+
+        Returns:
+            dict: In-flight keys and execution counters
+        """
+        return {
+            "in_flight": len(self._calls),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,182 @@
+"""
+Thumbnails and medium previews of processed images.
+
+Gallery pages should not download full-size processed images for every
+grid cell, so each processed image gets smaller JPEG derivatives. They are
+generated right after the image is processed, or lazily on first request,
+and stored in a ``derivatives`` directory next to the processed images
+(served like them, from the static mount or the storage backend). The
+image index records when they were generated, so listings link them
+without looking them up in storage. JPEG
+sources are decoded at reduced size with Pillow's ``draft`` and the
+remaining shrink uses ``reduce``-based resampling, so generating them costs
+a fraction of a full decode.
+"""
+
+import asyncio
+import io
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from PIL import Image
+
+from app.utils.concurrency import SingleFlight
+from app.utils.image_encoding import encode_image, prepare_for_encoding
+from app.utils.image_index import get_image_index
+from app.utils.metrics import observe_stage
+from app.utils.render_pool import get_render_pool
+from app.utils.storage import get_storage, storage_call
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_DIR_NAME = "derivatives"
+
+# Longest side in pixels of each derivative
+DERIVATIVE_SIZES: Dict[str, int] = {
+    "thumbnail": int(os.getenv("THUMBNAIL_MAX_DIMENSION", "256")),
+    "preview": int(os.getenv("PREVIEW_MAX_DIMENSION", "1024")),
+}
+
+
+def build_derivatives(image_data: bytes) -> Dict[str, bytes]:
+    """
+    Create every derivative of an image.
+
+    Runs in render pool workers. The image is decoded once, at the smallest
+    JPEG scale that still covers the largest derivative, and then shrunk
+    step by step from the largest derivative to the smallest.
+
+    Args:
+        image_data: Encoded processed image
+
+    Returns:
+        dict: Derivative name to encoded JPEG
+    """
+    image = Image.open(io.BytesIO(image_data))
+    largest = max(DERIVATIVE_SIZES.values())
+    image.draft("RGB", (largest, largest))
+    image = prepare_for_encoding(image, "jpeg")
+
+    derivatives = {}
+    for name, size in sorted(DERIVATIVE_SIZES.items(),
+                             key=lambda item: -item[1]):
+        image.thumbnail((size, size), Image.Resampling.BILINEAR,
+                        reducing_gap=2.0)
+        derivatives[name] = encode_image(image, "jpeg")
+    return derivatives
+
+
+def derivative_path(processed_path: str, name: str) -> Path:
+    """
+    Location of a derivative of a processed image.
+
+    Args:
+        processed_path: Path of the processed image
+        name: Derivative name (see ``DERIVATIVE_SIZES``)
+
+    Returns:
+        Path: ``<processed dir>/derivatives/<name>_<processed file>``, with
+              ``.jpg`` appended unless the processed file is already a JPEG
+    """
+    processed = Path(processed_path)
+    filename = f"{name}_{processed.name}"
+    if processed.suffix.lower() not in (".jpg", ".jpeg"):
+        filename += ".jpg"
+    return processed.parent / DERIVATIVE_DIR_NAME / filename
+
+
+def derivative_url(processed_path: str, name: str) -> str:
+    """Static URL of a derivative under ``/api/processed_uploads``."""
+    return f"/api/processed_uploads/{DERIVATIVE_DIR_NAME}/" \
+           f"{derivative_path(processed_path, name).name}"
+
+
+def fresh_derivative(processed_path: str, name: str) -> Optional[Path]:
+    """
+    Return a derivative if it exists and is not older than its source.
+
+    Args:
+        processed_path: Path of the processed image
+        name: Derivative name
+
+    Returns:
+        Path | None: The derivative file, or None if it must be generated
+    """
+    storage = get_storage()
+    path = derivative_path(processed_path, name)
+    try:
+        derivative = storage.stat(str(path))
+        processed = storage.stat(processed_path)
+    except OSError:
+        return None
+    if derivative is not None and processed is not None and \
+            derivative.mtime >= processed.mtime:
+        return path
+    return None
+
+
+def save_derivatives(processed_path: str,
+                     derivatives: Dict[str, bytes]) -> None:
+    """Write derivatives atomically next to the processed image."""
+    storage = get_storage()
+    for name, data in derivatives.items():
+        storage.write(str(derivative_path(processed_path, name)), data)
+
+
+def remove_derivatives(processed_path: str) -> int:
+    """
+    Delete every derivative of a processed image.
+
+    Returns:
+        int: Number of files removed
+    """
+    storage = get_storage()
+    removed = sum(storage.delete(str(derivative_path(processed_path, name)))
+                  for name in DERIVATIVE_SIZES)
+    get_image_index().set_derivatives(processed_path, None)
+    return removed
+
+
+# Concurrent first requests for one image generate its derivatives once
+_derivative_flights = SingleFlight()
+
+
+async def _generate(processed_path: str,
+                    image_data: Optional[bytes]) -> Dict[str, bytes]:
+    # Taken before the source is read, so a processed image saved while
+    # this runs leaves the derivatives marked stale
+    generated_at = time.time()
+    if image_data is None:
+        image_data = await storage_call(get_storage().read, processed_path)
+    started = time.perf_counter()
+    derivatives = await get_render_pool().run(build_derivatives, image_data)
+    await storage_call(save_derivatives, processed_path, derivatives)
+    await asyncio.to_thread(get_image_index().set_derivatives,
+                            processed_path, generated_at)
+    observe_stage("derivatives", time.perf_counter() - started)
+    return derivatives
+
+
+async def ensure_derivatives(processed_path: str,
+                             image_data: Optional[bytes] = None) -> \
+        Dict[str, bytes]:
+    """
+    Generate and save the derivatives of a processed image.
+
+    Args:
+        processed_path: Path of the processed image
+        image_data: The processed image bytes if already in memory
+
+    Returns:
+        dict: Derivative name to encoded JPEG
+
+    Raises:
+        RenderPoolSaturated: If the render pool has no room
+        OSError: If the processed image cannot be read or the derivatives
+                 cannot be written
+    """
+    return await _derivative_flights.do(
+        processed_path, lambda: _generate(processed_path, image_data))
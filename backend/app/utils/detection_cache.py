@@ -0,0 +1,386 @@
+"""
+Content-addressed cache for object detection results.
+
+Entries are keyed by the SHA-256 of the original image bytes, so re-opening
+an image or re-uploading the same photo is served without calling Azure or
+redrawing the bounding boxes. A bounded in-memory LRU tier (entry count,
+byte size and TTL eviction) sits in front of a persistent on-disk tier,
+which is only read and written from worker threads. Rendered images are
+cached once per output format (JPEG, WebP, ...) and render settings.
+Entries of an image are invalidated when its last reference is released.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.utils.http_caching import strong_etag
+from app.utils.image_processing import render_settings_key
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _CacheEntry:
+    """A single in-memory cache entry."""
+    boxes: Optional[List[Dict[str, Any]]]
+    rendered: Optional[bytes]
+    created_at: float
+    rendered_etag: Optional[str] = None
+
+    @property
+    def size(self) -> int:
+        """Approximate memory footprint used for size-based eviction."""
+        box_bytes = 128 * len(self.boxes) if self.boxes else 0
+        return box_bytes + (len(self.rendered) if self.rendered else 0)
+
+
+class DetectionCache:
+    """Two-tier (memory LRU + disk) cache of detections and rendered images."""
+
+    def __init__(self, cache_dir: Path, max_entries: int = 1024,
+                 max_bytes: int = 256 * 1024 * 1024,
+                 ttl_seconds: float = 7 * 24 * 3600):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._total_bytes = 0
+        # The memory tier is used on the event loop, but invalidated from
+        # the worker threads that delete images
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.render_hits = 0
+        self.render_misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def hash_image(image_data: bytes) -> str:
+        """Return the content hash used as cache key."""
+        return hashlib.sha256(image_data).hexdigest()
+
+    # ------------------------------------------------------------------
+    # Memory tier
+    # ------------------------------------------------------------------
+
+    def _expired(self, created_at: float) -> bool:
+        return time.time() - created_at > self.ttl_seconds
+
+    def _get_entry(self, key: str) -> Optional[_CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry.created_at):
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry.size
+
+    def _store(self, key: str, boxes: Optional[List[Dict[str, Any]]] = None,
+               rendered: Optional[bytes] = None,
+               created_at: Optional[float] = None,
+               rendered_etag: Optional[str] = None) -> None:
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None:
+                boxes = boxes if boxes is not None else existing.boxes
+                if rendered is None:
+                    rendered = existing.rendered
+                    rendered_etag = existing.rendered_etag
+                created_at = created_at or existing.created_at
+                self._drop(key)
+
+            entry = _CacheEntry(boxes=boxes, rendered=rendered,
+                                created_at=created_at or time.time(),
+                                rendered_etag=rendered_etag)
+            self._entries[key] = entry
+            self._total_bytes += entry.size
+
+            # Evict least recently used entries until within bounds
+            while self._entries and (len(self._entries) > self.max_entries or
+                                     self._total_bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    # ------------------------------------------------------------------
+    # Disk tier (blocking; run in worker threads by the public API)
+    # ------------------------------------------------------------------
+
+    def _boxes_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    @staticmethod
+    def _variant_key(key: str, output_format: str) -> str:
+        # Renders made with other box, label or encoder settings never match
+        return f"{key}.{render_settings_key(output_format)}.{output_format}"
+
+    def _rendered_path(self, key: str, output_format: str = "jpeg") -> Path:
+        extension = "jpg" if output_format == "jpeg" else output_format
+        return self.cache_dir / \
+            f"{key}.{render_settings_key(output_format)}.{extension}"
+
+    def _write_atomic(self, path: Path, data: bytes) -> None:
+        # Unique per write, so neither worker processes sharing the
+        # directory nor threads of one worker replace each other's file
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write detection cache file {path}: {e}")
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def _read_disk_boxes(self, key: str) -> \
+            Optional[Tuple[List[Dict[str, Any]], float]]:
+        path = self._boxes_path(key)
+        try:
+            with open(path, "r") as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable cache file {path}: {e}")
+            return None
+
+        created_at = record.get("created_at", 0)
+        if self._expired(created_at):
+            self._remove_disk(key)
+            return None
+        return record.get("boxes", []), created_at
+
+    def _read_disk_rendered(self, path: Path) -> Optional[Tuple[bytes, str]]:
+        try:
+            if self._expired(path.stat().st_mtime):
+                path.unlink()
+                return None
+            with open(path, "rb") as f:
+                rendered = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Ignoring unreadable cache file {path}: {e}")
+            return None
+        return rendered, strong_etag(rendered)
+
+    def _write_rendered(self, path: Path, rendered: bytes) -> str:
+        self._write_atomic(path, rendered)
+        return strong_etag(rendered)
+
+    def _remove_disk(self, key: str, suffix: str = ".*") -> None:
+        # Boxes and every rendered format
+        for path in self.cache_dir.glob(f"{key}{suffix}"):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    async def get_boxes(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Look up normalized bounding boxes for an image hash.
+
+        Memory hits are served on the event loop; the disk tier is read in
+        a worker thread.
+
+        Args:
+            key: Content hash of the original image
+
+        Returns:
+            list | None: Bounding boxes as dicts, or None on a miss
+        """
+        entry = self._get_entry(key)
+        if entry is not None and entry.boxes is not None:
+            self.hits += 1
+            return entry.boxes
+
+        stored = await asyncio.to_thread(self._read_disk_boxes, key)
+        if stored is not None:
+            boxes, created_at = stored
+            self.hits += 1
+            self.disk_hits += 1
+            self._store(key, boxes=boxes, created_at=created_at)
+            return boxes
+
+        self.misses += 1
+        return None
+
+    async def put_boxes(self, key: str, boxes: List[Dict[str, Any]]) -> None:
+        """Store normalized bounding boxes in both tiers."""
+        created_at = time.time()
+        self._store(key, boxes=boxes, created_at=created_at)
+        record = {"created_at": created_at, "boxes": boxes}
+        await asyncio.to_thread(self._write_atomic, self._boxes_path(key),
+                                json.dumps(record).encode("utf-8"))
+
+    async def get_rendered(self, key: str,
+                           output_format: str = "jpeg") -> Optional[bytes]:
+        """
+        Look up the image with bounding boxes already drawn.
+
+        Renders are keyed by the box, label and encoder settings as well,
+        so a render made with different settings is a miss.
+
+        Args:
+            key: Content hash of the original image
+            output_format: Encoded format of the render
+
+        Returns:
+            bytes | None: Encoded processed image, or None on a miss
+        """
+        variant_key = self._variant_key(key, output_format)
+        entry = self._get_entry(variant_key)
+        if entry is not None and entry.rendered is not None:
+            self.render_hits += 1
+            return entry.rendered
+
+        stored = await asyncio.to_thread(
+            self._read_disk_rendered, self._rendered_path(key, output_format))
+        if stored is not None:
+            rendered, etag = stored
+            self.render_hits += 1
+            self._store(variant_key, rendered=rendered, rendered_etag=etag)
+            return rendered
+
+        self.render_misses += 1
+        return None
+
+    def peek_rendered_etag(self, key: str,
+                           output_format: str = "jpeg") -> Optional[str]:
+        """
+        Return the ETag of a rendered image held in memory, without touching
+        the disk tier or the hit counters.
+
+        Args:
+            key: Content hash of the original image
+            output_format: Encoded format of the render
+
+        Returns:
+            str | None: Strong ETag of the rendered image, if known
+        """
+        with self._lock:
+            entry = self._entries.get(self._variant_key(key, output_format))
+        if entry is None or self._expired(entry.created_at):
+            return None
+        return entry.rendered_etag
+
+    async def put_rendered(self, key: str, rendered: bytes,
+                           output_format: str = "jpeg") -> None:
+        """Store an encoded processed image in both tiers."""
+        etag = await asyncio.to_thread(
+            self._write_rendered, self._rendered_path(key, output_format),
+            rendered)
+        self._store(self._variant_key(key, output_format), rendered=rendered,
+                    rendered_etag=etag)
+
+    def invalidate(self, image_hash: str) -> None:
+        """
+        Remove the detections and renders of an image, made by any detector
+        backend, from both tiers.
+
+        Blocking (the disk tier is deleted from); call it from a worker
+        thread.
+
+        Args:
+            image_hash: Content hash of the original image
+        """
+        with self._lock:
+            for cached_key in [k for k in self._entries
+                               if k.startswith(image_hash)]:
+                self._drop(cached_key)
+        # Content hashes have a fixed length, so the prefix is unambiguous
+        self._remove_disk(image_hash, suffix="*")
+
+    def purge_expired(self) -> Tuple[int, int]:
+        """
+        Delete disk-tier files past their TTL (entries are otherwise only
+        dropped when looked up) and leftover temporary files.
+
+        Returns:
+            tuple: Number of files removed and bytes reclaimed
+        """
+        cutoff = time.time() - self.ttl_seconds
+        removed = reclaimed = 0
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                try:
+                    st = entry.stat()
+                    if not entry.is_file() or st.st_mtime >= cutoff:
+                        continue
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    continue
+                removed += 1
+                reclaimed += st.st_size
+        return removed, reclaimed
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report cache usage counters.
+
+        Returns:
+            dict: Hit/miss counters, evictions and memory-tier occupancy
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "render_hits": self.render_hits,
+            "render_misses": self.render_misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_cache: Optional[DetectionCache] = None
+
+
+def get_detection_cache() -> DetectionCache:
+    """
+    Return the process-wide detection cache, configured from the environment.
+
+    Returns:
+        DetectionCache: The shared cache instance
+    """
+    global _cache
+    if _cache is None:
+        _cache = DetectionCache(
+            cache_dir=Path(os.getenv("DETECTION_CACHE_DIR", "detection_cache")),
+            max_entries=int(os.getenv("DETECTION_CACHE_MAX_ENTRIES", "1024")),
+            max_bytes=int(os.getenv("DETECTION_CACHE_MAX_BYTES",
+                                    str(256 * 1024 * 1024))),
+            ttl_seconds=float(os.getenv("DETECTION_CACHE_TTL_SECONDS",
+                                        str(7 * 24 * 3600))),
+        )
+    return _cache
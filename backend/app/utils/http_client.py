@@ -0,0 +1,174 @@
+"""
+Shared, application-lifetime HTTP client for outbound API calls.
+
+A single pooled ``httpx.AsyncClient`` is created by the FastAPI lifespan hook
+and reused by every route, so Azure Computer Vision calls benefit from
+keep-alive connections instead of paying a TCP+TLS handshake per request.
+"""
+
+import importlib.util
+import logging
+import os
+from typing import Any, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# The single client shared by all routes (created lazily or at startup)
+_client: Optional[httpx.AsyncClient] = None
+_client_settings: Dict[str, Any] = {}
+_requests_total = 0
+
+
+def _env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment."""
+    return int(os.getenv(name, str(default)))
+
+
+def _env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment."""
+    return float(os.getenv(name, str(default)))
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """Read a boolean setting from the environment."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def get_client_settings() -> Dict[str, Any]:
+    """
+    Collect connection-pool and timeout settings from environment variables.
+
+    Returns:
+        dict: Pool limits, keep-alive expiry, per-phase timeouts and the
+              HTTP/2 flag
+    """
+    http2 = _env_bool("HTTP_CLIENT_HTTP2", True)
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning("HTTP/2 requested but the 'h2' package is not "
+                       "installed; falling back to HTTP/1.1")
+        http2 = False
+
+    return {
+        "max_connections": _env_int("HTTP_CLIENT_MAX_CONNECTIONS", 100),
+        "max_keepalive_connections": _env_int(
+            "HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS", 20),
+        "keepalive_expiry": _env_float("HTTP_CLIENT_KEEPALIVE_EXPIRY", 30.0),
+        "connect_timeout": _env_float("HTTP_CLIENT_CONNECT_TIMEOUT", 5.0),
+        "read_timeout": _env_float("HTTP_CLIENT_READ_TIMEOUT", 30.0),
+        "write_timeout": _env_float("HTTP_CLIENT_WRITE_TIMEOUT", 30.0),
+        "pool_timeout": _env_float("HTTP_CLIENT_POOL_TIMEOUT", 5.0),
+        "http2": http2,
+    }
+
+
+async def _count_request(request: httpx.Request) -> None:
+    """Event hook counting every request sent through the shared client."""
+    global _requests_total
+    _requests_total += 1
+
+
+def create_http_client(settings: Optional[Dict[str, Any]] = None) -> \
+        httpx.AsyncClient:
+    """
+    Build a pooled AsyncClient.
+
+    Args:
+        settings: Pool and timeout settings; read from the environment
+                  when omitted
+
+    Returns:
+        httpx.AsyncClient: A new client (the caller owns its lifetime)
+    """
+    if settings is None:
+        settings = get_client_settings()
+    limits = httpx.Limits(
+        max_connections=settings["max_connections"],
+        max_keepalive_connections=settings["max_keepalive_connections"],
+        keepalive_expiry=settings["keepalive_expiry"],
+    )
+    timeout = httpx.Timeout(
+        connect=settings["connect_timeout"],
+        read=settings["read_timeout"],
+        write=settings["write_timeout"],
+        pool=settings["pool_timeout"],
+    )
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=timeout,
+        http2=settings["http2"],
+        event_hooks={"request": [_count_request]},
+    )
+
+
+def _open_shared_client() -> httpx.AsyncClient:
+    """Create the shared client and remember the settings it was built with."""
+    global _client, _client_settings
+    _client_settings = get_client_settings()
+    _client = create_http_client(_client_settings)
+    return _client
+
+
+async def start_http_client() -> httpx.AsyncClient:
+    """Create the shared client at application startup."""
+    if _client is None or _client.is_closed:
+        _open_shared_client()
+        logger.info("Shared HTTP client started "
+                    f"(http2={_client_settings['http2']})")
+    return _client
+
+
+async def close_http_client() -> None:
+    """Close the shared client and release pooled connections."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        logger.info("Shared HTTP client closed")
+    _client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the shared client, creating it if the lifespan hook has not run
+    (for example under ``TestClient`` without a ``with`` block).
+
+    Returns:
+        httpx.AsyncClient: The application-wide client
+    """
+    if _client is None or _client.is_closed:
+        return _open_shared_client()
+    return _client
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    Report connection-pool usage of the shared client.
+
+    Returns:
+        dict: Open, idle and active connection counts, queued requests,
+              configured limits and total requests sent
+    """
+    if _client is None or _client.is_closed:
+        return {"started": False, "requests_total": _requests_total}
+
+    pool = getattr(_client._transport, "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for conn in connections if conn.is_idle())
+    pending = len(getattr(pool, "_requests", []))
+    settings = _client_settings
+
+    return {
+        "started": True,
+        "http2": settings["http2"],
+        "max_connections": settings["max_connections"],
+        "max_keepalive_connections": settings["max_keepalive_connections"],
+        "connections": len(connections),
+        "idle_connections": idle,
+        "active_connections": len(connections) - idle,
+        "pending_requests": pending,
+        "requests_total": _requests_total,
+    }
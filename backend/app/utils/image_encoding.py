@@ -0,0 +1,183 @@
+"""
+Output encoding policy for processed images.
+
+Processed images can be served as JPEG, WebP or AVIF. The format is
+negotiated from the request's ``Accept`` header among the formats enabled
+with ``OUTPUT_FORMATS`` (in server preference order); JPEG is always
+available as the fallback and is the format of the saved processed file.
+Encoder settings default to fast, libjpeg-turbo friendly values (4:2:0
+chroma subsampling, no extra Huffman optimization pass) and can be tuned
+per format through environment variables.
+"""
+
+import io
+import os
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from PIL import Image, features
+
+
+class OutputFormat(NamedTuple):
+    """An encodable output format."""
+    name: str
+    pil_format: str
+    media_type: str
+    extension: str
+    supports_alpha: bool
+
+
+FORMATS: Dict[str, OutputFormat] = {
+    "jpeg": OutputFormat("jpeg", "JPEG", "image/jpeg", "jpg", False),
+    "webp": OutputFormat("webp", "WEBP", "image/webp", "webp", True),
+    "avif": OutputFormat("avif", "AVIF", "image/avif", "avif", True),
+}
+
+DEFAULT_FORMAT = "jpeg"
+
+# Background used when flattening transparent images for JPEG
+FLATTEN_BACKGROUND = (255, 255, 255)
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes")
+
+
+ENCODER_OPTIONS: Dict[str, Dict[str, Any]] = {
+    "jpeg": {
+        "quality": int(os.getenv("OUTPUT_JPEG_QUALITY", "85")),
+        "optimize": _env_flag("OUTPUT_JPEG_OPTIMIZE", "false"),
+        "progressive": _env_flag("OUTPUT_JPEG_PROGRESSIVE", "false"),
+        "subsampling": "4:2:0",
+    },
+    "webp": {
+        "quality": int(os.getenv("OUTPUT_WEBP_QUALITY", "80")),
+        # 0 (fastest) to 6 (smallest)
+        "method": int(os.getenv("OUTPUT_WEBP_METHOD", "4")),
+    },
+    "avif": {
+        "quality": int(os.getenv("OUTPUT_AVIF_QUALITY", "60")),
+        # 0 (slowest, smallest) to 10 (fastest)
+        "speed": int(os.getenv("OUTPUT_AVIF_SPEED", "8")),
+    },
+}
+
+
+def _supported(name: str) -> bool:
+    return name == DEFAULT_FORMAT or bool(features.check(name))
+
+
+def enabled_formats() -> List[str]:
+    """
+    Formats that may be negotiated, in server preference order.
+
+    Returns:
+        list: Names from ``OUTPUT_FORMATS`` (default ``webp,jpeg``) that
+              this Pillow build can encode, always ending with JPEG
+    """
+    names = [name.strip().lower()
+             for name in os.getenv("OUTPUT_FORMATS", "webp,jpeg").split(",")]
+    enabled = [name for name in dict.fromkeys(names)
+               if name in FORMATS and _supported(name)]
+    if DEFAULT_FORMAT not in enabled:
+        enabled.append(DEFAULT_FORMAT)
+    return enabled
+
+
+def _accepted_media_types(accept: str) -> Dict[str, float]:
+    """Parse an Accept header into media type -> q-value."""
+    accepted = {}
+    for part in accept.split(","):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        if not media_type:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[media_type.lower()] = q
+    return accepted
+
+
+def negotiate_format(accept: Optional[str],
+                     available: Optional[List[str]] = None) -> str:
+    """
+    Choose the output format for a request.
+
+    The client's highest q-value wins; ties are broken by server
+    preference. Wildcards (``image/*``, ``*/*``) do not opt in to WebP or
+    AVIF, since browsers send them even when they cannot decode those
+    formats.
+
+    Args:
+        accept: The request's ``Accept`` header
+        available: Candidate formats in preference order; defaults to
+                   :func:`enabled_formats`
+
+    Returns:
+        str: Name of the format to encode
+    """
+    if available is None:
+        available = enabled_formats()
+    if not accept:
+        return DEFAULT_FORMAT
+
+    accepted = _accepted_media_types(accept)
+    best, best_q = DEFAULT_FORMAT, 0.0
+    for name in available:
+        media_type = FORMATS[name].media_type
+        q = accepted.get(media_type)
+        if q is None and name == DEFAULT_FORMAT:
+            q = accepted.get("image/*", accepted.get("*/*", 0.0))
+        if q is not None and q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def prepare_for_encoding(image: Image.Image,
+                         output_format: str = DEFAULT_FORMAT) -> Image.Image:
+    """
+    Convert a decoded image to a mode the output format can encode.
+
+    Transparency is kept for formats that support it; otherwise it is
+    flattened onto a white background instead of turning black.
+
+    Args:
+        image: Decoded source image
+        output_format: Target format name
+
+    Returns:
+        Image: An RGB or RGBA image
+    """
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or (
+        image.mode == "P" and "transparency" in image.info)
+    if not has_alpha:
+        return image if image.mode == "RGB" else image.convert("RGB")
+
+    rgba = image.convert("RGBA")
+    if FORMATS[output_format].supports_alpha:
+        return rgba
+    flattened = Image.new("RGB", rgba.size, FLATTEN_BACKGROUND)
+    flattened.paste(rgba, mask=rgba.getchannel("A"))
+    return flattened
+
+
+def encode_image(image: Image.Image,
+                 output_format: str = DEFAULT_FORMAT) -> bytes:
+    """
+    Encode an image with the configured settings of a format.
+
+    Args:
+        image: RGB or RGBA image (see :func:`prepare_for_encoding`)
+        output_format: Target format name
+
+    Returns:
+        bytes: The encoded image
+    """
+    output = io.BytesIO()
+    image.save(output, format=FORMATS[output_format].pil_format,
+               **ENCODER_OPTIONS[output_format])
+    return output.getvalue()
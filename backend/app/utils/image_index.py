@@ -0,0 +1,812 @@
+"""
+SQLite-backed registry of stored images.
+
+Maps an image ID (the saved upload filename) to its original and processed
+files plus size, mtime, content type and content hash, so routes resolve an
+image with a primary-key lookup instead of scanning the upload directories.
+The detections of each image are stored alongside as compact rows, so
+clients can fetch boxes without a render. Uploads are deduplicated by
+content hash: an image counts its references, and its files are removed
+only when the last one is released.
+"""
+
+import json
+import logging
+import mimetypes
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, \
+    Tuple
+
+from app.utils.storage import StorageBackend, StoredObject, get_storage
+
+logger = logging.getLogger(__name__)
+
+PROCESSED_PREFIX = "processed_"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id TEXT PRIMARY KEY,
+    stem TEXT NOT NULL,
+    original_path TEXT,
+    processed_path TEXT,
+    size INTEGER,
+    mtime REAL,
+    content_type TEXT,
+    hash TEXT,
+    uploaded_at REAL NOT NULL,
+    refs INTEGER NOT NULL DEFAULT 1,
+    processed_mtime REAL,
+    derivatives_mtime REAL
+);
+CREATE INDEX IF NOT EXISTS idx_images_stem ON images(stem);
+CREATE INDEX IF NOT EXISTS idx_images_hash ON images(hash);
+CREATE INDEX IF NOT EXISTS idx_images_processed_order
+    ON images(uploaded_at DESC, id DESC) WHERE processed_path IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_images_uploaded_at ON images(uploaded_at, id);
+CREATE INDEX IF NOT EXISTS idx_images_processed_path ON images(processed_path);
+
+-- Running totals kept up to date by triggers, so counting is O(1)
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS images_processed_insert
+AFTER INSERT ON images WHEN NEW.processed_path IS NOT NULL
+BEGIN
+    UPDATE counters SET value = value + 1 WHERE name = 'processed_images';
+END;
+CREATE TRIGGER IF NOT EXISTS images_processed_delete
+AFTER DELETE ON images WHEN OLD.processed_path IS NOT NULL
+BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'processed_images';
+END;
+CREATE TRIGGER IF NOT EXISTS images_processed_update
+AFTER UPDATE OF processed_path ON images
+WHEN (OLD.processed_path IS NULL) != (NEW.processed_path IS NULL)
+BEGIN
+    UPDATE counters
+    SET value = value + (CASE WHEN NEW.processed_path IS NULL
+                              THEN -1 ELSE 1 END)
+    WHERE name = 'processed_images';
+END;
+
+-- Detections of an image; boxes are a JSON array of
+-- [label, score, x, y, w, h] rows in original image pixels
+CREATE TABLE IF NOT EXISTS detections (
+    image_id TEXT PRIMARY KEY,
+    detector_key TEXT NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    boxes TEXT NOT NULL,
+    detected_at REAL NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS images_detections_delete
+AFTER DELETE ON images
+BEGIN
+    DELETE FROM detections WHERE image_id = OLD.id;
+END;
+"""
+
+# Only these files in the processed directory are listed as images
+PROCESSED_IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+
+_COLUMNS = ("id", "stem", "original_path", "processed_path", "size", "mtime",
+            "content_type", "hash", "uploaded_at", "refs", "processed_mtime",
+            "derivatives_mtime")
+
+# Columns added after the first release, with their definitions
+_ADDED_COLUMNS = {
+    "refs": "INTEGER NOT NULL DEFAULT 1",
+    "processed_mtime": "REAL",
+    "derivatives_mtime": "REAL",
+}
+
+
+@dataclass
+class ImageRecord:
+    """A stored image and the files that belong to it."""
+    id: str
+    original_path: Optional[str] = None
+    processed_path: Optional[str] = None
+    size: Optional[int] = None
+    mtime: Optional[float] = None
+    content_type: Optional[str] = None
+    hash: Optional[str] = None
+    uploaded_at: Optional[float] = None
+    # Uploads that resolved to this image (see ImageIndex.register_upload)
+    refs: int = 1
+    # When the processed image was saved and when its derivatives were
+    # generated, so listings need no storage lookups
+    processed_mtime: Optional[float] = None
+    derivatives_mtime: Optional[float] = None
+
+    @property
+    def stem(self) -> str:
+        """Image ID without its file extension."""
+        return Path(self.id).stem
+
+    @property
+    def derivatives_fresh(self) -> bool:
+        """Whether saved derivatives are not older than the processed image."""
+        return self.processed_path is not None and \
+            self.derivatives_mtime is not None and \
+            self.derivatives_mtime >= (self.processed_mtime or 0)
+
+
+@dataclass
+class DetectionRecord:
+    """Bounding boxes detected in a stored image."""
+    image_id: str
+    # Detector cache key of the image content the boxes were detected in
+    detector_key: str
+    boxes: List[Dict[str, Any]]
+    width: Optional[int] = None
+    height: Optional[int] = None
+    detected_at: Optional[float] = None
+
+
+def _pack_boxes(boxes: Iterable[Dict[str, Any]]) -> str:
+    """Serialize boxes as compact ``[label, score, x, y, w, h]`` rows."""
+    rows = [[box["label"], round(box["score"], 4), round(box["x"], 1),
+             round(box["y"], 1), round(box["w"], 1), round(box["h"], 1)]
+            for box in boxes]
+    return json.dumps(rows, separators=(",", ":"))
+
+
+def _unpack_boxes(packed: str) -> List[Dict[str, Any]]:
+    """Inverse of :func:`_pack_boxes`."""
+    return [{"label": label, "score": score, "x": x, "y": y, "w": w, "h": h}
+            for label, score, x, y, w, h in json.loads(packed)]
+
+
+class ImageIndex:
+    """Constant-time image lookups backed by a SQLite database."""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        if self.db_path.parent != Path("."):
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.db_path),
+                                     check_same_thread=False,
+                                     isolation_level=None, timeout=30.0)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        # Add columns introduced after the database was created
+        columns = {row["name"] for row in
+                   self._conn.execute("PRAGMA table_info(images)")}
+        for name, definition in _ADDED_COLUMNS.items():
+            if name not in columns:
+                self._conn.execute(
+                    f"ALTER TABLE images ADD COLUMN {name} {definition}")
+        # Seed the counter once for databases created before it existed
+        self._conn.execute(
+            "INSERT OR IGNORE INTO counters (name, value) "
+            "SELECT 'processed_images', COUNT(*) FROM images "
+            "WHERE processed_path IS NOT NULL")
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _to_record(row: Optional[sqlite3.Row]) -> Optional[ImageRecord]:
+        if row is None:
+            return None
+        values = {key: row[key] for key in row.keys() if key != "stem"}
+        return ImageRecord(**values)
+
+    def _upsert(self, record: ImageRecord, replace: bool = True) -> bool:
+        if record.uploaded_at is None:
+            record.uploaded_at = time.time()
+        values = (record.id, record.stem, record.original_path,
+                  record.processed_path, record.size, record.mtime,
+                  record.content_type, record.hash, record.uploaded_at,
+                  record.refs, record.processed_mtime,
+                  record.derivatives_mtime)
+        # An upsert (rather than INSERT OR REPLACE) fires the update
+        # triggers that maintain the counters
+        updates = ", ".join(f"{name} = excluded.{name}"
+                            for name in _COLUMNS if name != "id")
+        conflict = f"DO UPDATE SET {updates}" if replace else "DO NOTHING"
+        cursor = self._conn.execute(
+            f"INSERT INTO images ({', '.join(_COLUMNS)}) "
+            f"VALUES ({', '.join('?' for _ in _COLUMNS)}) "
+            f"ON CONFLICT(id) {conflict}",
+            values,
+        )
+        return cursor.rowcount > 0
+
+    def add(self, record: ImageRecord) -> ImageRecord:
+        """
+        Insert an image record or update the existing one with the same ID.
+
+        Args:
+            record: The image to register
+
+        Returns:
+            ImageRecord: The stored record (with ``uploaded_at`` filled in)
+        """
+        with self._lock:
+            self._upsert(record)
+        return record
+
+    def add_if_absent(self, record: ImageRecord) -> Optional[ImageRecord]:
+        """
+        Insert an image record unless one with the same ID exists, including
+        a released one that is being purged.
+
+        Args:
+            record: The image to register
+
+        Returns:
+            ImageRecord | None: The stored record, or None if the ID is taken
+        """
+        with self._lock:
+            inserted = self._upsert(record, replace=False)
+        return record if inserted else None
+
+    def add_many(self, records: Iterable[ImageRecord]) -> int:
+        """
+        Insert or update many image records in a single transaction.
+
+        Args:
+            records: The images to register
+
+        Returns:
+            int: Number of records written
+        """
+        count = 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for record in records:
+                    self._upsert(record)
+                    count += 1
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return count
+
+    def register_upload(self, record: ImageRecord) -> \
+            Tuple[ImageRecord, bool]:
+        """
+        Register an upload, deduplicating it by content hash.
+
+        If a referenced image with the same content (or the same
+        content-addressed ID) and a stored original already exists, it gains
+        a reference and is returned instead; otherwise the record is
+        inserted. Both happen in one transaction, so concurrent uploads of
+        the same content agree on a single image.
+
+        An image whose last reference was released is being purged and is
+        never revived: if the upload's ID belongs to one, the upload is
+        registered under a new ID (and original path) with a random suffix,
+        so the purge cannot remove its file.
+
+        Args:
+            record: The uploaded image, with ``hash`` set
+
+        Returns:
+            tuple: The image the upload resolved to and whether it is an
+                   existing image (whose stored original the upload must
+                   not replace)
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM images WHERE (hash = ? OR id = ?) "
+                    "AND refs > 0 AND original_path IS NOT NULL "
+                    "ORDER BY hash IS NULL, uploaded_at, id LIMIT 1",
+                    (record.hash, record.id)).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE images SET refs = refs + 1, "
+                        "hash = COALESCE(hash, ?) WHERE id = ?",
+                        (record.hash, row["id"]))
+                    existing = self._to_record(row)
+                    existing.refs += 1
+                else:
+                    pending = self._conn.execute(
+                        "SELECT 1 FROM images WHERE id = ? AND refs <= 0",
+                        (record.id,)).fetchone()
+                    if pending is not None:
+                        suffix = f"-{uuid.uuid4().hex[:8]}"
+                        record.id = f"{record.stem}{suffix}" \
+                                    f"{Path(record.id).suffix}"
+                        if record.original_path:
+                            path = Path(record.original_path)
+                            record.original_path = str(path.with_name(
+                                f"{path.stem}{suffix}{path.suffix}"))
+                    record.refs = 1
+                    self._upsert(record)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is not None:
+            return existing, True
+        return record, False
+
+    def release(self, image_id: str) -> int:
+        """
+        Drop one reference to an image.
+
+        The record is kept when the count reaches zero, as a tombstone that
+        keeps new uploads from reviving the image while the caller removes
+        its files (see :meth:`delete_released`).
+
+        Args:
+            image_id: Exact ID of the image
+
+        Returns:
+            int: References still held (0 if the image is unreferenced or
+                 unknown)
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "UPDATE images SET refs = MAX(refs - 1, 0) WHERE id = ? "
+                "RETURNING refs", (image_id,)).fetchall()
+        return rows[0][0] if rows else 0
+
+    def tombstone(self, image_id: str) -> Optional[ImageRecord]:
+        """
+        Release every reference to an image at once, so that it can be
+        purged whatever its references.
+
+        Args:
+            image_id: Exact ID of the image
+
+        Returns:
+            ImageRecord | None: The image as now stored, if it exists
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE images SET refs = 0 WHERE id = ? RETURNING *",
+                (image_id,)).fetchone()
+        return self._to_record(row)
+
+    def get(self, image_id: str) -> Optional[ImageRecord]:
+        """Look up an image by its exact ID."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM images WHERE id = ?", (image_id,)).fetchone()
+        return self._to_record(row)
+
+    def resolve(self, image_id: str) -> Optional[ImageRecord]:
+        """
+        Resolve an ID as used by the API to a stored image.
+
+        Accepts the exact ID (``<uuid>.jpg``), the ID without extension and
+        either form prefixed with ``processed_``. Every step is an indexed
+        lookup, so resolution does not depend on the number of images.
+        Images whose last reference was released are being purged and never
+        resolve.
+
+        Args:
+            image_id: ID supplied by the client
+
+        Returns:
+            ImageRecord | None: The matching image, if any
+        """
+        candidates = [image_id]
+        if image_id.startswith(PROCESSED_PREFIX):
+            candidates.append(image_id[len(PROCESSED_PREFIX):])
+
+        with self._lock:
+            for candidate in candidates:
+                row = self._conn.execute(
+                    "SELECT * FROM images WHERE id = ? AND refs > 0",
+                    (candidate,)).fetchone()
+                if row is not None:
+                    return self._to_record(row)
+
+            for candidate in candidates:
+                row = self._conn.execute(
+                    "SELECT * FROM images WHERE stem = ? AND refs > 0 "
+                    "ORDER BY uploaded_at DESC LIMIT 1",
+                    (Path(candidate).stem,)).fetchone()
+                if row is not None:
+                    return self._to_record(row)
+        return None
+
+    def update(self, image_id: str, **fields: Any) -> None:
+        """Update selected columns of an image record."""
+        unknown = set(fields) - set(_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown image index fields: {sorted(unknown)}")
+        if not fields:
+            return
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE images SET {assignments} WHERE id = ?",
+                (*fields.values(), image_id),
+            )
+
+    def set_processed(self, image_id: str, processed_path: str,
+                      mtime: Optional[float] = None) -> None:
+        """
+        Record the processed version of an image.
+
+        Args:
+            image_id: Exact ID of the image
+            processed_path: Key of the processed image
+            mtime: When it was saved; defaults to now
+        """
+        if mtime is None:
+            mtime = time.time()
+        self.update(image_id, processed_path=processed_path,
+                    processed_mtime=mtime)
+
+    def set_derivatives(self, processed_path: str,
+                        mtime: Optional[float]) -> None:
+        """
+        Record when the derivatives of a processed image were generated.
+
+        Args:
+            processed_path: Key of the processed image
+            mtime: Generation time, or None once the derivatives are removed
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE images SET derivatives_mtime = ? "
+                "WHERE processed_path = ?", (mtime, processed_path))
+
+    def delete(self, image_id: str) -> bool:
+        """
+        Remove an image record.
+
+        Returns:
+            bool: True if a record was removed
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM images WHERE id = ?", (image_id,))
+        return cursor.rowcount > 0
+
+    def delete_released(self, image_id: str) -> bool:
+        """
+        Remove the record of an image whose references were all released.
+
+        Returns:
+            bool: True if a record was removed
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM images WHERE id = ? AND refs <= 0", (image_id,))
+        return cursor.rowcount > 0
+
+    def set_detections(self, detection: DetectionRecord) -> None:
+        """
+        Store the detections of an image, replacing earlier ones.
+
+        Args:
+            detection: The boxes and the detector key they belong to
+        """
+        if detection.detected_at is None:
+            detection.detected_at = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO detections (image_id, detector_key, "
+                "width, height, boxes, detected_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (detection.image_id, detection.detector_key, detection.width,
+                 detection.height, _pack_boxes(detection.boxes),
+                 detection.detected_at),
+            )
+
+    def get_detections(self, image_id: str) -> Optional[DetectionRecord]:
+        """Look up the stored detections of an image by its exact ID."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM detections WHERE image_id = ?",
+                (image_id,)).fetchone()
+        if row is None:
+            return None
+        return DetectionRecord(
+            image_id=row["image_id"],
+            detector_key=row["detector_key"],
+            boxes=_unpack_boxes(row["boxes"]),
+            width=row["width"],
+            height=row["height"],
+            detected_at=row["detected_at"],
+        )
+
+    def count(self) -> int:
+        """Return the number of registered images."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def count_processed(self) -> int:
+        """Return the number of processed images (maintained counter)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM counters WHERE name = 'processed_images'"
+            ).fetchone()
+        return row[0] if row else 0
+
+    def list_processed(self, limit: int, offset: int = 0,
+                       after: Optional[Tuple[float, str]] = None) -> \
+            List[ImageRecord]:
+        """
+        List processed images, newest upload first.
+
+        Both modes walk the ``(uploaded_at, id)`` index. Keyset pagination
+        with ``after`` seeks straight to the cursor position, so its cost
+        does not grow with the size of the store.
+
+        Args:
+            limit: Maximum number of records to return
+            offset: Number of records to skip (page-based pagination)
+            after: ``(uploaded_at, id)`` of the last record already seen
+
+        Returns:
+            list: Image records in listing order
+        """
+        query = "SELECT * FROM images WHERE processed_path IS NOT NULL"
+        params: List[Any] = []
+        if after is not None:
+            query += " AND (uploaded_at, id) < (?, ?)"
+            params.extend(after)
+        query += " ORDER BY uploaded_at DESC, id DESC LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._to_record(row) for row in rows]
+
+    def list_uploaded_before(self, cutoff: float, limit: int,
+                             after: Optional[Tuple[float, str]] = None) -> \
+            List[ImageRecord]:
+        """
+        List images uploaded before a point in time, oldest first.
+
+        Args:
+            cutoff: Upload time (epoch seconds) the images must predate
+            limit: Maximum number of records to return
+            after: ``(uploaded_at, id)`` of the last record already seen
+
+        Returns:
+            list: Image records in upload order
+        """
+        query = "SELECT * FROM images WHERE uploaded_at < ?"
+        params: List[Any] = [cutoff]
+        if after is not None:
+            query += " AND (uploaded_at, id) > (?, ?)"
+            params.extend(after)
+        query += " ORDER BY uploaded_at, id LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._to_record(row) for row in rows]
+
+    def count_uploaded_before(self, cutoff: float) -> int:
+        """Return the number of images uploaded before ``cutoff``."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM images WHERE uploaded_at < ?",
+                (cutoff,)).fetchone()[0]
+
+    def list_released(self) -> List[ImageRecord]:
+        """
+        List images whose last reference was released but whose record is
+        still present (their deletion was interrupted).
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM images WHERE refs <= 0").fetchall()
+        return [self._to_record(row) for row in rows]
+
+    def list_orphans(self, cutoff: float) -> List[ImageRecord]:
+        """
+        List images uploaded before ``cutoff`` that have only one of their
+        files: an original never processed, or a processed image whose
+        original is gone.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM images WHERE uploaded_at < ? AND "
+                "(original_path IS NULL) != (processed_path IS NULL)",
+                (cutoff,)).fetchall()
+        return [self._to_record(row) for row in rows]
+
+    def processed_paths(self) -> Set[str]:
+        """Return the keys of all processed images."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT processed_path FROM images "
+                "WHERE processed_path IS NOT NULL").fetchall()
+        return {row[0] for row in rows}
+
+    def _write_batch(self, func: Callable[[Any], None],
+                     items: List[Any]) -> None:
+        # One short transaction per batch, so other writers are held up
+        # for a batch rather than the whole reconciliation
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for item in items:
+                    func(item)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def reconcile(self, original_dir: Path, processed_dir: Path,
+                  storage: Optional[StorageBackend] = None,
+                  batch_size: int = 500,
+                  grace_seconds: float = 300) -> Dict[str, int]:
+        """
+        Bring the index in line with the stored files.
+
+        Registers files that are missing from the index, refreshes records
+        whose size or mtime changed, attaches processed files to their
+        originals and drops records whose files are gone. Runs at startup
+        and from the garbage collector. Files missing from the listing are
+        checked again before their records change. Uploads are registered
+        before their original is moved into place, so the original of an
+        image uploaded less than ``grace_seconds`` ago counts as present
+        even when it is not found.
+
+        Work is done in batches of ``batch_size`` records, each in its own
+        short transaction. Storage is listed and checked without holding
+        the index lock, and a record is only changed if its paths are still
+        the ones that were checked.
+
+        Args:
+            original_dir: Directory (key prefix) holding uploaded originals
+            processed_dir: Directory (key prefix) holding processed images
+            storage: Backend holding the files; defaults to
+                     :func:`~app.utils.storage.get_storage`
+            batch_size: Records written per transaction
+            grace_seconds: Age below which a missing original is not
+                           treated as gone
+
+        Returns:
+            dict: Number of records added, updated and removed
+        """
+        if storage is None:
+            storage = get_storage()
+        recent = time.time() - grace_seconds
+        # List before taking the lock; remote listings can be slow
+        originals = list(storage.list(str(original_dir)))
+        processed_files = [
+            obj for obj in storage.list(str(processed_dir))
+            if Path(obj.name).suffix.lower() in PROCESSED_IMAGE_SUFFIXES]
+
+        stats = {"added": 0, "updated": 0, "removed": 0}
+        seen_originals = {obj.name for obj in originals}
+        seen_processed = set()
+
+        def sync_original(obj: StoredObject) -> None:
+            existing = self.get(obj.name)
+            if existing is None:
+                self.add(ImageRecord(
+                    id=obj.name,
+                    original_path=obj.key,
+                    size=obj.size,
+                    mtime=obj.mtime,
+                    content_type=mimetypes.guess_type(obj.name)[0],
+                    uploaded_at=obj.mtime,
+                ))
+                stats["added"] += 1
+            elif (existing.original_path != obj.key or
+                  existing.size != obj.size or
+                  existing.mtime != obj.mtime):
+                # Content may have changed; drop the stale hash
+                self.update(obj.name, original_path=obj.key,
+                            size=obj.size, mtime=obj.mtime, hash=None)
+                stats["updated"] += 1
+
+        def sync_processed(obj: StoredObject) -> None:
+            image_id = obj.name
+            if image_id.startswith(PROCESSED_PREFIX):
+                image_id = image_id[len(PROCESSED_PREFIX):]
+            seen_processed.add(image_id)
+            existing = self.get(image_id)
+            if existing is None:
+                self.add(ImageRecord(
+                    id=image_id,
+                    processed_path=obj.key,
+                    content_type=mimetypes.guess_type(obj.name)[0],
+                    uploaded_at=obj.mtime,
+                    processed_mtime=obj.mtime,
+                ))
+                stats["added"] += 1
+            elif (existing.processed_path != obj.key or
+                  existing.processed_mtime is None or
+                  obj.mtime > existing.processed_mtime):
+                # Replaced behind the index's back; this also marks older
+                # derivatives stale
+                self.set_processed(image_id, obj.key, obj.mtime)
+                stats["updated"] += 1
+
+        def drop_missing(check: Tuple[sqlite3.Row, bool, bool]) -> None:
+            row, has_original, has_processed = check
+            # Only if the record still points at the files that were checked
+            match = "id = ? AND original_path IS ? AND processed_path IS ?"
+            params = (row["id"], row["original_path"], row["processed_path"])
+            if not has_original and not has_processed:
+                cursor = self._conn.execute(
+                    f"DELETE FROM images WHERE {match}", params)
+                stats["removed"] += cursor.rowcount
+                return
+            changes = []
+            if row["original_path"] and not has_original:
+                changes.append("original_path = NULL")
+            if row["processed_path"] and not has_processed:
+                changes.append("processed_path = NULL")
+            if changes:
+                cursor = self._conn.execute(
+                    f"UPDATE images SET {', '.join(changes)} WHERE {match}",
+                    params)
+                stats["updated"] += cursor.rowcount
+
+        for start in range(0, len(originals), batch_size):
+            self._write_batch(sync_original,
+                              originals[start:start + batch_size])
+        for start in range(0, len(processed_files), batch_size):
+            self._write_batch(sync_processed,
+                              processed_files[start:start + batch_size])
+
+        last_id = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, original_path, processed_path, uploaded_at "
+                    "FROM images WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+
+            # Storage checks (a request each with a remote backend) run
+            # outside the lock
+            checks = []
+            for row in rows:
+                has_original = row["id"] in seen_originals or (
+                    row["original_path"] is not None and
+                    (row["uploaded_at"] >= recent or
+                     storage.exists(row["original_path"])))
+                has_processed = row["id"] in seen_processed or (
+                    row["processed_path"] is not None and
+                    storage.exists(row["processed_path"]))
+                gone = (row["original_path"] and not has_original) or \
+                    (row["processed_path"] and not has_processed)
+                if gone or not (has_original or has_processed):
+                    checks.append((row, has_original, has_processed))
+            if checks:
+                self._write_batch(drop_missing, checks)
+
+        logger.info(f"Image index reconciled: {stats}")
+        return stats
+
+
+_index: Optional[ImageIndex] = None
+
+
+def get_image_index() -> ImageIndex:
+    """
+    Return the process-wide image index, configured from the environment.
+
+    Returns:
+        ImageIndex: The shared index instance
+    """
+    global _index
+    if _index is None:
+        _index = ImageIndex(Path(os.getenv("IMAGE_INDEX_PATH",
+                                           "image_index.db")))
+    return _index
@@ -0,0 +1,117 @@
+"""
+Preprocessing of images before they are sent to Azure Computer Vision.
+
+Object detection works just as well on a downscaled copy, so oversized
+uploads are reduced to a maximum dimension and re-encoded as a compact JPEG
+before the request. JPEGs are decoded at reduced scale with Pillow's
+``draft()``, which skips most of the decoding work for large photos. The
+scale factors are kept so detected rectangles can be mapped back to the
+original image.
+"""
+
+import io
+import logging
+import os
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Longest side of the image sent to Azure (0 disables downscaling)
+AZURE_MAX_IMAGE_DIMENSION = int(os.getenv("AZURE_MAX_IMAGE_DIMENSION", "1024"))
+# JPEG quality of the downscaled copy
+AZURE_IMAGE_QUALITY = int(os.getenv("AZURE_IMAGE_QUALITY", "85"))
+# Azure rejects images smaller than 50x50 pixels
+AZURE_MIN_IMAGE_DIMENSION = 50
+
+
+@dataclass
+class PreparedImage:
+    """Image bytes to send for detection and their scale to the original."""
+    data: bytes
+    scale_x: float = 1.0
+    scale_y: float = 1.0
+
+    @property
+    def resized(self) -> bool:
+        """Whether the image differs in size from the original."""
+        return self.scale_x != 1.0 or self.scale_y != 1.0
+
+
+def image_size(image_data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Read the pixel size of an encoded image from its header.
+
+    Args:
+        image_data: Encoded image bytes
+
+    Returns:
+        tuple | None: ``(width, height)``, or None if the image cannot be
+                      identified
+    """
+    try:
+        return Image.open(io.BytesIO(image_data)).size
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def prepare_for_detection(image_data: bytes,
+                          max_dimension: Optional[int] = None,
+                          quality: Optional[int] = None) -> PreparedImage:
+    """
+    Downscale an image for detection if it exceeds the maximum dimension.
+
+    Images that are small enough, or that cannot be decoded, are returned
+    unchanged so Azure still sees (and reports on) the original upload.
+
+    Args:
+        image_data: Original image bytes
+        max_dimension: Longest side in pixels (defaults to
+                       ``AZURE_MAX_IMAGE_DIMENSION``; 0 disables resizing)
+        quality: JPEG quality of the downscaled copy (defaults to
+                 ``AZURE_IMAGE_QUALITY``)
+
+    Returns:
+        PreparedImage: Bytes to send and factors mapping them back to the
+                       original coordinates
+    """
+    if max_dimension is None:
+        max_dimension = AZURE_MAX_IMAGE_DIMENSION
+    if quality is None:
+        quality = AZURE_IMAGE_QUALITY
+    if max_dimension <= 0:
+        return PreparedImage(image_data)
+
+    try:
+        image = Image.open(io.BytesIO(image_data))
+        width, height = image.size
+        if max(width, height) <= max_dimension:
+            return PreparedImage(image_data)
+
+        # Keep the short side above Azure's minimum for very long images
+        ratio = max(max_dimension / max(width, height),
+                    AZURE_MIN_IMAGE_DIMENSION / min(width, height))
+        if ratio >= 1:
+            return PreparedImage(image_data)
+        target = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+
+        # Let the JPEG decoder skip straight to a 1/2, 1/4 or 1/8 scale
+        image.draft("RGB", target)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image = image.resize(target, Image.Resampling.BILINEAR,
+                             reducing_gap=2.0)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning(f"Sending original image, downscaling failed: {e}")
+        return PreparedImage(image_data)
+
+    logger.info(f"Downscaled image {width}x{height} -> "
+                f"{target[0]}x{target[1]} for detection "
+                f"({len(image_data)} -> {buffer.tell()} bytes)")
+    return PreparedImage(buffer.getvalue(), scale_x=width / target[0],
+                         scale_y=height / target[1])
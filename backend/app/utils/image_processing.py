@@ -1,16 +1,231 @@
 """
-Utility functions for image processing and drawing bounding boxes.
+Bounding-box rendering engine shared by every route.
+
+Boxes are drawn in two passes over the whole batch: first their geometry
+(pixel coordinates clipped to the image, outline strips, fill and label
+positions) is computed, then everything is painted with Pillow's C-level
+region fills and masked pastes, so no pixel is touched from Python.
+Translucent fills are alpha-blended into the image, and labels are pasted
+from the cached sprites of :mod:`app.utils.label_rendering`.
 """
 
+import hashlib
 import io
-from typing import List
+import json
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, \
+    TYPE_CHECKING
+
+from PIL import Image, ImageColor
+
+from app.utils.image_encoding import DEFAULT_FORMAT, ENCODER_OPTIONS, \
+    FLATTEN_BACKGROUND, encode_image, prepare_for_encoding
+from app.utils.label_rendering import LABEL_PADDING, font_settings, \
+    get_label_renderer
+
+if TYPE_CHECKING:
+    from app.routes.detection import BoundingBox
+
+# Colors cycle through the boxes of an image
+PALETTE = (
+    '#FF0000',  # Red
+    '#00FF00',  # Green
+    '#0000FF',  # Blue
+    '#FFFF00',  # Yellow
+    '#FF00FF',  # Magenta
+    '#00FFFF',  # Cyan
+    '#FFA500',  # Orange
+    '#800080',  # Purple
+    '#FFC0CB',  # Pink
+    '#A52A2A',  # Brown
+)
+_PALETTE_RGB = tuple(ImageColor.getrgb(color) for color in PALETTE)
+
+OUTLINE_WIDTH = 3
+# Distance between a box and a label placed below it
+LABEL_GAP = 5
+
+# Opacity of the fill inside each box (0 draws outlines only)
+BOX_FILL_ALPHA = float(os.getenv("BOX_FILL_ALPHA", "0"))
+
+Rect = Tuple[int, int, int, int]
+
+
+class BoxGeometry(NamedTuple):
+    """Pixel geometry of one box, clipped to the image."""
+    color: str
+    rgb: Tuple[int, int, int]
+    outline: List[Rect]
+    fill: Optional[Rect]
+    x1: int
+    y1: int
+    y2: int
+
+
+def _clip(rect: Rect, width: int, height: int) -> Optional[Rect]:
+    """Clip a half-open rectangle to the image, or None if it is empty."""
+    left, top = max(rect[0], 0), max(rect[1], 0)
+    right, bottom = min(rect[2], width), min(rect[3], height)
+    if left >= right or top >= bottom:
+        return None
+    return left, top, right, bottom
+
+
+def box_geometry(boxes: Sequence["BoundingBox"], width: int, height: int,
+                 outline_width: int = OUTLINE_WIDTH) -> List[BoxGeometry]:
+    """
+    Compute the pixel geometry of a batch of boxes.
+
+    Box coordinates are absolute pixels (as returned by Azure). Outlines are
+    drawn inside the box, ``outline_width`` pixels wide, and split into four
+    strips so they can be painted as plain region fills.
+
+    Args:
+        boxes: Boxes to draw
+        width: Image width
+        height: Image height
+        outline_width: Outline thickness in pixels
+
+    Returns:
+        list: One :class:`BoxGeometry` per box, in drawing order
+    """
+    geometry = []
+    for i, box in enumerate(boxes):
+        x1, y1 = int(box.x), int(box.y)
+        x2, y2 = int(box.x + box.w), int(box.y + box.h)
+        # Right and bottom edges are inclusive, as with ImageDraw
+        right, bottom = x2 + 1, y2 + 1
+        w = max(0, min(outline_width, right - x1, bottom - y1))
+        strips = [] if w == 0 else [
+            (x1, y1, right, y1 + w),          # top
+            (x1, bottom - w, right, bottom),  # bottom
+            (x1, y1 + w, x1 + w, bottom - w),  # left
+            (right - w, y1 + w, right, bottom - w),  # right
+        ]
+        geometry.append(BoxGeometry(
+            color=PALETTE[i % len(PALETTE)],
+            rgb=_PALETTE_RGB[i % len(PALETTE)],
+            outline=[rect for rect in (_clip(strip, width, height)
+                                       for strip in strips) if rect],
+            fill=_clip((x1 + w, y1 + w, right - w, bottom - w), width,
+                       height) if w else None,
+            x1=x1, y1=y1, y2=y2,
+        ))
+    return geometry
+
+
+def draw_boxes(image: Image.Image, boxes: Sequence["BoundingBox"],
+               fill_alpha: Optional[float] = None) -> None:
+    """
+    Draw a batch of boxes with labels onto an image in place.
+
+    Args:
+        image: RGB or RGBA image to draw on
+        boxes: Boxes to draw
+        fill_alpha: Opacity of the box fill from 0 to 1; defaults to
+                    ``BOX_FILL_ALPHA``
+    """
+    if fill_alpha is None:
+        fill_alpha = BOX_FILL_ALPHA
+    alpha = round(max(0.0, min(1.0, fill_alpha)) * 255)
+    geometry = box_geometry(boxes, *image.size)
+    # Opaque colors in the image's mode
+    opaque = "A" in image.getbands()
+
+    # Translucent fills first, so outlines and labels stay crisp on top
+    if alpha:
+        masks: Dict[Tuple[int, int], Image.Image] = {}
+        for box in geometry:
+            if box.fill is None:
+                continue
+            size = (box.fill[2] - box.fill[0], box.fill[3] - box.fill[1])
+            mask = masks.get(size)
+            if mask is None:
+                mask = masks[size] = Image.new("L", size, alpha)
+            image.paste(box.rgb + (255,) if opaque else box.rgb, box.fill,
+                        mask)
 
-from PIL import Image, ImageDraw, ImageFont
+    for box in geometry:
+        color = box.rgb + (255,) if opaque else box.rgb
+        for rect in box.outline:
+            image.paste(color, rect)
 
-from app.routes.detection import BoundingBox
+    labels = get_label_renderer()
+    for box, source in zip(geometry, boxes):
+        labels.draw_label(image, source.label, source.score, box.color,
+                          box.x1, box.y1, box.y2, gap=LABEL_GAP)
 
 
-def draw_bounding_boxes(image_data: bytes, boxes: List[BoundingBox]) -> bytes:
+def render_boxes(image_data: bytes, boxes: Sequence["BoundingBox"],
+                 fill_alpha: Optional[float] = None,
+                 output_format: str = DEFAULT_FORMAT) -> \
+        Tuple[bytes, Dict[str, float]]:
+    """
+    Decode an image, draw boxes on it and encode it.
+
+    Args:
+        image_data: Original image as bytes
+        boxes: Boxes to draw
+        fill_alpha: Opacity of the box fill; defaults to ``BOX_FILL_ALPHA``
+        output_format: Output format name (see
+                       :mod:`app.utils.image_encoding`)
+
+    Returns:
+        tuple: The encoded image and seconds spent in the ``decode``,
+               ``draw`` and ``encode`` steps
+    """
+    started = time.perf_counter()
+
+    # Open the image in a mode the output format can encode
+    image = Image.open(io.BytesIO(image_data))
+    image.load()
+    image = prepare_for_encoding(image, output_format)
+    decoded = time.perf_counter()
+
+    draw_boxes(image, boxes, fill_alpha)
+    drawn = time.perf_counter()
+
+    encoded = encode_image(image, output_format)
+
+    timings = {
+        "decode": decoded - started,
+        "draw": drawn - decoded,
+        "encode": time.perf_counter() - drawn,
+    }
+    return encoded, timings
+
+
+def render_settings_key(output_format: str = DEFAULT_FORMAT) -> str:
+    """
+    Fingerprint the settings that change how a render looks or encodes.
+
+    Cached renders are keyed by it, so changing the box style, the label
+    font or the encoder options never serves a render made with the old
+    settings.
+
+    Args:
+        output_format: Output format name
+
+    Returns:
+        str: Short hex digest of the box, label and encoder settings
+    """
+    settings = {
+        "palette": PALETTE,
+        "outline_width": OUTLINE_WIDTH,
+        "label_gap": LABEL_GAP,
+        "label_padding": LABEL_PADDING,
+        "fill_alpha": BOX_FILL_ALPHA,
+        "font": font_settings(),
+        "background": FLATTEN_BACKGROUND,
+        "encoder": ENCODER_OPTIONS.get(output_format, {}),
+    }
+    encoded = json.dumps(settings, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:12]
+
+
+def draw_bounding_boxes(image_data: bytes,
+                        boxes: Sequence["BoundingBox"]) -> bytes:
     """
     Draw bounding boxes on an image and return the modified image.
 
@@ -21,90 +236,4 @@ def draw_bounding_boxes(image_data: bytes, boxes: List[BoundingBox]) -> bytes:
     Returns:
         bytes: Modified image with bounding boxes drawn on it
     """
-    # Open the image from bytes
-    image = Image.open(io.BytesIO(image_data))
-    
-    # Convert to RGB if necessary (for JPEG output)
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
-    
-    # Create a drawing context
-    draw = ImageDraw.Draw(image)
-    
-    # Define colors for different objects (will cycle through these)
-    colors = [
-        '#FF0000',  # Red
-        '#00FF00',  # Green
-        '#0000FF',  # Blue
-        '#FFFF00',  # Yellow
-        '#FF00FF',  # Magenta
-        '#00FFFF',  # Cyan
-        '#FFA500',  # Orange
-    ]
-    
-    # Try to load a font
-    try:
-        # Try to use Arial for Windows
-        font = ImageFont.truetype("arial.ttf", 20)
-    except (OSError, IOError):
-        try:
-            # Try default font
-            font = ImageFont.load_default()
-        except Exception:
-            font = None
-    
-    # Draw each bounding box
-    for i, box in enumerate(boxes):
-        # Get coordinates
-        x1 = int(box.x)
-        y1 = int(box.y)
-        x2 = int(box.x + box.w)
-        y2 = int(box.y + box.h)
-        
-        # Choose color for this box
-        color = colors[i % len(colors)]
-        
-        # Draw rectangle
-        draw.rectangle(
-            [(x1, y1), (x2, y2)],
-            outline=color,
-            width=3
-        )
-        
-        # Prepare label text
-        label = f"{box.label} ({box.score:.2f})"
-        
-        # Calculate text background
-        if font:
-            bbox = draw.textbbox((0, 0), label, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-        else:
-            # Estimate text size if no font available
-            text_width = len(label) * 8
-            text_height = 15
-            
-        # Draw label background
-        label_x = x1
-        label_y = y1 - text_height - 4 if y1 > text_height + 4 else y2 + 4
-        
-        draw.rectangle(
-            [(label_x, label_y), 
-             (label_x + text_width + 4, label_y + text_height + 4)],
-            fill=color
-        )
-        
-        # Draw text
-        draw.text(
-            (label_x + 2, label_y + 2),
-            label,
-            fill='white',
-            font=font
-        )
-    
-    # Convert back to bytes
-    output = io.BytesIO()
-    image.save(output, format='JPEG', quality=95)
-    output.seek(0)
-    
-    return output.getvalue()
\ No newline at end of file
+    return render_boxes(image_data, boxes)[0]
@@ -0,0 +1,447 @@
+"""
+Background job queue for long-running work such as object detection.
+
+Requests enqueue a job and return immediately; a pool of in-process worker
+tasks runs the jobs and records their status, which clients poll or follow
+as server-sent events. Job state lives behind the :class:`JobBackend`
+interface: in memory for a single process, or in the shared state database
+so that every worker process can run and report any job.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, \
+    Optional, Set, Tuple
+
+from fastapi import HTTPException
+
+from app.utils.shared_state import SharedState, get_shared_state, \
+    shared_state_enabled
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TERMINAL_STATES = (SUCCEEDED, FAILED)
+
+
+@dataclass
+class Job:
+    """A unit of background work and its outcome."""
+    kind: str
+    payload: Dict[str, Any]
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = QUEUED
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    status_code: Optional[int] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    # Optional in-process input (e.g. image bytes already in memory); it is
+    # never serialized, so handlers must cope with it being absent
+    data: Optional[bytes] = field(default=None, repr=False, compare=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the job for API responses and storage."""
+        values = asdict(self)
+        values.pop("data")
+        return values
+
+
+class JobBackend(ABC):
+    """Storage and hand-off of jobs between producers and workers."""
+
+    @abstractmethod
+    async def enqueue(self, job: Job) -> None:
+        """Persist a new job and make it available to workers."""
+
+    @abstractmethod
+    async def dequeue(self) -> Optional[Job]:
+        """Claim the next queued job, or return None if there is none."""
+
+    @abstractmethod
+    async def save(self, job: Job) -> None:
+        """Persist the current state of a job."""
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[Job]:
+        """Load a job by ID."""
+
+    @abstractmethod
+    async def queued_count(self) -> int:
+        """Number of jobs waiting for a worker."""
+
+    async def heartbeat(self, job: Job) -> None:
+        """Record that the worker running a job is still alive."""
+
+
+class InMemoryJobBackend(JobBackend):
+    """
+    Job backend for a single process.
+
+    Finished jobs expire after a TTL, and at most ``max_finished`` of them
+    are kept (oldest dropped first). Both limits are applied whenever a job
+    finishes, and a finished job's in-memory input is released at once.
+    """
+
+    def __init__(self, ttl_seconds: float = 3600, max_finished: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_finished = max_finished
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Deque[str] = deque()
+        # Finished job IDs in order of completion
+        self._finished: "OrderedDict[str, float]" = OrderedDict()
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        while self._finished:
+            job_id, finished_at = next(iter(self._finished.items()))
+            if finished_at >= cutoff and \
+                    len(self._finished) <= self.max_finished:
+                break
+            del self._finished[job_id]
+            self._jobs.pop(job_id, None)
+
+    async def enqueue(self, job: Job) -> None:
+        self._expire()
+        self._jobs[job.id] = job
+        self._queue.append(job.id)
+
+    async def dequeue(self) -> Optional[Job]:
+        while self._queue:
+            job = self._jobs.get(self._queue.popleft())
+            if job is not None and job.status == QUEUED:
+                return job
+        return None
+
+    async def save(self, job: Job) -> None:
+        self._jobs[job.id] = job
+        if job.status in TERMINAL_STATES:
+            job.data = None
+            self._finished[job.id] = job.finished_at or time.time()
+            self._expire()
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def queued_count(self) -> int:
+        return len(self._queue)
+
+
+class SqliteJobBackend(JobBackend):
+    """
+    Job backend shared by worker processes through the shared state database.
+
+    Any worker may claim a queued job; the claim is a single conditional
+    update, so each job runs once. In-memory input (``Job.data``) stays in
+    the submitting process, which claims its own jobs first; a job run by
+    another worker gets no data and its handler re-reads its input. Expired
+    jobs, and the input of jobs other workers claimed, are pruned whenever
+    a job is queued or finishes.
+
+    Workers send heartbeats while a job runs. A running job without one for
+    ``stale_seconds`` (its worker died) is queued again, up to
+    ``max_attempts`` runs in total, after which it fails. Database calls run
+    in worker threads, so waiting for the database lock never blocks the
+    event loop.
+    """
+
+    def __init__(self, state: SharedState, ttl_seconds: float = 3600,
+                 stale_seconds: float = 60, max_attempts: int = 3):
+        self.state = state
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_attempts = max_attempts
+        self._data: Dict[str, bytes] = {}
+        self._next_recovery = 0.0
+
+    @staticmethod
+    def _to_job(row: Optional[sqlite3.Row]) -> Optional[Job]:
+        if row is None:
+            return None
+        return Job(
+            id=row["id"], kind=row["kind"],
+            payload=json.loads(row["payload"]), status=row["status"],
+            result=json.loads(row["result"]) if row["result"] else None,
+            error=row["error"], status_code=row["status_code"],
+            created_at=row["created_at"], started_at=row["started_at"],
+            finished_at=row["finished_at"])
+
+    def _expire(self, pending: Tuple[str, ...]) -> Set[str]:
+        """Delete expired jobs; return the IDs in ``pending`` still queued."""
+        self.state.execute("DELETE FROM jobs WHERE finished_at < ?",
+                           (time.time() - self.ttl_seconds,))
+        if not pending:
+            return set()
+        placeholders = ", ".join("?" for _ in pending)
+        return {row["id"] for row in self.state.execute(
+            f"SELECT id FROM jobs WHERE status = '{QUEUED}' "
+            f"AND id IN ({placeholders})", pending)}
+
+    def _recover_stale(self) -> None:
+        """Requeue (or fail) running jobs whose worker stopped."""
+        now = time.time()
+        cutoff = now - self.stale_seconds
+        with self.state.transaction() as conn:
+            failed = conn.execute(
+                f"UPDATE jobs SET status = '{FAILED}', status_code = 500, "
+                f"error = 'Job failed because its worker stopped', "
+                f"finished_at = ? WHERE status = '{RUNNING}' "
+                f"AND heartbeat_at < ? AND attempts >= ?",
+                (now, cutoff, self.max_attempts)).rowcount
+            requeued = conn.execute(
+                f"UPDATE jobs SET status = '{QUEUED}', started_at = NULL, "
+                f"heartbeat_at = NULL WHERE status = '{RUNNING}' "
+                f"AND heartbeat_at < ?", (cutoff,)).rowcount
+        if failed or requeued:
+            logger.warning(f"Recovered jobs of stopped workers: {requeued} "
+                           f"requeued, {failed} failed")
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        if time.monotonic() >= self._next_recovery:
+            self._next_recovery = time.monotonic() + self.stale_seconds / 4
+            self._recover_stale()
+        # Look before taking the write lock; idle polls stay read-only
+        if not self.state.execute(
+                f"SELECT 1 FROM jobs WHERE status = '{QUEUED}' LIMIT 1"):
+            return None
+        now = time.time()
+        rows = self.state.execute(
+            f"UPDATE jobs SET status = '{RUNNING}', started_at = ?, "
+            f"heartbeat_at = ?, attempts = attempts + 1 "
+            f"WHERE id = (SELECT id FROM jobs WHERE status = '{QUEUED}' "
+            f"ORDER BY origin = ? DESC, created_at LIMIT 1) RETURNING *",
+            (now, now, self.state.owner))
+        return rows[0] if rows else None
+
+    async def _prune(self) -> None:
+        pending = tuple(self._data)
+        queued = await asyncio.to_thread(self._expire, pending)
+        for job_id in set(pending) - queued:
+            # Another worker claimed the job; its input is not needed
+            self._data.pop(job_id, None)
+
+    async def enqueue(self, job: Job) -> None:
+        await self._prune()
+        if job.data is not None:
+            self._data[job.id] = job.data
+        await asyncio.to_thread(
+            self.state.execute,
+            "INSERT INTO jobs (id, kind, payload, status, created_at, origin) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (job.id, job.kind, json.dumps(job.payload), job.status,
+             job.created_at, self.state.owner))
+
+    async def dequeue(self) -> Optional[Job]:
+        job = self._to_job(await asyncio.to_thread(self._claim))
+        if job is not None:
+            job.data = self._data.pop(job.id, None)
+        return job
+
+    async def save(self, job: Job) -> None:
+        await asyncio.to_thread(
+            self.state.execute,
+            "UPDATE jobs SET status = ?, result = ?, error = ?, "
+            "status_code = ?, started_at = ?, finished_at = ?, "
+            "heartbeat_at = ? WHERE id = ?",
+            (job.status,
+             json.dumps(job.result) if job.result is not None else None,
+             job.error, job.status_code, job.started_at, job.finished_at,
+             time.time(), job.id))
+        if job.status in TERMINAL_STATES:
+            job.data = None
+            self._data.pop(job.id, None)
+            await self._prune()
+
+    async def heartbeat(self, job: Job) -> None:
+        await asyncio.to_thread(
+            self.state.execute,
+            f"UPDATE jobs SET heartbeat_at = ? WHERE id = ? "
+            f"AND status = '{RUNNING}'", (time.time(), job.id))
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        rows = await asyncio.to_thread(
+            self.state.execute, "SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return self._to_job(rows[0] if rows else None)
+
+    async def queued_count(self) -> int:
+        rows = await asyncio.to_thread(
+            self.state.execute,
+            f"SELECT COUNT(*) FROM jobs WHERE status = '{QUEUED}'")
+        return rows[0][0]
+
+
+JobHandler = Callable[[Job], Awaitable[Dict[str, Any]]]
+
+
+class JobManager:
+    """Runs queued jobs on a pool of asyncio worker tasks."""
+
+    def __init__(self, backend: JobBackend, workers: int = 4,
+                 poll_interval: float = 0.5, heartbeat_interval: float = 10):
+        self.backend = backend
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self._handlers: Dict[str, JobHandler] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        """Register the coroutine that runs jobs of the given kind."""
+        self._handlers[kind] = handler
+
+    def start(self) -> None:
+        """Start the worker tasks on the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._tasks:
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(n))
+                       for n in range(self.workers)]
+        logger.info(f"Job manager started with {self.workers} workers")
+
+    async def stop(self) -> None:
+        """Cancel the worker tasks."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+
+    async def submit(self, kind: str, payload: Dict[str, Any],
+                     data: Optional[bytes] = None) -> Job:
+        """
+        Queue a job for background execution.
+
+        Args:
+            kind: Registered job kind
+            payload: JSON-serializable arguments for the handler
+            data: Optional in-memory input handed to the handler as-is
+
+        Returns:
+            Job: The queued job
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+        self.start()
+        job = Job(kind=kind, payload=payload, data=data)
+        await self.backend.enqueue(job)
+        self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        """Load a job by ID."""
+        return await self.backend.get(job_id)
+
+    async def _worker(self, number: int) -> None:
+        while True:
+            job: Optional[Job] = None
+            try:
+                self._wakeup.clear()
+                job = await self.backend.dequeue()
+                if job is None:
+                    # Sleep until new work arrives (or poll a shared
+                    # backend)
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(),
+                                               self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(job)
+            except Exception as e:
+                # A backend error (e.g. the shared database is locked) must
+                # not end the worker; a job whose state could not be saved
+                # is recovered once its heartbeats stop
+                logger.error(f"Job worker {number} failed "
+                             f"(job {job.id if job else None}): {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _run(self, job: Job) -> None:
+        job.status = RUNNING
+        job.started_at = time.time()
+        await self.backend.save(job)
+
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            job.result = await self._handlers[job.kind](job)
+            job.status = SUCCEEDED
+        except HTTPException as e:
+            job.status = FAILED
+            job.status_code = e.status_code
+            job.error = str(e.detail)
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {e}")
+            job.status = FAILED
+            job.status_code = 500
+            job.error = "Job failed due to an unexpected error"
+        finally:
+            heartbeat.cancel()
+
+        job.finished_at = time.time()
+        job.data = None  # Release the input as soon as the job is done
+        await self.backend.save(job)
+
+    async def _heartbeat(self, job: Job) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.backend.heartbeat(job)
+            except Exception as e:
+                logger.warning(f"Heartbeat of job {job.id} failed: {e}")
+
+    async def stats(self) -> Dict[str, Any]:
+        """
+        Report worker and queue state.
+
+        Returns:
+            dict: Worker count, running flag and queued jobs
+        """
+        return {
+            "workers": self.workers,
+            "running": bool(self._tasks),
+            "queued": await self.backend.queued_count(),
+        }
+
+
+_manager: Optional[JobManager] = None
+
+
+def get_job_manager() -> JobManager:
+    """
+    Return the process-wide job manager, configured from the environment.
+
+    Returns:
+        JobManager: The shared manager
+    """
+    global _manager
+    if _manager is None:
+        ttl_seconds = float(os.getenv("JOB_TTL_SECONDS", "3600"))
+        if shared_state_enabled():
+            backend: JobBackend = SqliteJobBackend(
+                get_shared_state(), ttl_seconds=ttl_seconds,
+                stale_seconds=float(os.getenv("JOB_STALE_SECONDS", "60")))
+        else:
+            backend = InMemoryJobBackend(
+                ttl_seconds=ttl_seconds,
+                max_finished=int(os.getenv("JOB_MAX_FINISHED", "1000")))
+        _manager = JobManager(
+            backend=backend,
+            workers=int(os.getenv("JOB_WORKERS", "4")),
+        )
+    return _manager
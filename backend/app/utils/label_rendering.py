@@ -0,0 +1,178 @@
+"""
+Cached fonts and label sprites for drawing detection labels.
+
+Rasterizing text is the most expensive part of drawing a box, and the same
+labels ("person (0.87)" in red) recur across boxes and images. The label
+font is loaded once per process and every label is rendered once into a
+small sprite (background plus text) that is then pasted onto the image.
+The font is chosen with ``LABEL_FONT_PATH`` and ``LABEL_FONT_SIZE``.
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+logger = logging.getLogger(__name__)
+
+# Tried in order when LABEL_FONT_PATH is not set
+DEFAULT_FONT_CANDIDATES = ("arial.ttf", "DejaVuSans.ttf")
+
+# Space between the label text and the edge of its background
+LABEL_PADDING = 2
+
+
+def load_font(path: Optional[str] = None,
+              size: int = 16) -> ImageFont.ImageFont:
+    """
+    Load a TrueType font, falling back to Pillow's built-in font.
+
+    Args:
+        path: Font file or name; the default candidates are tried if None
+        size: Font size in pixels
+
+    Returns:
+        ImageFont: The loaded font
+    """
+    candidates = (path,) if path else DEFAULT_FONT_CANDIDATES
+    for candidate in candidates:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    if path:
+        logger.warning(f"Label font '{path}' not found, using built-in font")
+    try:
+        # Scalable built-in font (Pillow 10.1+)
+        return ImageFont.load_default(size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+class LabelRenderer:
+    """
+    Renders detection labels as cached sprites.
+
+    Sprites are keyed by label text, score bucket (the two decimals shown)
+    and color, and kept in a bounded LRU. The renderer is shared by the
+    render threads of a process, so cache access is locked.
+    """
+
+    def __init__(self, font: ImageFont.ImageFont, max_sprites: int = 2048):
+        self.font = font
+        self.max_sprites = max_sprites
+        self._sprites: "OrderedDict[Tuple[str, int, str], Image.Image]" = \
+            OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _render(self, text: str, color: str) -> Image.Image:
+        left, top, right, bottom = self.font.getbbox(text)
+        sprite = Image.new(
+            "RGB", (right - left + 2 * LABEL_PADDING + 1,
+                    bottom - top + 2 * LABEL_PADDING + 1), color)
+        ImageDraw.Draw(sprite).text(
+            (LABEL_PADDING - left, LABEL_PADDING - top), text, fill="white",
+            font=self.font)
+        return sprite
+
+    def sprite(self, label: str, score: float, color: str) -> Image.Image:
+        """
+        Return the sprite for a label, rendering it on first use.
+
+        Args:
+            label: Object label
+            score: Confidence score, shown with two decimals
+            color: Background color
+
+        Returns:
+            Image: RGB sprite of the label on its background (do not modify)
+        """
+        key = (label, round(score * 100), color)
+        with self._lock:
+            sprite = self._sprites.get(key)
+            if sprite is not None:
+                self._sprites.move_to_end(key)
+                self.hits += 1
+                return sprite
+            self.misses += 1
+
+        sprite = self._render(f"{label} ({key[1] / 100:.2f})", color)
+        with self._lock:
+            self._sprites[key] = sprite
+            while len(self._sprites) > self.max_sprites:
+                self._sprites.popitem(last=False)
+        return sprite
+
+    def draw_label(self, image: Image.Image, label: str, score: float,
+                   color: str, x1: int, y1: int, y2: int,
+                   gap: int = 5) -> None:
+        """
+        Paste a label just above a box, or ``gap`` pixels below it if there
+        is no room above.
+
+        Args:
+            image: Image to draw on
+            label: Object label
+            score: Confidence score
+            color: Background color
+            x1: Left edge of the box
+            y1: Top edge of the box
+            y2: Bottom edge of the box
+            gap: Distance between the box and a label placed below it
+        """
+        sprite = self.sprite(label, score, color)
+        y = y1 - sprite.height
+        if y <= 0:
+            y = y2 + gap
+        image.paste(sprite, (x1, y))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report sprite cache usage.
+
+        Returns:
+            dict: Cached sprites and hit/miss counters
+        """
+        return {"sprites": len(self._sprites), "hits": self.hits,
+                "misses": self.misses}
+
+
+_renderer: Optional[LabelRenderer] = None
+_renderer_lock = threading.Lock()
+
+
+def font_settings() -> Tuple[Optional[str], int]:
+    """
+    Return the configured label font.
+
+    Returns:
+        tuple: Font file path (None for the default candidates) and size
+    """
+    return (os.getenv("LABEL_FONT_PATH") or None,
+            int(os.getenv("LABEL_FONT_SIZE", "16")))
+
+
+def get_label_renderer() -> LabelRenderer:
+    """
+    Return the process-wide label renderer, loading the font on first use.
+
+    Render pool workers call this when they start, so the font is loaded
+    once per worker rather than per image.
+
+    Returns:
+        LabelRenderer: The shared renderer
+    """
+    global _renderer
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                _renderer = LabelRenderer(
+                    load_font(*font_settings()),
+                    max_sprites=int(
+                        os.getenv("LABEL_SPRITE_CACHE_SIZE", "2048")))
+    return _renderer
@@ -0,0 +1,338 @@
+"""
+Prometheus metrics for the API.
+
+Exposes request counters and latency histograms per route (recorded by
+:class:`PrometheusMiddleware`), in-flight gauges for API routes (routers use
+:class:`InstrumentedRoute`), per-stage latency of the detection pipeline,
+Azure status codes, retries, hedges and circuit breaker rejections, cache
+and render pool state, garbage collection and event-loop lag. Metrics are
+served in the Prometheus text format by ``GET /metrics``.
+
+With several worker processes, set ``PROMETHEUS_MULTIPROC_DIR`` to an empty
+directory before the workers start: every worker then records into files
+there, and whichever worker answers a scrape aggregates all of them.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Callable, Coroutine, Iterator, \
+    Optional
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, \
+    CollectorRegistry, Counter, Gauge, Histogram, generate_latest, \
+    multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Buckets from 1ms to 30s cover both cache hits and slow Azure calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route and status code",
+    ["method", "route", "status"])
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route",
+    ["method", "route"], buckets=LATENCY_BUCKETS)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served",
+    ["method", "route"], multiprocess_mode="livesum")
+
+STAGE_DURATION = Histogram(
+    "detection_stage_duration_seconds",
+    "Time spent in each stage of the detection pipeline",
+    ["stage"], buckets=LATENCY_BUCKETS)
+
+AZURE_REQUESTS = Counter(
+    "azure_requests_total",
+    "Azure Computer Vision calls by HTTP status code (or error type)",
+    ["status"])
+AZURE_REQUEST_DURATION = Histogram(
+    "azure_request_duration_seconds",
+    "Latency of individual Azure Computer Vision calls",
+    buckets=LATENCY_BUCKETS)
+AZURE_RETRIES = Counter(
+    "azure_retries_total", "Azure Computer Vision calls that were retried",
+    ["reason"])
+AZURE_HEDGED_REQUESTS = Counter(
+    "azure_hedged_requests_total",
+    "Duplicate Azure calls started because the first one was slow")
+AZURE_CIRCUIT_REJECTED = Counter(
+    "azure_circuit_rejected_total",
+    "Detections failed fast because the Azure circuit breaker was open")
+
+GC_RUNS = Counter(
+    "gc_runs_total", "Garbage collection runs of stored files")
+GC_FILES_REMOVED = Counter(
+    "gc_files_removed_total", "Files removed by garbage collection",
+    ["kind"])
+GC_BYTES_RECLAIMED = Counter(
+    "gc_bytes_reclaimed_total",
+    "Bytes of storage freed by garbage collection")
+
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Delay of the event loop in waking up a periodic timer",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+# Requests that match no route share one label to bound cardinality
+UNMATCHED_ROUTE = "unmatched"
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """
+    Record the duration of a pipeline stage.
+
+    Args:
+        stage: Stage name (e.g. ``read``, ``detect``, ``render``)
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.labels(stage).observe(time.perf_counter() - started)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Record a stage duration measured elsewhere (e.g. in a worker)."""
+    STAGE_DURATION.labels(stage).observe(seconds)
+
+
+def route_label(scope: Scope) -> str:
+    """
+    Return the route template (e.g. ``/api/detections/{image_id}``) that a
+    routed request matched, so metrics are grouped per route and not per
+    URL.
+    """
+    route = scope.get("route")
+    if route is not None and hasattr(route, "path_format"):
+        template = route.path_format
+        # Included routers may store the path without their prefix; recover
+        # the prefix from the concrete path
+        path = scope.get("path", "")
+        params = {name: str(value)
+                  for name, value in scope.get("path_params", {}).items()}
+        try:
+            concrete = template.format(**params)
+        except (KeyError, IndexError, ValueError):
+            return template
+        if path.endswith(concrete):
+            return path[:len(path) - len(concrete)] + template
+        return template
+    if scope.get("endpoint") is not None and scope.get("root_path"):
+        # A mounted app such as the static file directories
+        return scope["root_path"]
+    return UNMATCHED_ROUTE
+
+
+class PrometheusMiddleware:
+    """ASGI middleware recording request count and latency per route."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Routing fills in the matched route while the request runs
+            method, route = scope["method"], route_label(scope)
+            HTTP_REQUEST_DURATION.labels(method, route).observe(
+                time.perf_counter() - started)
+            HTTP_REQUESTS.labels(method, route, str(status_code)).inc()
+
+
+async def _track_stream(body: AsyncIterator[Any], gauge) -> \
+        AsyncIterator[Any]:
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        gauge.dec()
+
+
+class InstrumentedRoute(APIRoute):
+    """
+    API route that tracks how many requests it is currently serving.
+
+    Streaming responses (NDJSON, server-sent events) count as in flight
+    until the stream ends.
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any,
+                                                                 Response]]:
+        handler = super().get_route_handler()
+
+        async def instrumented_handler(request: Request) -> Response:
+            gauge = HTTP_REQUESTS_IN_FLIGHT.labels(
+                request.method, route_label(request.scope))
+            gauge.inc()
+            streaming = False
+            try:
+                response = await handler(request)
+                if isinstance(response, StreamingResponse):
+                    response.body_iterator = _track_stream(
+                        response.body_iterator, gauge)
+                    streaming = True
+                return response
+            finally:
+                if not streaming:
+                    gauge.dec()
+
+        return instrumented_handler
+
+
+def multiprocess_dir() -> Optional[str]:
+    """Directory shared by worker processes for metrics, if configured."""
+    return os.getenv("PROMETHEUS_MULTIPROC_DIR") or None
+
+
+class RuntimeStatsCollector:
+    """
+    Export counters kept by the shared services at scrape time.
+
+    These live in the memory of each worker, so with several workers they
+    carry a ``pid`` label naming the worker that answered the scrape.
+    """
+
+    def __init__(self, per_worker: bool = False):
+        self.per_worker = per_worker
+
+    def collect(self):
+        # Imported lazily: these modules are loaded after the metrics module
+        from app.utils import detection_cache, render_pool
+
+        labels = ["pid"] if self.per_worker else []
+        worker = [str(os.getpid())] if self.per_worker else []
+
+        cache = detection_cache._cache
+        if cache is not None:
+            stats = cache.stats()
+            lookups = CounterMetricFamily(
+                "detection_cache_lookups",
+                "Detection cache lookups by cached item and result",
+                labels=labels + ["item", "result"])
+            lookups.add_metric(worker + ["boxes", "hit"], stats["hits"])
+            lookups.add_metric(worker + ["boxes", "miss"], stats["misses"])
+            lookups.add_metric(worker + ["rendered", "hit"],
+                               stats["render_hits"])
+            lookups.add_metric(worker + ["rendered", "miss"],
+                               stats["render_misses"])
+            yield lookups
+            yield self._gauge("detection_cache_bytes",
+                              "Bytes held in the memory tier",
+                              stats["bytes"])
+            yield self._gauge("detection_cache_entries",
+                              "Entries held in the memory tier",
+                              stats["entries"])
+
+        pool = render_pool._pool
+        if pool is not None:
+            stats = pool.stats()
+            yield self._gauge("render_pool_pending",
+                              "Renders queued or running", stats["pending"])
+            rejected = CounterMetricFamily(
+                "render_pool_rejected", "Renders rejected because the pool "
+                "was saturated", labels=labels)
+            rejected.add_metric(worker, stats["rejected"])
+            yield rejected
+
+    def _gauge(self, name: str, documentation: str,
+               value: float) -> GaugeMetricFamily:
+        if not self.per_worker:
+            return GaugeMetricFamily(name, documentation, value=value)
+        gauge = GaugeMetricFamily(name, documentation, labels=["pid"])
+        gauge.add_metric([str(os.getpid())], value)
+        return gauge
+
+
+REGISTRY.register(RuntimeStatsCollector())
+
+
+def render_metrics() -> bytes:
+    """Return all metrics in the Prometheus text exposition format."""
+    if multiprocess_dir() is None:
+        return generate_latest(REGISTRY)
+    # Aggregate what every worker recorded, plus this worker's own stats
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(RuntimeStatsCollector(per_worker=True))
+    return generate_latest(registry)
+
+
+def mark_worker_exited() -> None:
+    """Drop the live gauges of this worker from the shared metrics."""
+    if multiprocess_dir() is not None:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class EventLoopLagMonitor:
+    """Periodically measures how late the event loop runs a timer."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG.observe(max(0.0, loop.time() - expected))
+
+    def start(self) -> None:
+        """Start measuring on the running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop measuring."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+_lag_monitor: Optional[EventLoopLagMonitor] = None
+
+
+def get_loop_lag_monitor() -> EventLoopLagMonitor:
+    """
+    Return the process-wide event-loop lag monitor.
+
+    Returns:
+        EventLoopLagMonitor: The shared monitor
+    """
+    global _lag_monitor
+    if _lag_monitor is None:
+        _lag_monitor = EventLoopLagMonitor(
+            interval=float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.5")))
+    return _lag_monitor
@@ -0,0 +1,134 @@
+"""
+Async token-bucket rate limiter for outbound API calls.
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+
+from app.utils.shared_state import SharedState, get_shared_state, \
+    shared_state_enabled
+
+
+class TokenBucket:
+    """
+    Token bucket that makes callers wait instead of exceeding a rate.
+
+    ``rate`` tokens are added per second up to ``capacity``; each call to
+    :meth:`acquire` takes one token, sleeping until one is available. A
+    token is reserved before sleeping (the balance may go negative), so
+    concurrent callers queue up in arrival order without needing a lock.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("Rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self.acquired = 0
+        self.waited_seconds = 0.0
+        self.deferred = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """Take one token, waiting for the bucket to refill if necessary."""
+        self._refill()
+        self._tokens -= 1
+        self.acquired += 1
+        if self._tokens < 0:
+            wait = -self._tokens / self.rate
+            self.waited_seconds += wait
+            await asyncio.sleep(wait)
+
+    async def defer(self, seconds: float) -> None:
+        """
+        Hold back new tokens for ``seconds``, e.g. after the server answered
+        429 with ``Retry-After``. Callers keep queueing instead of failing.
+        """
+        self._refill()
+        self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+        self.deferred += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report limiter usage.
+
+        Returns:
+            dict: Configured rate and capacity, tokens acquired, total
+                  time spent waiting and number of server-requested pauses
+        """
+        return {
+            "rate_per_second": self.rate,
+            "capacity": self.capacity,
+            "acquired": self.acquired,
+            "waited_seconds": round(self.waited_seconds, 3),
+            "deferred": self.deferred,
+        }
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Token bucket whose balance lives in shared state, so one limit holds
+    across all worker processes. Counters in :meth:`stats` are per worker.
+    """
+
+    def __init__(self, state: SharedState, name: str, rate: float,
+                 capacity: Optional[float] = None):
+        super().__init__(rate, capacity)
+        self.state = state
+        self.name = name
+
+    async def acquire(self) -> None:
+        """Take one token, waiting for the bucket to refill if necessary."""
+        wait = await asyncio.to_thread(self.state.take_tokens, self.name,
+                                       self.rate, self.capacity)
+        self.acquired += 1
+        if wait > 0:
+            self.waited_seconds += wait
+            await asyncio.sleep(wait)
+
+    async def defer(self, seconds: float) -> None:
+        """Hold back new tokens for every worker for ``seconds``."""
+        await asyncio.to_thread(self.state.hold_tokens, self.name, self.rate,
+                                self.capacity, seconds)
+        self.deferred += 1
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["shared"] = True
+        return stats
+
+
+_azure_limiter: Optional[TokenBucket] = None
+
+
+def get_azure_rate_limiter() -> TokenBucket:
+    """
+    Return the limiter shared by all Azure Computer Vision calls.
+
+    The default of 10 requests per second matches the Azure Computer Vision
+    S1 tier; set ``AZURE_RATE_LIMIT_PER_SECOND`` and ``AZURE_RATE_LIMIT_BURST``
+    to match another tier. With shared state the limit covers all workers.
+
+    Returns:
+        TokenBucket: The shared limiter
+    """
+    global _azure_limiter
+    if _azure_limiter is None:
+        burst = os.getenv("AZURE_RATE_LIMIT_BURST")
+        rate = float(os.getenv("AZURE_RATE_LIMIT_PER_SECOND", "10"))
+        capacity = float(burst) if burst else None
+        if shared_state_enabled():
+            _azure_limiter = SharedTokenBucket(get_shared_state(), "azure",
+                                               rate, capacity)
+        else:
+            _azure_limiter = TokenBucket(rate=rate, capacity=capacity)
+    return _azure_limiter
@@ -0,0 +1,146 @@
+"""
+Worker pool for CPU-bound image rendering.
+
+Decoding, drawing and JPEG encoding with Pillow hold the CPU for the whole
+render, so they run in a process (or thread) pool instead of on the event
+loop. The number of renders queued or running is bounded; when the pool is
+saturated, callers are rejected immediately so the API can answer 429
+instead of piling up work.
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, \
+    ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from app.utils.shared_state import worker_count
+
+logger = logging.getLogger(__name__)
+
+
+class RenderPoolSaturated(Exception):
+    """Raised when the render pool has no room for another job."""
+
+
+def _warm_worker() -> None:
+    """Load per-worker state (fonts) once when a worker starts."""
+    from app.utils.label_rendering import get_label_renderer
+    get_label_renderer()
+
+
+class RenderPool:
+    """Bounded executor for rendering jobs."""
+
+    def __init__(self, mode: str = "process", workers: Optional[int] = None,
+                 max_pending: Optional[int] = None,
+                 initializer: Optional[Callable[[], None]] = _warm_worker):
+        if mode not in ("process", "thread"):
+            raise ValueError(f"Unknown render pool mode: {mode}")
+        self.mode = mode
+        # Server worker processes split the cores between their pools
+        self.workers = workers or max(
+            1, (os.cpu_count() or 1) // worker_count())
+        self.max_pending = (max_pending if max_pending is not None
+                            else self.workers * 4)
+        self._initializer = initializer
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=self._initializer)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, initializer=self._initializer,
+                    thread_name_prefix="render")
+            logger.info(f"Render pool started ({self.mode}, "
+                        f"{self.workers} workers)")
+        return self._executor
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Run a render function in the pool.
+
+        Args:
+            func: Picklable top-level function to run
+            *args: Arguments passed to ``func``
+
+        Returns:
+            Any: The function's return value
+
+        Raises:
+            RenderPoolSaturated: If ``max_pending`` jobs are already queued
+                                 or running
+        """
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise RenderPoolSaturated(
+                f"Render pool saturated ({self._pending} jobs pending)")
+
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._get_executor(), func,
+                                                *args)
+            self.completed += 1
+            return result
+        finally:
+            self._pending -= 1
+
+    def shutdown(self) -> None:
+        """Stop the workers."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report pool occupancy.
+
+        Returns:
+            dict: Mode, worker count, pending jobs and job counters
+        """
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+_pool: Optional[RenderPool] = None
+
+
+def get_render_pool() -> RenderPool:
+    """
+    Return the process-wide render pool, configured from the environment.
+
+    Returns:
+        RenderPool: The shared pool
+    """
+    global _pool
+    if _pool is None:
+        workers = os.getenv("RENDER_POOL_WORKERS")
+        max_pending = os.getenv("RENDER_POOL_MAX_PENDING")
+        _pool = RenderPool(
+            mode=os.getenv("RENDER_POOL_MODE", "process"),
+            workers=int(workers) if workers else None,
+            max_pending=int(max_pending) if max_pending else None,
+        )
+    return _pool
+
+
+def shutdown_render_pool() -> None:
+    """Stop the shared pool (called on application shutdown)."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+    _pool = None
@@ -0,0 +1,238 @@
+"""
+Retry, circuit breaker and request hedging helpers for outbound API calls.
+"""
+
+import asyncio
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Responses worth retrying: throttling and transient server errors
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a ``Retry-After`` header.
+
+    Args:
+        value: Header value, either delay seconds or an HTTP date
+
+    Returns:
+        float: Seconds to wait, or None if missing or malformed
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter.
+
+    Attempt ``n`` (0-based) waits a random time between 0 and
+    ``min(max_delay, base_delay * 2**n)`` so that clients failing together
+    do not retry together. A server-provided ``Retry-After`` takes
+    precedence, capped at ``max_retry_after``.
+    """
+
+    def __init__(self, max_retries: int = 3, base_delay: float = 0.5,
+                 max_delay: float = 10.0, max_retry_after: float = 30.0):
+        if max_retries < 0:
+            raise ValueError("max_retries must not be negative")
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> \
+            float:
+        """
+        Seconds to wait before retrying after a failed attempt.
+
+        Args:
+            attempt: Number of the attempt that failed, starting at 0
+            retry_after: Delay requested by the server, if any
+
+        Returns:
+            float: Delay in seconds
+        """
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a service that is failing."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Circuit open, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Fails fast while a downstream service keeps failing.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls are rejected for ``reset_timeout`` seconds. Then a single probe
+    call is let through (half-open): success closes the circuit, failure
+    opens it again. A probe that never reports back (e.g. was cancelled) is
+    abandoned after another ``reset_timeout``.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0):
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold must be at least 1")
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+
+    def before_call(self) -> None:
+        """
+        Check that a call may be made.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with a
+                              probe already in flight
+        """
+        if self.state == self.CLOSED:
+            return
+        now = time.monotonic()
+        remaining = self._opened_at + self.reset_timeout - now
+        if self.state == self.OPEN and remaining <= 0:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and (
+                self._probe_started is None or
+                now - self._probe_started > self.reset_timeout):
+            self._probe_started = now
+            return
+        self.rejected += 1
+        raise CircuitOpenError(max(remaining, 1.0))
+
+    def record_success(self) -> None:
+        """Record a call that reached a healthy service."""
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_started = None
+
+    def record_failure(self) -> None:
+        """Record a failed call, opening the circuit if needed."""
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or \
+                self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened += 1
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+        self._probe_started = None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report breaker state.
+
+        Returns:
+            dict: State, consecutive failures, times opened and calls
+                  rejected while open
+        """
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class LatencyTracker:
+    """Sliding window of recent call latencies."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self._samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, seconds: float) -> None:
+        """Add one latency sample."""
+        self._samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """
+        Latency below which ``fraction`` of recent calls completed.
+
+        Returns:
+            float: Latency in seconds, or None until ``min_samples`` calls
+                   have been recorded
+        """
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def hedged(call: Callable[[], Awaitable[T]], delay: Optional[float],
+                 on_hedge: Optional[Callable[[], None]] = None) -> T:
+    """
+    Run ``call`` and, if it has not finished after ``delay`` seconds, run it
+    a second time and use whichever succeeds first.
+
+    Hedging trims tail latency at the cost of a few duplicate requests;
+    the slower call is cancelled once one succeeds.
+
+    Args:
+        call: Factory for the awaitable to run
+        delay: Seconds to wait before hedging, or None to disable hedging
+        on_hedge: Called when the second request is started
+
+    Returns:
+        The result of the first successful call
+
+    Raises:
+        Exception: The error of the last call to fail if none succeed
+    """
+    if delay is None:
+        return await call()
+
+    tasks: List[asyncio.Task] = [asyncio.ensure_future(call())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            if on_hedge is not None:
+                on_hedge()
+            tasks.append(asyncio.ensure_future(call()))
+        pending = set(tasks)
+        while True:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+            if not pending:
+                # Every call failed; surface the error of the last one
+                return done.pop().result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
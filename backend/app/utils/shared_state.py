@@ -0,0 +1,329 @@
+"""
+State shared by the worker processes of one deployment.
+
+With several uvicorn workers, each process has its own memory, so anything
+that must hold across requests on different workers lives in a SQLite
+database in WAL mode (``SHARED_STATE_PATH``) that every worker opens:
+
+* leases, which give cross-worker single-flight (one Azure call per image
+  content no matter which worker gets the requests) and one-off startup
+  work,
+* the token bucket of the Azure rate limiter, so the limit holds for the
+  deployment rather than per worker,
+* the background job queue (see :class:`app.utils.jobs.SqliteJobBackend`).
+
+The image index is already a shared SQLite database and the detection
+cache's disk tier is a shared directory, so both work across workers as-is.
+Shared state is used when ``SHARED_STATE_BACKEND`` is ``sqlite``, which is
+the default when ``WEB_CONCURRENCY`` asks for more than one worker.
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterator, \
+    List, Optional
+
+from app.utils.concurrency import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+
+-- Token buckets; tokens may go negative while callers wait for a refill
+CREATE TABLE IF NOT EXISTS token_buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    status_code INTEGER,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    -- Worker that submitted the job (and may hold its in-memory input)
+    origin TEXT NOT NULL,
+    -- Last sign of life from the worker running the job
+    heartbeat_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_queued ON jobs(created_at)
+    WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(finished_at)
+    WHERE finished_at IS NOT NULL;
+"""
+
+
+def worker_count() -> int:
+    """Number of worker processes the server was started with."""
+    try:
+        return max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    except ValueError:
+        return 1
+
+
+def shared_state_enabled() -> bool:
+    """Whether cross-worker state should go through the shared database."""
+    default = "sqlite" if worker_count() > 1 else "memory"
+    backend = os.getenv("SHARED_STATE_BACKEND", default).lower()
+    if backend not in ("memory", "sqlite"):
+        raise ValueError(f"Unknown shared state backend: {backend}")
+    return backend == "sqlite"
+
+
+class SharedState:
+    """Leases, token buckets and jobs in a SQLite database shared by workers."""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        if self.db_path.parent != Path("."):
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Identifies this process (and this instance) as a lease owner
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.db_path),
+                                     check_same_thread=False,
+                                     isolation_level=None, timeout=30.0)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        # Add columns introduced after the database was created
+        columns = {row["name"] for row in
+                   self._conn.execute("PRAGMA table_info(jobs)")}
+        if "heartbeat_at" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+        if "attempts" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER "
+                               "NOT NULL DEFAULT 0")
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def execute(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        """Run one statement and return all of its rows."""
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Hold the database write lock for a read-modify-write sequence.
+
+        Yields:
+            sqlite3.Connection: The connection to run statements on
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    # Leases
+
+    def acquire_lease(self, key: str, seconds: float) -> bool:
+        """
+        Take (or extend) a lease on a key unless another owner holds it.
+
+        Args:
+            key: Name of the leased resource
+            seconds: Lease lifetime; an owner that dies loses the lease
+                     after this long
+
+        Returns:
+            bool: Whether this instance now holds the lease
+        """
+        now = time.time()
+        rows = self.execute(
+            "INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, "
+            "expires_at = excluded.expires_at "
+            "WHERE leases.owner = excluded.owner OR leases.expires_at < ? "
+            "RETURNING owner",
+            (key, self.owner, now + seconds, now))
+        return bool(rows)
+
+    def release_lease(self, key: str) -> None:
+        """Give up a lease held by this instance."""
+        self.execute("DELETE FROM leases WHERE key = ? AND owner = ?",
+                     (key, self.owner))
+
+    # Token buckets
+
+    def take_tokens(self, name: str, rate: float, capacity: float,
+                    tokens: float = 1.0) -> float:
+        """
+        Reserve tokens from a shared bucket.
+
+        Args:
+            name: Bucket name
+            rate: Tokens added per second
+            capacity: Maximum balance
+            tokens: Tokens to take
+
+        Returns:
+            float: Seconds the caller must wait before using the tokens
+        """
+        with self.transaction() as conn:
+            balance = self._refill(conn, name, rate, capacity) - tokens
+            self._store_balance(conn, name, balance)
+        return max(0.0, -balance / rate)
+
+    def hold_tokens(self, name: str, rate: float, capacity: float,
+                    seconds: float) -> None:
+        """Stop a shared bucket from refilling for ``seconds``."""
+        with self.transaction() as conn:
+            balance = min(self._refill(conn, name, rate, capacity), 0.0)
+            self._store_balance(conn, name, balance - seconds * rate)
+
+    @staticmethod
+    def _refill(conn: sqlite3.Connection, name: str, rate: float,
+                capacity: float) -> float:
+        # Wall-clock time, since monotonic clocks are per process
+        row = conn.execute(
+            "SELECT tokens, updated_at FROM token_buckets WHERE name = ?",
+            (name,)).fetchone()
+        if row is None:
+            return capacity
+        elapsed = max(0.0, time.time() - row["updated_at"])
+        return min(capacity, row["tokens"] + elapsed * rate)
+
+    @staticmethod
+    def _store_balance(conn: sqlite3.Connection, name: str,
+                       tokens: float) -> None:
+        conn.execute(
+            "INSERT INTO token_buckets (name, tokens, updated_at) "
+            "VALUES (?, ?, ?) ON CONFLICT(name) DO UPDATE SET "
+            "tokens = excluded.tokens, updated_at = excluded.updated_at",
+            (name, tokens, time.time()))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report the shared state in use.
+
+        Returns:
+            dict: Database path, owner ID of this worker and live leases
+        """
+        leases = self.execute("SELECT COUNT(*) FROM leases "
+                              "WHERE expires_at >= ?", (time.time(),))
+        return {
+            "path": str(self.db_path),
+            "owner": self.owner,
+            "leases": leases[0][0],
+        }
+
+
+class SharedSingleFlight(SingleFlight):
+    """
+    Single-flight across worker processes.
+
+    Calls are coalesced within the process first. The one execution left
+    per process then takes a lease on the key, so only one worker runs the
+    work at a time. A worker that finds the key leased waits until the
+    lease is gone and asks ``cached`` for the result the other worker
+    stored, running the work itself only if there is none. The holder
+    renews its lease while the work runs; if it dies, the lease expires and
+    another worker takes over.
+    """
+
+    def __init__(self, state: SharedState, lease_seconds: float = 60.0,
+                 poll_interval: float = 0.05):
+        super().__init__()
+        self.state = state
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.waited = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]],
+                 cached: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+        return await super().do(
+            key, lambda: self._run_leased(str(key), func, cached))
+
+    async def _run_leased(self, key: str,
+                          func: Callable[[], Awaitable[Any]],
+                          cached: Optional[Callable[[], Awaitable[Any]]]
+                          ) -> Any:
+        waited = False
+        while not await asyncio.to_thread(self.state.acquire_lease, key,
+                                          self.lease_seconds):
+            if not waited:
+                waited = True
+                self.waited += 1
+            await asyncio.sleep(self.poll_interval)
+
+        renewer = asyncio.create_task(self._renew(key))
+        try:
+            if waited and cached is not None:
+                result = await cached()
+                if result is not None:
+                    return result
+            return await func()
+        finally:
+            renewer.cancel()
+            await asyncio.to_thread(self.state.release_lease, key)
+
+    async def _renew(self, key: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await asyncio.to_thread(self.state.acquire_lease, key,
+                                    self.lease_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["waited_for_other_workers"] = self.waited
+        return stats
+
+
+_state: Optional[SharedState] = None
+
+
+def get_shared_state() -> SharedState:
+    """
+    Return this process's connection to the shared state database.
+
+    Returns:
+        SharedState: The shared state
+    """
+    global _state
+    if _state is None:
+        _state = SharedState(Path(os.getenv("SHARED_STATE_PATH",
+                                            "shared_state.db")))
+    return _state
+
+
+def new_single_flight() -> SingleFlight:
+    """
+    Create a single-flight group that spans workers when state is shared.
+
+    Returns:
+        SingleFlight: A cross-worker group with shared state, otherwise an
+                      in-process one
+    """
+    if shared_state_enabled():
+        return SharedSingleFlight(
+            get_shared_state(),
+            lease_seconds=float(os.getenv("SHARED_LEASE_SECONDS", "60")))
+    return SingleFlight()
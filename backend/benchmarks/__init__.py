@@ -0,0 +1,3 @@
+"""
+Benchmarks for the upload, listing, rendering and detection pipeline.
+"""
@@ -0,0 +1,87 @@
+"""
+Mock of the Azure Computer Vision v3.2 analyze endpoint.
+
+Serves ``POST /vision/v3.2/analyze`` with a fixed latency and a fixed number
+of boxes that fit the posted image, so the real Azure client path (rate
+limiter, pooled HTTP client, response normalization) can be benchmarked
+without a live service.
+
+Usage:
+    python -m benchmarks.mock_azure --port 8900 --latency-ms 50 --boxes 5
+"""
+
+import argparse
+import asyncio
+import io
+from typing import Any, Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from PIL import Image
+
+
+def fake_objects(width: int, height: int, count: int) -> List[Dict[str, Any]]:
+    """Return ``count`` boxes laid out on a grid inside the image."""
+    objects = []
+    for n in range(count):
+        w, h = max(1, width // 4), max(1, height // 4)
+        x = (n * w // 2) % max(1, width - w)
+        y = (n * h // 3) % max(1, height - h)
+        objects.append({
+            "rectangle": {"x": x, "y": y, "w": w, "h": h},
+            "object": f"object{n % 5}",
+            "confidence": 0.5 + (n % 5) / 10,
+        })
+    return objects
+
+
+def create_app(latency_ms: float = 0.0, boxes: int = 5) -> FastAPI:
+    """
+    Create the mock service.
+
+    Args:
+        latency_ms: Delay before each response
+        boxes: Number of objects returned per image
+
+    Returns:
+        FastAPI: The mock application
+    """
+    app = FastAPI(title="Mock Azure Computer Vision")
+    app.state.requests = 0
+
+    @app.post("/vision/v3.2/analyze")
+    async def analyze(request: Request):
+        app.state.requests += 1
+        body = await request.body()
+        if latency_ms > 0:
+            await asyncio.sleep(latency_ms / 1000)
+        try:
+            width, height = Image.open(io.BytesIO(body)).size
+        except OSError:
+            width, height = 640, 480
+        return {
+            "objects": fake_objects(width, height, boxes),
+            "requestId": f"mock-{app.state.requests}",
+            "metadata": {"width": width, "height": height, "format": "Jpeg"},
+        }
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "requests": app.state.requests}
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--boxes", type=int, default=5)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.latency_ms, args.boxes), host=args.host,
+                port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,569 @@
+"""
+Benchmark runner for the detection service.
+
+Suites:
+    draw    ``draw_bounding_boxes_on_image`` time vs. image size and box count
+    list    ``GET /api/images`` latency vs. number of indexed images
+    upload  ``POST /api/upload`` throughput against a running server
+    e2e     ``GET /api/detections/{id}`` requests per second vs. concurrency,
+            with the server talking to a local mock Azure service
+
+The ``upload`` and ``e2e`` suites start the API and the mock Azure service
+(:mod:`benchmarks.mock_azure`) as subprocesses in a temporary directory.
+Results are written as JSON; pass ``--baseline`` with an earlier result file
+to exit non-zero when a metric regresses by more than ``--tolerance``.
+
+Usage:
+    python -m benchmarks.run --suite all --output results.json
+    python -m benchmarks.run --suite draw,list --quick \\
+        --baseline results.json --tolerance 0.25
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import httpx
+from PIL import Image
+
+logger = logging.getLogger("benchmarks")
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+SUITES = ("draw", "list", "upload", "e2e")
+
+# Metrics that regress when they grow, and metrics that regress when they
+# shrink; other metrics are reported but not compared
+LOWER_IS_BETTER = ("mean_ms", "p50_ms", "p95_ms", "p99_ms")
+HIGHER_IS_BETTER = ("rps", "files_per_second", "mb_per_second")
+
+
+# ----------------------------------------------------------------------
+# Helpers
+# ----------------------------------------------------------------------
+
+def summarize(samples: Sequence[float]) -> Dict[str, float]:
+    """
+    Summarize latency samples given in seconds.
+
+    Returns:
+        dict: Count and mean/min/max/percentile latencies in milliseconds
+    """
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        index = min(len(ordered) - 1, max(0, round(p * len(ordered)) - 1))
+        return ordered[index] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "p50_ms": round(percentile(0.50), 3),
+        "p95_ms": round(percentile(0.95), 3),
+        "p99_ms": round(percentile(0.99), 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def result(benchmark: str, params: Dict[str, Any],
+           metrics: Dict[str, Any]) -> Dict[str, Any]:
+    """Build one result record."""
+    return {"benchmark": benchmark, "params": params, "metrics": metrics}
+
+
+def make_jpeg(size: Tuple[int, int], quality: int = 90) -> bytes:
+    """A photo-like (noisy) JPEG of the given size."""
+    image = Image.effect_noise(size, 64).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def unique_variant(image_data: bytes) -> bytes:
+    """
+    Make image bytes unique without changing the decoded image.
+
+    Decoders stop at the JPEG end-of-image marker, so trailing bytes give a
+    new content hash (a cold cache entry) at identical rendering cost.
+    """
+    return image_data + os.urandom(16)
+
+
+def free_port() -> int:
+    """Return a TCP port that is free on localhost."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(url: str, process: subprocess.Popen,
+                     timeout: float = 30.0) -> None:
+    """Poll a URL until it answers or the process exits."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited early with code "
+                               f"{process.returncode}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"Server at {url} did not become ready")
+
+
+@contextmanager
+def run_server(module: str, args: List[str], env: Dict[str, str],
+               cwd: Path, health_path: str) -> Iterator[str]:
+    """
+    Run a server module in a subprocess until the block exits.
+
+    Yields:
+        str: Base URL of the server
+    """
+    port = free_port()
+    command = [sys.executable, "-m", module, "--port", str(port)] + args
+    process_env = dict(os.environ, PYTHONPATH=str(BACKEND_DIR), **env)
+    process = subprocess.Popen(command, cwd=str(cwd), env=process_env)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_ready(base_url + health_path, process)
+        yield base_url
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+@contextmanager
+def benchmark_stack(workdir: Path, azure_latency_ms: float,
+                    azure_boxes: int) -> Iterator[str]:
+    """
+    Start the mock Azure service and the API configured to use it.
+
+    Yields:
+        str: Base URL of the API
+    """
+    with run_server("benchmarks.mock_azure",
+                    ["--latency-ms", str(azure_latency_ms),
+                     "--boxes", str(azure_boxes)],
+                    {}, workdir, "/health") as azure_url:
+        api_env = {
+            "VISION_ENDPOINT": azure_url,
+            "VISION_KEY": "benchmark",
+            "DETECTOR_BACKEND": "azure",
+            "AZURE_RATE_LIMIT_PER_SECOND": "100000",
+            "HTTP_CLIENT_HTTP2": "false",
+            "RENDER_POOL_MAX_PENDING": "10000",
+        }
+        with run_server("uvicorn", ["app.main:app", "--log-level", "warning"],
+                        api_env, workdir, "/api/health") as api_url:
+            yield api_url
+
+
+async def timed_requests(count: int, concurrency: int,
+                         send) -> Tuple[List[float], Dict[str, int], float]:
+    """
+    Issue ``count`` requests with at most ``concurrency`` in flight.
+
+    Args:
+        count: Number of requests
+        concurrency: Maximum requests in flight
+        send: Coroutine function taking the request number and returning
+              an ``httpx.Response``
+
+    Returns:
+        tuple: Latencies of successful requests, counts per status code and
+               wall-clock duration
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+
+    async def one(number: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await send(number)
+                code = str(response.status_code)
+            except httpx.HTTPError as e:
+                code = type(e).__name__
+            if code == "200":
+                latencies.append(time.perf_counter() - started)
+            statuses[code] = statuses.get(code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(count)))
+    return latencies, statuses, time.perf_counter() - started
+
+
+# ----------------------------------------------------------------------
+# Suites
+# ----------------------------------------------------------------------
+
+def bench_draw(sizes: Sequence[Tuple[int, int]], box_counts: Sequence[int],
+               repeats: int) -> List[Dict[str, Any]]:
+    """Time ``draw_bounding_boxes_on_image`` per image size and box count."""
+    from app.routes.detection import BoundingBox, \
+        draw_bounding_boxes_on_image
+
+    results = []
+    rng = random.Random(0)
+    for width, height in sizes:
+        image_data = make_jpeg((width, height))
+        for box_count in box_counts:
+            boxes = []
+            for n in range(box_count):
+                w = rng.randint(width // 10, width // 3)
+                h = rng.randint(height // 10, height // 3)
+                boxes.append(BoundingBox(
+                    label=f"object{n}", x=rng.randint(0, width - w),
+                    y=rng.randint(0, height - h), w=w, h=h,
+                    score=rng.random()))
+
+            draw_bounding_boxes_on_image(image_data, boxes)  # warm-up
+            samples = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                draw_bounding_boxes_on_image(image_data, boxes)
+                samples.append(time.perf_counter() - started)
+            logger.info(f"draw {width}x{height} boxes={box_count}: "
+                        f"p50 {summarize(samples)['p50_ms']} ms")
+            results.append(result(
+                "draw_bounding_boxes",
+                {"width": width, "height": height, "boxes": box_count,
+                 "input_bytes": len(image_data)},
+                summarize(samples)))
+    return results
+
+
+def bench_list_images(store_sizes: Sequence[int], repeats: int,
+                      page_size: int = 20) -> List[Dict[str, Any]]:
+    """Time ``GET /api/images`` against indexes of increasing size."""
+    from app.main import app
+    from app.routes.images import encode_cursor
+    from app.utils import image_index
+    from app.utils.image_index import ImageIndex, ImageRecord
+
+    async def measure(client: httpx.AsyncClient,
+                      params: Dict[str, Any]) -> List[float]:
+        samples = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            response = await client.get("/api/images", params=params)
+            samples.append(time.perf_counter() - started)
+            response.raise_for_status()
+        return samples
+
+    async def run(count: int) -> Dict[str, List[float]]:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport,
+                                     base_url="http://bench") as client:
+            middle = image_index.get_image_index().list_processed(
+                1, offset=count // 2)[0]
+            return {
+                "first_page": await measure(
+                    client, {"page_size": page_size}),
+                "middle_page_offset": await measure(
+                    client, {"page": max(1, count // 2 // page_size),
+                             "page_size": page_size}),
+                "middle_page_cursor": await measure(
+                    client, {"after": encode_cursor(middle),
+                             "page_size": page_size}),
+            }
+
+    results = []
+    previous = image_index._index
+    for count in store_sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            index = ImageIndex(Path(tmp) / "index.db")
+            base = time.time() - count
+            index.add_many(ImageRecord(
+                id=f"{n:08d}.jpg",
+                original_path=f"uploads/{n:08d}.jpg",
+                processed_path=f"processed_uploads/processed_{n:08d}.jpg",
+                size=100_000, mtime=base + n, content_type="image/jpeg",
+                uploaded_at=base + n) for n in range(count))
+            image_index._index = index
+            try:
+                timings = asyncio.run(run(count))
+            finally:
+                image_index._index = previous
+                index.close()
+
+        for variant, samples in timings.items():
+            logger.info(f"list_images n={count} {variant}: "
+                        f"p50 {summarize(samples)['p50_ms']} ms")
+            results.append(result(
+                "list_images",
+                {"images": count, "variant": variant,
+                 "page_size": page_size},
+                summarize(samples)))
+    return results
+
+
+async def _upload(client: httpx.AsyncClient, image_data: bytes,
+                  name: str) -> httpx.Response:
+    return await client.post(
+        "/api/upload",
+        files=[("files[]", (name, unique_variant(image_data), "image/jpeg"))])
+
+
+def bench_upload(api_url: str, files: int, file_kb: int,
+                 concurrency_levels: Sequence[int]) -> List[Dict[str, Any]]:
+    """Measure upload throughput of single-file requests."""
+    side = max(64, int((file_kb * 1024 / 0.9) ** 0.5 / 1.2))
+    image_data = make_jpeg((side, side), quality=95)
+
+    async def run(concurrency: int):
+        async with httpx.AsyncClient(base_url=api_url,
+                                     timeout=60.0) as client:
+            return await timed_requests(
+                files, concurrency,
+                lambda n: _upload(client, image_data, f"bench{n}.jpg"))
+
+    results = []
+    for concurrency in concurrency_levels:
+        latencies, statuses, elapsed = asyncio.run(run(concurrency))
+        ok = statuses.get("200", 0)
+        metrics = summarize(latencies) if latencies else {"count": 0}
+        metrics.update({
+            "files_per_second": round(ok / elapsed, 2),
+            "mb_per_second": round(ok * len(image_data) / elapsed / 2**20,
+                                   2),
+            "statuses": statuses,
+        })
+        logger.info(f"upload concurrency={concurrency}: "
+                    f"{metrics['files_per_second']} files/s")
+        results.append(result(
+            "upload",
+            {"files": files, "file_bytes": len(image_data),
+             "concurrency": concurrency},
+            metrics))
+    return results
+
+
+def bench_e2e(api_url: str, requests: int,
+              concurrency_levels: Sequence[int],
+              image_size: Tuple[int, int]) -> List[Dict[str, Any]]:
+    """
+    Measure detection requests per second at several concurrency levels.
+
+    Each level detects freshly uploaded images (``cold``: Azure call and
+    render) and then requests the same images again (``warm``: served from
+    the persisted processed image).
+    """
+    image_data = make_jpeg(image_size)
+
+    async def run(concurrency: int) -> Dict[str, Any]:
+        async with httpx.AsyncClient(base_url=api_url,
+                                     timeout=120.0) as client:
+            image_ids = []
+            for n in range(requests):
+                response = await _upload(client, image_data, f"e2e{n}.jpg")
+                response.raise_for_status()
+                image_ids.append(response.json()["files"][0]["saved_filename"])
+
+            measured = {}
+            for phase in ("cold", "warm"):
+                measured[phase] = await timed_requests(
+                    requests, concurrency,
+                    lambda n: client.get(f"/api/detections/{image_ids[n]}"))
+            return measured
+
+    results = []
+    for concurrency in concurrency_levels:
+        for phase, (latencies, statuses, elapsed) in \
+                asyncio.run(run(concurrency)).items():
+            metrics = summarize(latencies) if latencies else {"count": 0}
+            metrics.update({
+                "rps": round(statuses.get("200", 0) / elapsed, 2),
+                "statuses": statuses,
+            })
+            logger.info(f"e2e {phase} concurrency={concurrency}: "
+                        f"{metrics['rps']} req/s")
+            results.append(result(
+                "e2e_detection",
+                {"phase": phase, "concurrency": concurrency,
+                 "requests": requests, "width": image_size[0],
+                 "height": image_size[1]},
+                metrics))
+    return results
+
+
+# ----------------------------------------------------------------------
+# Regression check
+# ----------------------------------------------------------------------
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]],
+            tolerance: float) -> List[Dict[str, Any]]:
+    """
+    Find metrics that regressed compared with a baseline run.
+
+    Args:
+        results: Results of this run
+        baseline: Results of the reference run
+        tolerance: Allowed relative change (0.2 = 20%)
+
+    Returns:
+        list: One record per regressed metric
+    """
+    def key(record: Dict[str, Any]) -> str:
+        return json.dumps([record["benchmark"], record["params"]],
+                          sort_keys=True)
+
+    reference = {key(record): record["metrics"] for record in baseline}
+    regressions = []
+    for record in results:
+        before = reference.get(key(record))
+        if before is None:
+            continue
+        for metric, value in record["metrics"].items():
+            old = before.get(metric)
+            if not isinstance(value, (int, float)) or not old:
+                continue
+            change = (value - old) / old
+            if (metric in LOWER_IS_BETTER and change > tolerance) or \
+                    (metric in HIGHER_IS_BETTER and change < -tolerance):
+                regressions.append({
+                    "benchmark": record["benchmark"],
+                    "params": record["params"],
+                    "metric": metric,
+                    "baseline": old,
+                    "current": value,
+                    "change": round(change, 4),
+                })
+    return regressions
+
+
+def environment() -> Dict[str, Any]:
+    """Describe the machine and code version the benchmarks ran on."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=str(BACKEND_DIR),
+            capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def parse_sizes(value: str) -> List[Tuple[int, int]]:
+    """Parse ``640x480,1920x1080`` into size tuples."""
+    return [tuple(int(n) for n in size.split("x")) for size in value.split(",")]
+
+
+def parse_ints(value: str) -> List[int]:
+    """Parse ``1,4,16`` into integers."""
+    return [int(n) for n in value.split(",")]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the detection service.")
+    parser.add_argument("--suite", default="all",
+                        help=f"Comma-separated suites: {', '.join(SUITES)} "
+                             f"or all")
+    parser.add_argument("--quick", action="store_true",
+                        help="Small sizes and counts for a fast smoke run")
+    parser.add_argument("--output", help="Write results to this JSON file "
+                                         "(default: stdout)")
+    parser.add_argument("--baseline", help="Earlier results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative regression (default 0.2)")
+    parser.add_argument("--repeats", type=int)
+    parser.add_argument("--draw-sizes")
+    parser.add_argument("--draw-boxes")
+    parser.add_argument("--list-sizes")
+    parser.add_argument("--upload-files", type=int)
+    parser.add_argument("--upload-kb", type=int, default=512)
+    parser.add_argument("--concurrency")
+    parser.add_argument("--e2e-requests", type=int)
+    parser.add_argument("--e2e-size", default="1280x960")
+    parser.add_argument("--azure-latency-ms", type=float, default=50.0)
+    parser.add_argument("--azure-boxes", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr,
+                        format="%(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    suites = SUITES if args.suite == "all" else tuple(args.suite.split(","))
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"Unknown suite(s): {', '.join(sorted(unknown))}")
+
+    quick = args.quick
+    repeats = args.repeats or (3 if quick else 20)
+    concurrency = parse_ints(args.concurrency or
+                             ("1,4" if quick else "1,4,16,64"))
+
+    results: List[Dict[str, Any]] = []
+    if "draw" in suites:
+        results += bench_draw(
+            parse_sizes(args.draw_sizes or
+                        ("320x240" if quick else
+                         "640x480,1920x1080,4032x3024")),
+            parse_ints(args.draw_boxes or ("1,10" if quick else "1,10,50")),
+            repeats)
+    if "list" in suites:
+        results += bench_list_images(
+            parse_ints(args.list_sizes or
+                       ("100,1000" if quick else "1000,10000,100000")),
+            repeats)
+    if "upload" in suites or "e2e" in suites:
+        with tempfile.TemporaryDirectory() as tmp, \
+                benchmark_stack(Path(tmp), args.azure_latency_ms,
+                                args.azure_boxes) as api_url:
+            if "upload" in suites:
+                results += bench_upload(
+                    api_url, args.upload_files or (20 if quick else 200),
+                    args.upload_kb, concurrency)
+            if "e2e" in suites:
+                results += bench_e2e(
+                    api_url, args.e2e_requests or (10 if quick else 100),
+                    concurrency, parse_sizes(args.e2e_size)[0])
+
+    report: Dict[str, Any] = {"environment": environment(),
+                              "results": results}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        report["regressions"] = compare(results, baseline, args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+    if report.get("regressions"):
+        for regression in report["regressions"]:
+            logger.error(f"Regression: {regression}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
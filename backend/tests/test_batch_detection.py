@@ -0,0 +1,137 @@
+import asyncio
+import io
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import app.routes.detection as detection_module
+from app.main import app
+from app.utils import detection_cache, image_index, render_pool
+from app.utils.concurrency import SingleFlight, bounded_as_completed
+from app.utils.detection_cache import DetectionCache
+from app.utils.image_index import ImageIndex
+from app.utils.rate_limiter import TokenBucket
+from app.utils.render_pool import RenderPool
+
+client = TestClient(app)
+
+
+def test_token_bucket_paces_calls():
+    """Calls beyond the burst wait for tokens to refill"""
+    bucket = TokenBucket(rate=20, capacity=1)
+
+    async def take(n):
+        for _ in range(n):
+            await bucket.acquire()
+
+    started = time.monotonic()
+    asyncio.run(take(3))
+    assert time.monotonic() - started >= 0.09
+    assert bucket.stats()["acquired"] == 3
+
+
+def test_bounded_as_completed_limits_concurrency():
+    """No more than the given number of jobs run at once"""
+    running = 0
+    peak = 0
+
+    async def job(item):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        if item == 3:
+            raise ValueError("boom")
+        return item * 2
+
+    async def collect():
+        return [r async for r in bounded_as_completed(range(6), job, 2)]
+
+    results = asyncio.run(collect())
+    assert peak == 2
+    assert sorted(item for item, _, _ in results) == list(range(6))
+    assert [type(err) for item, _, err in results if item == 3] == [ValueError]
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    """Concurrent calls for one key share a single execution"""
+    flights = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    async def burst():
+        first = await asyncio.gather(*(flights.do("a", work)
+                                       for _ in range(5)))
+        return first, await flights.do("a", work)
+
+    first, later = asyncio.run(burst())
+    assert first == [1] * 5
+    assert later == 2  # A finished call is not reused
+    assert flights.stats() == {"in_flight": 0, "executed": 2, "coalesced": 4}
+
+
+class TestBatchDetection:
+    """Test suite for POST /api/detections/batch"""
+
+    @pytest.fixture(autouse=True)
+    def isolated_storage(self, tmp_path, monkeypatch):
+        self.uploads = tmp_path / "uploads"
+        processed = tmp_path / "processed"
+        self.uploads.mkdir()
+        processed.mkdir()
+        self.azure_calls = 0
+
+        async def fake_azure(image_data):
+            self.azure_calls += 1
+            return {"objects": [{"rectangle": {"x": 1, "y": 1, "w": 4, "h": 4},
+                                 "object": "box", "confidence": 0.5}]}
+
+        monkeypatch.setattr(detection_module, "UPLOAD_DIR", self.uploads)
+        monkeypatch.setattr(detection_module, "PROCESSED_DIR", processed)
+        monkeypatch.setattr(detection_module, "run_detector", fake_azure)
+        monkeypatch.setattr(detection_cache, "_cache",
+                            DetectionCache(tmp_path / "cache"))
+        monkeypatch.setattr(image_index, "_index",
+                            ImageIndex(tmp_path / "index.db"))
+        monkeypatch.setattr(render_pool, "_pool", RenderPool(mode="thread"))
+
+    def make_image(self, name, color):
+        buffer = io.BytesIO()
+        Image.new("RGB", (16, 16), color).save(buffer, format="JPEG")
+        (self.uploads / name).write_bytes(buffer.getvalue())
+
+    def test_streams_one_line_per_image(self):
+        """Each image gets its own NDJSON result line, errors included"""
+        self.make_image("a.jpg", "red")
+        self.make_image("b.jpg", "blue")
+
+        response = client.post(
+            "/api/detections/batch",
+            json={"image_ids": ["a.jpg", "b.jpg", "missing.jpg", "a.jpg"]},
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith(
+            "application/x-ndjson")
+
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        by_id = {line["image_id"]: line for line in lines}
+        assert len(lines) == 3
+        assert by_id["a.jpg"]["status"] == "ok"
+        assert by_id["b.jpg"]["processed_image_url"].startswith(
+            "/api/processed_uploads/processed_b.jpg?v=")
+        assert by_id["missing.jpg"]["status_code"] == 404
+        assert self.azure_calls == 2
+
+    def test_rejects_empty_batch(self):
+        """An empty list of IDs is a validation error"""
+        response = client.post("/api/detections/batch", json={"image_ids": []})
+        assert response.status_code == 422
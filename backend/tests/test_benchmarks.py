@@ -0,0 +1,56 @@
+from fastapi.testclient import TestClient
+
+from app.utils import image_index
+from benchmarks import mock_azure
+from benchmarks.run import bench_draw, bench_list_images, compare, \
+    make_jpeg, summarize, unique_variant
+
+
+def test_summarize_percentiles():
+    """Latency samples are summarized in milliseconds"""
+    summary = summarize([0.001 * n for n in range(1, 101)])
+    assert summary["count"] == 100
+    assert summary["p50_ms"] == 50.0
+    assert summary["p95_ms"] == 95.0
+    assert summary["max_ms"] == 100.0
+
+
+def test_compare_flags_regressions():
+    """Slower latencies and lower throughput beyond tolerance are reported"""
+    baseline = [{"benchmark": "e2e", "params": {"c": 1},
+                 "metrics": {"p95_ms": 100.0, "rps": 50.0, "count": 10}}]
+    current = [{"benchmark": "e2e", "params": {"c": 1},
+                "metrics": {"p95_ms": 130.0, "rps": 45.0, "count": 99}},
+               {"benchmark": "new", "params": {}, "metrics": {"p95_ms": 1}}]
+
+    regressions = compare(current, baseline, tolerance=0.2)
+    assert [r["metric"] for r in regressions] == ["p95_ms"]
+    assert compare(current, baseline, tolerance=0.5) == []
+
+
+def test_micro_benchmarks_produce_results():
+    """The in-process suites run and restore the shared index"""
+    previous = image_index._index
+    draw = bench_draw([(64, 48)], [1, 3], repeats=2)
+    listing = bench_list_images([30], repeats=2, page_size=10)
+
+    assert [r["params"]["boxes"] for r in draw] == [1, 3]
+    assert {r["params"]["variant"] for r in listing} == {
+        "first_page", "middle_page_offset", "middle_page_cursor"}
+    assert all(r["metrics"]["count"] == 2 for r in draw + listing)
+    assert image_index._index is previous
+
+
+def test_mock_azure_returns_boxes_inside_image():
+    """The mock analyze endpoint answers in the Azure response shape"""
+    client = TestClient(mock_azure.create_app(boxes=4))
+    image = unique_variant(make_jpeg((200, 100)))
+    response = client.post("/vision/v3.2/analyze", content=image)
+    assert response.status_code == 200
+
+    objects = response.json()["objects"]
+    assert len(objects) == 4
+    for obj in objects:
+        rect = obj["rectangle"]
+        assert rect["x"] + rect["w"] <= 200
+        assert rect["y"] + rect["h"] <= 100
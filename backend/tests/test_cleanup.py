@@ -0,0 +1,212 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.main as main_module
+from app.main import app
+from app.utils import cleanup, detection_cache, image_index
+from app.utils.cleanup import GarbageCollector
+from app.utils.derivatives import derivative_path
+from app.utils.detection_cache import DetectionCache
+from app.utils.image_index import ImageIndex, ImageRecord
+
+
+def wait_for_job(client, created):
+    for _ in range(200):
+        job = client.get(created["status_url"]).json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError("job did not finish")
+
+
+class CleanupTestBase:
+    @pytest.fixture(autouse=True)
+    def isolated_storage(self, tmp_path, monkeypatch):
+        self.uploads = tmp_path / "uploads"
+        self.processed = tmp_path / "processed"
+        self.uploads.mkdir()
+        self.processed.mkdir()
+        self.index = ImageIndex(tmp_path / "index.db")
+        self.cache = DetectionCache(tmp_path / "cache", ttl_seconds=60)
+        self.collector = GarbageCollector(
+            interval=0, staged_max_age=60, original_dir=self.uploads,
+            processed_dir=self.processed)
+        monkeypatch.setattr(image_index, "_index", self.index)
+        monkeypatch.setattr(detection_cache, "_cache", self.cache)
+        monkeypatch.setattr(cleanup, "_collector", self.collector)
+        monkeypatch.setattr(main_module, "UPLOAD_DIR", self.uploads)
+        monkeypatch.setattr(main_module, "PROCESSED_DIR", self.processed)
+
+    def store(self, name, uploaded_at=None, processed=True, refs=1):
+        original = self.uploads / name
+        original.write_bytes(b"original")
+        record = ImageRecord(id=name, original_path=str(original),
+                             uploaded_at=uploaded_at or time.time(),
+                             refs=refs)
+        if processed:
+            path = self.processed / f"processed_{name}"
+            path.write_bytes(b"processed")
+            thumbnail = derivative_path(str(path), "thumbnail")
+            thumbnail.parent.mkdir(exist_ok=True)
+            thumbnail.write_bytes(b"thumb")
+            record.processed_path = str(path)
+        return self.index.add(record)
+
+
+def age(path, seconds):
+    stamp = time.time() - seconds
+    os.utime(path, (stamp, stamp))
+
+
+class TestBulkDelete(CleanupTestBase):
+    """Test suite for DELETE /api/images"""
+
+    def test_delete_by_ids(self):
+        """IDs resolve through the index; shared images lose a reference"""
+        first = self.store("a.jpg")
+        self.store("b.jpg", refs=2)
+        self.store("c.jpg")
+
+        with TestClient(app) as client:
+            response = client.request("DELETE", "/api/images", json={
+                "ids": ["processed_a", "b.jpg", "missing.jpg"]})
+            assert response.status_code == 202
+            created = response.json()
+            assert created["matched"] == 2
+            assert created["not_found"] == ["missing.jpg"]
+
+            job = wait_for_job(client, created)
+        assert job["status"] == "succeeded"
+        assert job["result"]["deleted"] == 1
+        assert job["result"]["released"] == 1
+        assert job["result"]["bytes_reclaimed"] == \
+            len(b"original") + len(b"processed") + len(b"thumb")
+
+        assert not os.path.exists(first.original_path)
+        assert not derivative_path(first.processed_path, "thumbnail").exists()
+        assert self.index.get("a.jpg") is None
+        assert self.index.get("b.jpg").refs == 1
+        assert self.index.get("c.jpg") is not None
+
+    def test_delete_invalidates_cached_detections(self):
+        """Releasing the last reference drops the image from the cache"""
+        shared = self.store("shared.jpg", refs=2)
+        deleted = self.store("deleted.jpg")
+        self.index.update("shared.jpg", hash="a" * 64)
+        self.index.update("deleted.jpg", hash="b" * 64)
+        for key in ("a" * 64, "b" * 64):
+            asyncio.run(self.cache.put_boxes(key, [{"label": "cat"}]))
+
+        totals = cleanup.delete_images(
+            [self.index.get(shared.id), self.index.get(deleted.id)])
+        assert totals["deleted"] == 1 and totals["released"] == 1
+        assert asyncio.run(self.cache.get_boxes("a" * 64)) is not None
+        assert asyncio.run(self.cache.get_boxes("b" * 64)) is None
+        assert not list(self.cache.cache_dir.glob("b*"))
+
+    def test_delete_older_than(self, monkeypatch):
+        """A filter removes every matching image, across batches"""
+        import app.routes.images as images_module
+        monkeypatch.setattr(images_module, "BULK_DELETE_BATCH_SIZE", 2)
+        cutoff = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for n in range(5):
+            self.store(f"old{n}.jpg", refs=2,
+                       uploaded_at=cutoff.timestamp() - 100 + n)
+        self.store("new.jpg")
+
+        with TestClient(app) as client:
+            response = client.request("DELETE", "/api/images", json={
+                "older_than": cutoff.isoformat()})
+            assert response.status_code == 202
+            assert response.json()["matched"] == 5
+            job = wait_for_job(client, response.json())
+        assert job["result"]["deleted"] == 5
+        assert self.index.count() == 1
+        assert self.index.get("new.jpg") is not None
+
+    def test_invalid_requests(self):
+        """Exactly one of ids and older_than must be given"""
+        with TestClient(app) as client:
+            for body in ({}, {"ids": ["a.jpg"],
+                              "older_than": "2024-01-01T00:00:00Z"}):
+                assert client.request("DELETE", "/api/images",
+                                      json=body).status_code == 400
+            assert client.request("DELETE", "/api/images",
+                                  json={"ids": []}).status_code == 422
+
+
+class TestGarbageCollector(CleanupTestBase):
+    """Test suite for periodic garbage collection"""
+
+    def test_collect_reclaims_unreferenced_files(self):
+        """Released images, stale staging files, orphaned derivatives and
+        expired cache files are removed and their bytes reported"""
+        released = self.store("released.jpg", refs=0)
+        kept = self.store("kept.jpg")
+
+        stale = self.uploads / ".upload.abc.part"
+        stale.write_bytes(b"12345")
+        age(stale, 120)
+        fresh = self.uploads / ".upload.def.part"
+        fresh.write_bytes(b"12345")
+
+        orphan = derivative_path(str(self.processed / "processed_gone.jpg"),
+                                 "preview")
+        orphan.write_bytes(b"preview")
+        age(orphan, 1)
+
+        expired = self.cache.cache_dir / "old.json"
+        expired.write_bytes(b"{}")
+        age(expired, 120)
+
+        report = self.collector.collect()
+        assert report["removed"] == {
+            "released_images": 1, "orphaned_images": 0, "staged_files": 1,
+            "derivatives": 1, "detection_cache_files": 1}
+        assert report["bytes_reclaimed"] == (
+            len(b"original") + len(b"processed") + len(b"thumb") +
+            len(b"12345") + len(b"preview") + len(b"{}"))
+
+        assert self.index.get("released.jpg") is None
+        assert not os.path.exists(released.processed_path)
+        assert fresh.exists() and not stale.exists() and not orphan.exists()
+        assert os.path.exists(kept.processed_path)
+        assert derivative_path(kept.processed_path, "thumbnail").exists()
+        assert self.collector.stats()["runs"] == 1
+
+    def test_reconcile_drops_records_of_missing_files(self):
+        """Records whose files were removed behind the index's back go"""
+        record = self.store("a.jpg", processed=False,
+                            uploaded_at=time.time() - 3600)
+        os.unlink(record.original_path)
+        report = self.collector.collect()
+        assert report["reconciled"]["removed"] == 1
+        assert self.index.get("a.jpg") is None
+
+    def test_orphans_are_only_removed_when_enabled(self):
+        """Originals never processed are kept unless orphan removal is on"""
+        record = self.store("unprocessed.jpg", uploaded_at=time.time() - 120,
+                            processed=False)
+        assert self.collector.collect()["removed"]["orphaned_images"] == 0
+        assert os.path.exists(record.original_path)
+
+        self.collector.orphan_max_age = 60
+        assert self.collector.collect()["removed"]["orphaned_images"] == 1
+        assert not os.path.exists(record.original_path)
+
+    def test_gc_endpoint_runs_collection(self):
+        """POST /api/images/gc runs a collection as a job"""
+        self.store("released.jpg", refs=0)
+        with TestClient(app) as client:
+            response = client.post("/api/images/gc")
+            assert response.status_code == 202
+            job = wait_for_job(client, response.json())
+            assert job["status"] == "succeeded"
+            assert job["result"]["removed"]["released_images"] == 1
+            stats = client.get("/api/health/stats").json()["gc"]
+        assert stats["runs"] == 1
@@ -0,0 +1,161 @@
+import io
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import app.routes.detection as detection_module
+from app.main import app
+from app.utils import derivatives, detection_cache, image_index, render_pool
+from app.utils.derivatives import build_derivatives, derivative_path, \
+    fresh_derivative
+from app.utils.detection_cache import DetectionCache
+from app.utils.image_index import ImageIndex
+from app.utils.render_pool import RenderPool
+from tests.test_detection_cache import AZURE_RESPONSE, make_jpeg
+
+client = TestClient(app)
+
+
+class TestBuildDerivatives:
+    """Test suite for derivative generation"""
+
+    def test_sizes_fit_their_bounds(self, monkeypatch):
+        """Each derivative fits its bound and keeps the aspect ratio"""
+        monkeypatch.setattr(derivatives, "DERIVATIVE_SIZES",
+                            {"thumbnail": 64, "preview": 256})
+        result = build_derivatives(make_jpeg(size=(800, 400)))
+        thumbnail = Image.open(io.BytesIO(result["thumbnail"]))
+        preview = Image.open(io.BytesIO(result["preview"]))
+        assert thumbnail.format == "JPEG"
+        assert thumbnail.size == (64, 32)
+        assert preview.size == (256, 128)
+
+    def test_small_images_are_not_upscaled(self, monkeypatch):
+        """Images smaller than a bound keep their size"""
+        monkeypatch.setattr(derivatives, "DERIVATIVE_SIZES",
+                            {"thumbnail": 64})
+        result = build_derivatives(make_jpeg(size=(40, 20)))
+        assert Image.open(io.BytesIO(result["thumbnail"])).size == (40, 20)
+
+    def test_transparent_png_is_flattened(self):
+        """PNG sources with alpha become JPEG on a white background"""
+        buffer = io.BytesIO()
+        Image.new("RGBA", (32, 32), (0, 0, 0, 0)).save(buffer, format="PNG")
+        result = build_derivatives(buffer.getvalue())
+        thumbnail = Image.open(io.BytesIO(result["thumbnail"]))
+        assert thumbnail.getpixel((16, 16))[0] > 240
+
+    def test_stale_derivatives_are_ignored(self, tmp_path):
+        """A derivative older than its processed image must be rebuilt"""
+        processed = tmp_path / "processed_photo.jpg"
+        processed.write_bytes(make_jpeg())
+        path = derivative_path(str(processed), "thumbnail")
+        assert path.parent.name == "derivatives"
+        assert fresh_derivative(str(processed), "thumbnail") is None
+
+        path.parent.mkdir()
+        path.write_bytes(b"old")
+        stat = processed.stat()
+        os.utime(path, (stat.st_atime, stat.st_mtime - 10))
+        assert fresh_derivative(str(processed), "thumbnail") is None
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+        assert fresh_derivative(str(processed), "thumbnail") == path
+
+
+class TestDerivativeEndpoints:
+    """Listing links derivatives generated eagerly or on first request"""
+
+    @pytest.fixture(autouse=True)
+    def isolated_dirs(self, tmp_path, monkeypatch):
+        self.uploads = tmp_path / "uploads"
+        self.processed = tmp_path / "processed"
+        self.uploads.mkdir()
+        self.processed.mkdir()
+        monkeypatch.setattr(detection_module, "UPLOAD_DIR", self.uploads)
+        monkeypatch.setattr(detection_module, "PROCESSED_DIR",
+                            self.processed)
+        monkeypatch.setattr(detection_cache, "_cache",
+                            DetectionCache(tmp_path / "cache"))
+        monkeypatch.setattr(image_index, "_index",
+                            ImageIndex(tmp_path / "index.db"))
+        monkeypatch.setattr(render_pool, "_pool", RenderPool(mode="thread"))
+
+        async def fake_azure(image_data):
+            return AZURE_RESPONSE
+
+        monkeypatch.setattr(detection_module, "run_detector", fake_azure)
+
+    def process(self, name="photo.jpg"):
+        (self.uploads / name).write_bytes(make_jpeg(size=(600, 300)))
+        response = client.get(f"/api/detections/{name}/image")
+        assert response.status_code == 200
+        return self.processed / f"processed_{name}"
+
+    def test_processing_generates_derivatives(self):
+        """Processed images get static thumbnail and preview URLs"""
+        processed = self.process()
+        assert derivative_path(str(processed), "thumbnail").exists()
+
+        item = client.get("/api/images").json()["items"][0]
+        assert item["thumbnail_url"] == \
+            "/api/processed_uploads/derivatives/thumbnail_processed_photo.jpg"
+        assert item["preview_url"].startswith(
+            "/api/processed_uploads/derivatives/")
+
+    def test_missing_derivative_is_generated_on_request(self):
+        """The lazy endpoint creates, saves and serves derivatives"""
+        processed = self.process()
+        derivatives.remove_derivatives(str(processed))
+
+        item = client.get("/api/images").json()["items"][0]
+        assert item["thumbnail_url"] == \
+            "/api/images/processed_photo/derivatives/thumbnail"
+
+        response = client.get(item["thumbnail_url"])
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/jpeg"
+        assert max(Image.open(io.BytesIO(response.content)).size) == \
+            derivatives.DERIVATIVE_SIZES["thumbnail"]
+        assert derivative_path(str(processed), "thumbnail").exists()
+
+        not_modified = client.get(item["thumbnail_url"], headers={
+            "If-None-Match": response.headers["etag"]})
+        assert not_modified.status_code == 304
+
+    def test_unknown_derivative_or_image(self):
+        """Unknown derivative names and images are 404"""
+        self.process()
+        assert client.get(
+            "/api/images/processed_photo/derivatives/huge").status_code == 404
+        assert client.get(
+            "/api/images/missing/derivatives/thumbnail").status_code == 404
+
+    def test_delete_removes_derivatives(self):
+        """Deleting an image also deletes its derivatives"""
+        processed = self.process()
+        assert client.delete("/api/images/processed_photo").status_code == 200
+        assert not derivative_path(str(processed), "thumbnail").exists()
+        assert not derivative_path(str(processed), "preview").exists()
+
+    def test_listing_needs_no_storage_lookups(self, monkeypatch):
+        """Derivative URLs come from the index; reprocessing marks the
+        derivatives stale until they are generated again"""
+        self.process()
+        storage = detection_module.get_storage()
+
+        def no_lookups(key):
+            raise AssertionError(f"listing looked up {key}")
+
+        monkeypatch.setattr(storage, "stat", no_lookups)
+        monkeypatch.setattr(storage, "exists", no_lookups)
+        item = client.get("/api/images").json()["items"][0]
+        assert item["thumbnail_url"].startswith(
+            "/api/processed_uploads/derivatives/")
+
+        record = image_index._index.get("photo.jpg")
+        image_index._index.set_processed(record.id, record.processed_path)
+        item = client.get("/api/images").json()["items"][0]
+        assert item["thumbnail_url"] == \
+            "/api/images/processed_photo/derivatives/thumbnail"
@@ -0,0 +1,100 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app.routes.detection as detection_module
+from app.main import app
+from app.utils import detection_cache, image_index, render_pool
+from app.utils.detection_cache import DetectionCache
+from app.utils.image_index import ImageIndex
+from app.utils.render_pool import RenderPool
+from tests.test_detection_cache import AZURE_RESPONSE, make_jpeg
+
+client = TestClient(app)
+
+
+class TestDetectionBoxes:
+    """Test suite for the JSON bounding-box endpoint"""
+
+    @pytest.fixture(autouse=True)
+    def isolated_dirs(self, tmp_path, monkeypatch):
+        self.uploads = tmp_path / "uploads"
+        processed = tmp_path / "processed"
+        self.uploads.mkdir()
+        processed.mkdir()
+        monkeypatch.setattr(detection_module, "UPLOAD_DIR", self.uploads)
+        monkeypatch.setattr(detection_module, "PROCESSED_DIR", processed)
+        monkeypatch.setattr(detection_cache, "_cache",
+                            DetectionCache(tmp_path / "cache"))
+        monkeypatch.setattr(image_index, "_index",
+                            ImageIndex(tmp_path / "index.db"))
+        monkeypatch.setattr(render_pool, "_pool", RenderPool(mode="thread"))
+        self.azure_calls = 0
+        self.renders = 0
+
+        async def fake_azure(image_data):
+            self.azure_calls += 1
+            return AZURE_RESPONSE
+
+        original_render = detection_module.render_detection_image
+
+        def counting_render(*args):
+            self.renders += 1
+            return original_render(*args)
+
+        monkeypatch.setattr(detection_module, "run_detector", fake_azure)
+        monkeypatch.setattr(detection_module, "render_detection_image",
+                            counting_render)
+
+    def test_boxes_without_rendering(self):
+        """Boxes are detected once, stored and served without a render"""
+        (self.uploads / "photo.jpg").write_bytes(make_jpeg(size=(64, 48)))
+
+        response = client.get("/api/detections/photo.jpg/boxes")
+        assert response.status_code == 200
+        assert response.json() == {
+            "image_id": "photo.jpg",
+            "width": 64,
+            "height": 48,
+            "boxes": [{"label": "cat", "x": 2.0, "y": 3.0, "w": 10.0,
+                       "h": 12.0, "score": 0.9}],
+        }
+        assert self.renders == 0
+        assert image_index._index.get_detections("photo.jpg") is not None
+
+        # Served from the index, even after the detection cache is cleared
+        detection_cache._cache.invalidate(
+            image_index._index.get("photo.jpg").hash)
+        again = client.get("/api/detections/photo.jpg/boxes")
+        assert again.json() == response.json()
+        assert self.azure_calls == 1
+
+        not_modified = client.get("/api/detections/photo.jpg/boxes", headers={
+            "If-None-Match": response.headers["etag"]})
+        assert not_modified.status_code == 304
+
+    def test_detection_stores_boxes(self):
+        """The detection endpoint persists boxes and links them"""
+        (self.uploads / "photo.jpg").write_bytes(make_jpeg())
+
+        result = client.get("/api/detections/photo.jpg").json()
+        assert result["boxes_url"] == "/api/detections/photo.jpg/boxes"
+
+        boxes = client.get(result["boxes_url"]).json()["boxes"]
+        assert [box["label"] for box in boxes] == ["cat"]
+        assert self.azure_calls == 1
+        assert self.renders == 1
+
+    def test_changed_original_is_detected_again(self):
+        """Stored boxes are ignored once the image content hash changes"""
+        (self.uploads / "photo.jpg").write_bytes(make_jpeg())
+        client.get("/api/detections/photo.jpg/boxes")
+        image_index._index.update("photo.jpg", hash=None)
+        (self.uploads / "photo.jpg").write_bytes(make_jpeg(color="blue"))
+
+        client.get("/api/detections/photo.jpg/boxes")
+        assert self.azure_calls == 2
+
+    def test_unknown_image(self):
+        """Unknown images are 404"""
+        response = client.get("/api/detections/missing.jpg/boxes")
+        assert response.status_code == 404
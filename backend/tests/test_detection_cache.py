@@ -0,0 +1,252 @@
+import asyncio
+import io
+import threading
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import app.routes.detection as detection_module
+from app.main import app
+from app.utils import detection_cache, image_encoding, image_index, \
+    image_processing, render_pool
+from app.utils.detection_cache import DetectionCache
+from app.utils.http_caching import strong_etag
+from app.utils.image_index import ImageIndex
+from app.utils.render_pool import RenderPool
+
+client = TestClient(app)
+
+AZURE_RESPONSE = {
+    "objects": [
+        {"rectangle": {"x": 2, "y": 3, "w": 10, "h": 12},
+         "object": "cat", "confidence": 0.9},
+    ]
+}
+
+
+def make_jpeg(color="red", size=(32, 32)):
+    """Create a small in-memory JPEG image"""
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class TestDetectionCache:
+    """Test suite for the two-tier detection cache"""
+
+    def test_boxes_round_trip_and_counters(self, tmp_path):
+        """Stored boxes are returned and hits/misses are counted"""
+        cache = DetectionCache(tmp_path)
+        assert asyncio.run(cache.get_boxes("abc")) is None
+
+        asyncio.run(cache.put_boxes("abc", [{"label": "cat"}]))
+        assert asyncio.run(cache.get_boxes("abc")) == [{"label": "cat"}]
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+
+    def test_disk_tier_survives_new_instance(self, tmp_path):
+        """Entries persist on disk across cache instances"""
+        asyncio.run(DetectionCache(tmp_path).put_boxes(
+            "abc", [{"label": "dog"}]))
+        asyncio.run(DetectionCache(tmp_path).put_rendered(
+            "abc", b"jpeg-bytes"))
+
+        cache = DetectionCache(tmp_path)
+        assert asyncio.run(cache.get_boxes("abc")) == [{"label": "dog"}]
+        assert asyncio.run(cache.get_rendered("abc")) == b"jpeg-bytes"
+        assert cache.stats()["disk_hits"] == 1
+        assert cache.peek_rendered_etag("abc") == strong_etag(b"jpeg-bytes")
+
+    def test_disk_tier_is_read_off_the_event_loop(self, tmp_path,
+                                                  monkeypatch):
+        """Disk reads and writes run in worker threads"""
+        threads = []
+        write_atomic = DetectionCache._write_atomic
+        read_boxes = DetectionCache._read_disk_boxes
+
+        def record_write(cache, path, data):
+            threads.append(threading.current_thread())
+            write_atomic(cache, path, data)
+
+        def record_read(cache, key):
+            threads.append(threading.current_thread())
+            return read_boxes(cache, key)
+
+        monkeypatch.setattr(DetectionCache, "_write_atomic", record_write)
+        monkeypatch.setattr(DetectionCache, "_read_disk_boxes", record_read)
+
+        asyncio.run(DetectionCache(tmp_path).put_boxes("abc", []))
+        assert asyncio.run(DetectionCache(tmp_path).get_boxes("abc")) == []
+        assert len(threads) == 2
+        assert threading.main_thread() not in threads
+
+    def test_concurrent_writes_of_one_key(self, tmp_path):
+        """Threads writing the same entry never share a temporary file"""
+        cache = DetectionCache(tmp_path)
+        renders = [bytes([n]) * 4096 for n in range(16)]
+
+        async def write_all():
+            await asyncio.gather(*(cache.put_rendered("abc", rendered)
+                                   for rendered in renders))
+
+        asyncio.run(write_all())
+        assert cache._rendered_path("abc").read_bytes() in renders
+        assert not list(tmp_path.glob(".*.tmp"))
+
+    def test_invalidate_removes_every_detector_entry(self, tmp_path):
+        """An image's boxes and renders go, whichever backend made them"""
+        cache = DetectionCache(tmp_path)
+        image_hash, other = "a" * 64, "b" * 64
+
+        async def fill():
+            for key in (image_hash, f"{image_hash}-mock", other):
+                await cache.put_boxes(key, [{"label": "cat"}])
+                await cache.put_rendered(key, b"jpeg-bytes")
+
+        asyncio.run(fill())
+        cache.invalidate(image_hash)
+        assert sorted(path.name.split(".")[0]
+                      for path in tmp_path.iterdir()) == [other, other]
+        assert all(key.startswith(other) for key in cache._entries)
+        assert asyncio.run(cache.get_boxes(f"{image_hash}-mock")) is None
+        assert asyncio.run(cache.get_rendered(other)) == b"jpeg-bytes"
+
+    def test_renders_are_keyed_by_settings(self, tmp_path, monkeypatch):
+        """Changing the box style or encoder options misses old renders"""
+        cache = DetectionCache(tmp_path)
+        asyncio.run(cache.put_rendered("abc", b"outlined"))
+        assert asyncio.run(cache.get_rendered("abc")) == b"outlined"
+
+        monkeypatch.setattr(image_processing, "BOX_FILL_ALPHA", 0.5)
+        assert asyncio.run(cache.get_rendered("abc")) is None
+        monkeypatch.setattr(image_processing, "BOX_FILL_ALPHA", 0.0)
+
+        monkeypatch.setitem(image_encoding.ENCODER_OPTIONS["jpeg"],
+                            "quality", 50)
+        assert asyncio.run(DetectionCache(tmp_path).get_rendered(
+            "abc")) is None
+
+    def test_lru_eviction_by_entries_and_bytes(self, tmp_path):
+        """The memory tier evicts least recently used entries"""
+        cache = DetectionCache(tmp_path, max_entries=2)
+        asyncio.run(cache.put_boxes("a", []))
+        asyncio.run(cache.put_boxes("b", []))
+        asyncio.run(cache.get_boxes("a"))
+        asyncio.run(cache.put_boxes("c", []))
+        assert list(cache._entries) == ["a", "c"]
+        assert cache.stats()["evictions"] == 1
+
+        cache = DetectionCache(tmp_path, max_bytes=10)
+        asyncio.run(cache.put_rendered("big", b"x" * 20))
+        assert cache.stats()["entries"] == 0
+
+    def test_ttl_expiry(self, tmp_path):
+        """Expired entries are treated as misses in both tiers"""
+        cache = DetectionCache(tmp_path, ttl_seconds=60)
+        asyncio.run(cache.put_boxes("abc", []))
+        cache._entries["abc"].created_at = time.time() - 120
+        assert asyncio.run(cache.get_boxes("abc")) == []  # reloaded from disk
+        assert cache.stats()["disk_hits"] == 1
+
+        expired = DetectionCache(tmp_path, ttl_seconds=0)
+        time.sleep(0.01)
+        assert asyncio.run(expired.get_boxes("abc")) is None
+
+
+class TestDetectionRoutesCache:
+    """Detection routes reuse cached results"""
+
+    def setup_method(self):
+        self.azure_calls = 0
+
+    @pytest.fixture(autouse=True)
+    def isolated_dirs(self, tmp_path, monkeypatch):
+        uploads = tmp_path / "uploads"
+        processed = tmp_path / "processed"
+        uploads.mkdir()
+        processed.mkdir()
+        monkeypatch.setattr(detection_module, "UPLOAD_DIR", uploads)
+        monkeypatch.setattr(detection_module, "PROCESSED_DIR", processed)
+        monkeypatch.setattr(detection_cache, "_cache",
+                            DetectionCache(tmp_path / "cache"))
+        monkeypatch.setattr(image_index, "_index",
+                            ImageIndex(tmp_path / "index.db"))
+
+        async def fake_azure(image_data):
+            self.azure_calls += 1
+            return AZURE_RESPONSE
+
+        monkeypatch.setattr(detection_module, "run_detector", fake_azure)
+        self.uploads = uploads
+
+    def test_repeated_detection_calls_azure_once(self):
+        """Re-opening and re-uploading the same photo skips Azure"""
+        image = make_jpeg()
+        (self.uploads / "first.jpg").write_bytes(image)
+        (self.uploads / "copy.jpg").write_bytes(image)
+
+        assert client.get("/api/detections/first.jpg").status_code == 200
+        assert client.get("/api/detections/first.jpg/image").status_code == 200
+        assert client.get("/api/detections/copy.jpg").status_code == 200
+        assert self.azure_calls == 1
+
+        # The /image request reuses the persisted processed file; the copy
+        # is served from the content-addressed cache
+        stats = client.get("/api/health/stats").json()["detection_cache"]
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["render_hits"] == 1
+
+    def test_image_endpoint_reuses_persisted_render(self, monkeypatch):
+        """The /image endpoint serves the processed file without rendering"""
+        (self.uploads / "photo.jpg").write_bytes(make_jpeg())
+        assert client.get("/api/detections/photo.jpg").status_code == 200
+
+        def fail_render(*args):
+            raise AssertionError("rendered again")
+
+        monkeypatch.setattr(detection_module, "detect_and_render", fail_render)
+        response = client.get("/api/detections/photo.jpg/image")
+        assert response.status_code == 200
+        assert response.content == (
+            detection_module.PROCESSED_DIR / "processed_photo.jpg").read_bytes()
+        assert self.azure_calls == 1
+
+    def test_concurrent_requests_are_coalesced(self, monkeypatch):
+        """A burst of requests for one image calls Azure and renders once"""
+        (self.uploads / "photo.jpg").write_bytes(make_jpeg())
+        renders = 0
+        render = detection_module.render_detection_image
+
+        async def slow_azure(image_data):
+            self.azure_calls += 1
+            await asyncio.sleep(0.05)
+            return AZURE_RESPONSE
+
+        def counting_render(image_data, boxes, *args):
+            nonlocal renders
+            renders += 1
+            return render(image_data, boxes, *args)
+
+        monkeypatch.setattr(detection_module, "run_detector", slow_azure)
+        monkeypatch.setattr(detection_module, "render_detection_image",
+                            counting_render)
+        monkeypatch.setattr(render_pool, "_pool", RenderPool(mode="thread"))
+
+        async def burst():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport,
+                                         base_url="http://test") as http:
+                urls = ["/api/detections/photo.jpg",
+                        "/api/detections/photo.jpg/image"] * 5
+                return await asyncio.gather(*(http.get(url) for url in urls))
+
+        responses = asyncio.run(burst())
+        assert [r.status_code for r in responses] == [200] * 10
+        assert self.azure_calls == 1
+        assert renders == 1
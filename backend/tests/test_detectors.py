@@ -0,0 +1,150 @@
+import asyncio
+import io
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from PIL import Image, ImageDraw
+
+import app.routes.detection as detection_module
+from app.main import app
+from app.utils import detection_cache, detectors, http_client, image_index, \
+    render_pool
+from app.utils.detection_cache import DetectionCache
+from app.utils.detectors import AzureDetector, FakeDetector, LocalDetector, \
+    create_detector
+from app.utils.image_index import ImageIndex
+from app.utils.render_pool import RenderPool
+
+client = TestClient(app)
+
+
+def make_scene(size=(320, 240), box=(100, 60, 220, 180)):
+    """A plain background with one high-contrast rectangle"""
+    image = Image.new("RGB", size, "white")
+    ImageDraw.Draw(image).rectangle(box, fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class TestDetectorBackends:
+    """Test suite for the detector backends"""
+
+    def test_create_detector_by_name(self):
+        """Backends are selected by name; unknown names are rejected"""
+        assert isinstance(create_detector("azure"), AzureDetector)
+        assert isinstance(create_detector("Local"), LocalDetector)
+        assert isinstance(create_detector("fake"), FakeDetector)
+        with pytest.raises(ValueError):
+            create_detector("nope")
+
+    def test_backend_selected_from_environment(self, monkeypatch):
+        """DETECTOR_BACKEND and the fake's settings come from the env"""
+        monkeypatch.setenv("DETECTOR_BACKEND", "fake")
+        monkeypatch.setenv("DETECTOR_FAKE_BOXES", "5")
+        monkeypatch.setenv("DETECTOR_FAKE_LATENCY_MS", "20")
+        monkeypatch.setattr(detectors, "_detector", None)
+
+        detector = detectors.get_detector()
+        assert detector.stats() == {"backend": "fake", "calls": 0,
+                                    "latency_seconds": 0.02, "boxes": 5}
+
+    def test_fake_detector_is_deterministic(self):
+        """The same image gives the same boxes after the set latency"""
+        detector = FakeDetector(latency_seconds=0.05, boxes=4)
+        image = make_scene()
+
+        started = time.monotonic()
+        first = asyncio.run(detector.detect(image))
+        assert time.monotonic() - started >= 0.05
+        assert asyncio.run(detector.detect(image)) == first
+        assert len(first["objects"]) == 4
+        for obj in first["objects"]:
+            rect = obj["rectangle"]
+            assert 0 <= rect["x"] and rect["x"] + rect["w"] <= 320
+            assert 0 <= rect["y"] and rect["y"] + rect["h"] <= 240
+
+    def test_local_detector_finds_contrasting_region(self):
+        """The local detector boxes the only object in the scene"""
+        result = asyncio.run(LocalDetector().detect(make_scene()))
+        assert len(result["objects"]) == 1
+        rect = result["objects"][0]["rectangle"]
+        assert rect["x"] == pytest.approx(100, abs=15)
+        assert rect["y"] == pytest.approx(60, abs=15)
+        assert rect["x"] + rect["w"] == pytest.approx(220, abs=15)
+        assert rect["y"] + rect["h"] == pytest.approx(180, abs=15)
+
+    def test_local_detector_rejects_non_images(self):
+        """Undecodable input is a 422, not a server error"""
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(LocalDetector().detect(b"not an image"))
+        assert error.value.status_code == 422
+
+    def test_azure_detector_posts_image(self, monkeypatch):
+        """The Azure backend calls the analyze API with the image bytes"""
+        monkeypatch.setenv("VISION_ENDPOINT", "https://vision.test/")
+        monkeypatch.setenv("VISION_KEY", "secret")
+        seen = {}
+
+        def handler(request):
+            seen["url"] = str(request.url)
+            seen["key"] = request.headers["Ocp-Apim-Subscription-Key"]
+            seen["body"] = request.content
+            return httpx.Response(200, json={"objects": []})
+
+        async def detect():
+            monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(
+                transport=httpx.MockTransport(handler)))
+            return await AzureDetector().detect(b"image-bytes")
+
+        assert asyncio.run(detect()) == {"objects": []}
+        assert seen == {
+            "url": "https://vision.test/vision/v3.2/analyze"
+                   "?visualFeatures=Objects",
+            "key": "secret",
+            "body": b"image-bytes",
+        }
+
+    def test_cache_keys_are_per_backend(self):
+        """Azure keeps the bare hash; other backends get their own keys"""
+        assert AzureDetector().cache_key("abc") == "abc"
+        assert FakeDetector().cache_key("abc") == "abc-fake"
+
+
+class TestFakeBackendRoutes:
+    """The detection pipeline runs end to end without Azure"""
+
+    @pytest.fixture(autouse=True)
+    def isolated_dirs(self, tmp_path, monkeypatch):
+        self.uploads = tmp_path / "uploads"
+        processed = tmp_path / "processed"
+        self.uploads.mkdir()
+        processed.mkdir()
+        monkeypatch.setattr(detection_module, "UPLOAD_DIR", self.uploads)
+        monkeypatch.setattr(detection_module, "PROCESSED_DIR", processed)
+        self.cache = DetectionCache(tmp_path / "cache")
+        monkeypatch.setattr(detection_cache, "_cache", self.cache)
+        monkeypatch.setattr(image_index, "_index",
+                            ImageIndex(tmp_path / "index.db"))
+        monkeypatch.setattr(render_pool, "_pool", RenderPool(mode="thread"))
+        monkeypatch.setattr(detectors, "_detector", FakeDetector(boxes=2))
+
+    def test_detection_with_fake_backend(self):
+        """Boxes from the fake backend are cached under its own key"""
+        image = make_scene()
+        (self.uploads / "scene.png").write_bytes(image)
+
+        response = client.get("/api/detections/scene.png")
+        assert response.status_code == 200
+
+        image_hash = self.cache.hash_image(image)
+        assert len(asyncio.run(
+            self.cache.get_boxes(f"{image_hash}-fake"))) == 2
+        assert asyncio.run(self.cache.get_boxes(image_hash)) is None
+
+        stats = client.get("/api/health/stats").json()["detector"]
+        assert stats["backend"] == "fake"
+        assert stats["calls"] == 1
@@ -0,0 +1,152 @@
+import hashlib
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import app.routes.detection as detection_module
+from app.main import app
+from app.utils import detection_cache, image_index, render_pool
+from app.utils.detection_cache import DetectionCache
+from app.utils.http_caching import IMMUTABLE_CACHE_CONTROL, \
+    REVALIDATE_CACHE_CONTROL, CachedStaticFiles, etag_matches, stat_etag, \
+    strong_etag
+from app.utils.image_index import ImageIndex
+from app.utils.render_pool import RenderPool
+from tests.test_detection_cache import AZURE_RESPONSE, make_jpeg
+
+client = TestClient(app)
+
+
+class TestEtagHelpers:
+    """Test suite for ETag helpers"""
+
+    def test_strong_etag_is_content_hash(self):
+        """The ETag is a quoted prefix of the body's SHA-256"""
+        etag = strong_etag(b"body")
+        assert etag == f'"{hashlib.sha256(b"body").hexdigest()[:32]}"'
+        assert strong_etag(b"body") == etag
+        assert strong_etag(b"other") != etag
+
+    def test_if_none_match_parsing(self):
+        """Lists, weak validators and wildcards are honoured"""
+        assert etag_matches('"a", W/"b"', '"b"')
+        assert etag_matches("*", '"a"')
+        assert not etag_matches('"a"', '"b"')
+        assert not etag_matches(None, '"a"')
+
+
+class TestCachedStaticFiles:
+    """Static mounts send ETags and answer conditional requests"""
+
+    @pytest.fixture(autouse=True)
+    def static_client(self, tmp_path):
+        (tmp_path / "photo.jpg").write_bytes(b"image-bytes")
+        static_app = FastAPI()
+        static_app.mount("/files", CachedStaticFiles(directory=str(tmp_path)))
+        self.client = TestClient(static_app)
+        self.etag = stat_etag(os.stat(tmp_path / "photo.jpg"))
+
+    def test_etag_and_not_modified(self):
+        """A matching If-None-Match returns 304 with no body"""
+        response = self.client.get("/files/photo.jpg")
+        assert response.status_code == 200
+        assert response.headers["etag"] == self.etag
+        assert response.headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+
+        response = self.client.get("/files/photo.jpg",
+                                   headers={"If-None-Match": self.etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == self.etag
+
+    def test_etag_follows_replacement_without_reading(self, tmp_path,
+                                                       monkeypatch):
+        """The ETag comes from file metadata and changes on replacement"""
+        import builtins
+        real_open = builtins.open
+
+        def no_reads(path, *args, **kwargs):
+            raise AssertionError("file content was read for the ETag")
+
+        monkeypatch.setattr(builtins, "open", no_reads)
+        response = self.client.get("/files/photo.jpg",
+                                   headers={"If-None-Match": self.etag})
+        assert response.status_code == 304
+        monkeypatch.setattr(builtins, "open", real_open)
+
+        replacement = tmp_path / ".photo.jpg.part"
+        replacement.write_bytes(b"image-bytez")
+        os.replace(replacement, tmp_path / "photo.jpg")
+        response = self.client.get("/files/photo.jpg",
+                                   headers={"If-None-Match": self.etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != self.etag
+
+    def test_versioned_url_is_immutable(self):
+        """Only a URL carrying the current content version is immutable"""
+        version = self.etag.strip('"')[:16]
+        response = self.client.get(f"/files/photo.jpg?v={version}")
+        assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+
+        response = self.client.get("/files/photo.jpg?v=stale")
+        assert response.headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+
+
+class TestDetectionImageConditionalGet:
+    """The rendered-image endpoint revalidates without re-rendering"""
+
+    def setup_method(self):
+        self.azure_calls = 0
+
+    @pytest.fixture(autouse=True)
+    def isolated_dirs(self, tmp_path, monkeypatch):
+        uploads = tmp_path / "uploads"
+        processed = tmp_path / "processed"
+        uploads.mkdir()
+        processed.mkdir()
+        monkeypatch.setattr(detection_module, "UPLOAD_DIR", uploads)
+        monkeypatch.setattr(detection_module, "PROCESSED_DIR", processed)
+        monkeypatch.setattr(detection_cache, "_cache",
+                            DetectionCache(tmp_path / "cache"))
+        monkeypatch.setattr(image_index, "_index",
+                            ImageIndex(tmp_path / "index.db"))
+        monkeypatch.setattr(render_pool, "_pool", RenderPool(mode="thread"))
+
+        async def fake_azure(image_data):
+            self.azure_calls += 1
+            return AZURE_RESPONSE
+
+        monkeypatch.setattr(detection_module, "run_detector", fake_azure)
+        (uploads / "photo.jpg").write_bytes(make_jpeg())
+
+    def test_not_modified_skips_rendering(self, monkeypatch):
+        """A matching ETag is answered with 304 before any rendering"""
+        response = client.get("/api/detections/photo.jpg/image")
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        assert etag == strong_etag(response.content)
+        assert response.headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+        assert "last-modified" in response.headers
+
+        def fail_render(*args):
+            raise AssertionError("rendered again")
+
+        monkeypatch.setattr(detection_module, "render_detections", fail_render)
+        response = client.get("/api/detections/photo.jpg/image",
+                              headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+        assert self.azure_calls == 1
+
+    def test_detection_url_is_versioned(self):
+        """The processed image URL carries the stored file's version"""
+        url = client.get("/api/detections/photo.jpg").json()[
+            "processed_image_url"]
+        path, version = url.split("?v=")
+        assert path == "/api/processed_uploads/processed_photo.jpg"
+
+        processed = detection_module.PROCESSED_DIR / "processed_photo.jpg"
+        assert stat_etag(os.stat(processed)).strip('"').startswith(version)
@@ -0,0 +1,51 @@
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.utils import http_client
+
+client = TestClient(app)
+
+
+class TestSharedHTTPClient:
+    """Test suite for the shared pooled HTTP client"""
+
+    def teardown_method(self):
+        """Drop the shared client so each test starts clean"""
+        http_client._client = None
+
+    def test_settings_from_environment(self, monkeypatch):
+        """Pool limits and timeouts are read from environment variables"""
+        monkeypatch.setenv("HTTP_CLIENT_MAX_CONNECTIONS", "7")
+        monkeypatch.setenv("HTTP_CLIENT_READ_TIMEOUT", "12.5")
+        monkeypatch.setenv("HTTP_CLIENT_HTTP2", "false")
+
+        settings = http_client.get_client_settings()
+        assert settings["max_connections"] == 7
+        assert settings["read_timeout"] == 12.5
+        assert settings["http2"] is False
+
+    def test_get_http_client_is_shared(self):
+        """Every caller receives the same client instance"""
+        first = http_client.get_http_client()
+        second = http_client.get_http_client()
+        assert first is second
+        assert not first.is_closed
+
+    def test_lifespan_starts_and_closes_client(self):
+        """The client lives exactly as long as the application"""
+        with TestClient(app):
+            shared = http_client.get_http_client()
+            assert http_client.get_pool_stats()["started"] is True
+        assert shared.is_closed
+        assert http_client.get_pool_stats()["started"] is False
+
+    def test_stats_endpoint(self):
+        """Pool usage is exposed through the health stats endpoint"""
+        http_client.get_http_client()
+        response = client.get("/api/health/stats")
+        assert response.status_code == 200
+
+        stats = response.json()["http_client"]
+        assert stats["started"] is True
+        assert stats["connections"] == 0
+        assert "requests_total" in stats
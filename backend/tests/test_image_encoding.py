@@ -0,0 +1,125 @@
+import io
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import app.routes.detection as detection_module
+from app.main import app
+from app.utils import detection_cache, image_encoding, image_index, \
+    render_pool
+from app.utils.detection_cache import DetectionCache
+from app.utils.image_encoding import encode_image, enabled_formats, \
+    negotiate_format, prepare_for_encoding
+from app.utils.image_index import ImageIndex
+from app.utils.render_pool import RenderPool
+from tests.test_detection_cache import AZURE_RESPONSE, make_jpeg
+
+client = TestClient(app)
+
+CHROME_ACCEPT = "image/avif,image/webp,image/apng,image/*,*/*;q=0.8"
+
+
+class TestNegotiation:
+    """Test suite for Accept-based format selection"""
+
+    def test_prefers_enabled_modern_formats(self):
+        """WebP is chosen when accepted; wildcards fall back to JPEG"""
+        assert negotiate_format(CHROME_ACCEPT, ["webp", "jpeg"]) == "webp"
+        assert negotiate_format(CHROME_ACCEPT,
+                                ["avif", "webp", "jpeg"]) == "avif"
+        assert negotiate_format("*/*", ["webp", "jpeg"]) == "jpeg"
+        assert negotiate_format("image/*", ["webp", "jpeg"]) == "jpeg"
+        assert negotiate_format(None, ["webp", "jpeg"]) == "jpeg"
+
+    def test_q_values_are_respected(self):
+        """The client's highest q-value wins over server preference"""
+        accept = "image/webp;q=0.5,image/jpeg"
+        assert negotiate_format(accept, ["webp", "jpeg"]) == "jpeg"
+        assert negotiate_format("image/webp;q=0", ["webp", "jpeg"]) == "jpeg"
+
+    def test_enabled_formats_from_environment(self, monkeypatch):
+        """OUTPUT_FORMATS selects formats; JPEG is always available"""
+        monkeypatch.setenv("OUTPUT_FORMATS", "avif, webp, bmp")
+        assert enabled_formats()[-1] == "jpeg"
+        assert "bmp" not in enabled_formats()
+
+
+class TestEncoding:
+    """Test suite for encoder settings and alpha handling"""
+
+    def test_transparency_flattened_for_jpeg(self):
+        """Transparent pixels become white, not black, in JPEG output"""
+        image = Image.new("RGBA", (8, 8), (0, 0, 0, 0))
+        flattened = prepare_for_encoding(image, "jpeg")
+        assert flattened.mode == "RGB"
+        assert flattened.getpixel((0, 0)) == (255, 255, 255)
+        assert prepare_for_encoding(image, "webp").mode == "RGBA"
+
+    def test_encoder_settings(self, monkeypatch):
+        """Quality and progressive flags come from the encoder options"""
+        image = Image.effect_noise((64, 64), 60).convert("RGB")
+        small = encode_image(image, "jpeg")
+        monkeypatch.setitem(image_encoding.ENCODER_OPTIONS, "jpeg",
+                            {"quality": 95, "progressive": True})
+        large = encode_image(image, "jpeg")
+        assert len(large) > len(small)
+        assert Image.open(io.BytesIO(large)).info.get("progressive")
+
+    def test_webp_is_smaller_than_jpeg(self):
+        """WebP output is smaller at the default settings"""
+        image = Image.effect_noise((128, 128), 30).convert("RGB")
+        assert len(encode_image(image, "webp")) < \
+            len(encode_image(image, "jpeg"))
+
+
+class TestNegotiatedImages:
+    """The processed image endpoint serves negotiated formats"""
+
+    @pytest.fixture(autouse=True)
+    def isolated_dirs(self, tmp_path, monkeypatch):
+        self.uploads = tmp_path / "uploads"
+        processed = tmp_path / "processed"
+        self.uploads.mkdir()
+        processed.mkdir()
+        monkeypatch.setattr(detection_module, "UPLOAD_DIR", self.uploads)
+        monkeypatch.setattr(detection_module, "PROCESSED_DIR", processed)
+        monkeypatch.setattr(detection_cache, "_cache",
+                            DetectionCache(tmp_path / "cache"))
+        monkeypatch.setattr(image_index, "_index",
+                            ImageIndex(tmp_path / "index.db"))
+        monkeypatch.setattr(render_pool, "_pool", RenderPool(mode="thread"))
+        monkeypatch.setenv("OUTPUT_FORMATS", "webp,jpeg")
+        self.azure_calls = 0
+
+        async def fake_azure(image_data):
+            self.azure_calls += 1
+            return AZURE_RESPONSE
+
+        monkeypatch.setattr(detection_module, "run_detector", fake_azure)
+
+    def test_webp_variant_is_cached(self):
+        """WebP is served to clients that accept it and rendered once"""
+        (self.uploads / "photo.jpg").write_bytes(make_jpeg())
+        url = "/api/detections/photo.jpg/image"
+
+        jpeg = client.get(url, headers={"Accept": "*/*"})
+        assert jpeg.headers["content-type"] == "image/jpeg"
+        assert "Accept" in jpeg.headers["vary"]
+
+        webp = client.get(url, headers={"Accept": CHROME_ACCEPT})
+        assert webp.headers["content-type"] == "image/webp"
+        assert "Accept" in webp.headers["vary"]
+        assert "processed_photo.webp" in webp.headers["content-disposition"]
+        assert Image.open(io.BytesIO(webp.content)).format == "WEBP"
+        assert webp.headers["etag"] != jpeg.headers["etag"]
+
+        misses = detection_cache._cache.stats()["render_misses"]
+        again = client.get(url, headers={"Accept": CHROME_ACCEPT})
+        assert again.content == webp.content
+        assert detection_cache._cache.stats()["render_misses"] == misses
+        assert self.azure_calls == 1
+
+        not_modified = client.get(url, headers={
+            "Accept": CHROME_ACCEPT, "If-None-Match": webp.headers["etag"]})
+        assert not_modified.status_code == 304
@@ -0,0 +1,296 @@
+import io
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import app.routes.detection as detection_module
+import app.routes.images as images_module
+import app.routes.upload as upload_module
+from app.main import app
+from app.utils import image_index
+from app.utils.image_index import DetectionRecord, ImageIndex, ImageRecord
+from app.utils.storage import get_storage
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def index(tmp_path):
+    idx = ImageIndex(tmp_path / "index.db")
+    yield idx
+    idx.close()
+
+
+class TestImageIndex:
+    """Test suite for the SQLite image index"""
+
+    def test_resolve_id_variants(self, index):
+        """Exact IDs, stems and processed_ prefixes resolve to one image"""
+        index.add(ImageRecord(id="abc.jpg", original_path="uploads/abc.jpg"))
+
+        for image_id in ("abc.jpg", "abc", "processed_abc.jpg",
+                         "processed_abc"):
+            assert index.resolve(image_id).id == "abc.jpg"
+        assert index.resolve("ab") is None
+        assert index.resolve("bc.jpg") is None
+
+    def test_released_images_do_not_resolve(self, index):
+        """An image being purged is not found by ID or stem"""
+        index.add(ImageRecord(id="abc.jpg", original_path="uploads/abc.jpg"))
+        index.tombstone("abc.jpg")
+        for image_id in ("abc.jpg", "abc", "processed_abc"):
+            assert index.resolve(image_id) is None
+        assert index.get("abc.jpg").refs == 0
+
+    def test_add_if_absent_keeps_released_images(self, index):
+        """Registering a file again does not revive an image being purged"""
+        index.add(ImageRecord(id="abc.jpg", original_path="uploads/abc.jpg"))
+        index.tombstone("abc.jpg")
+        record = ImageRecord(id="abc.jpg", original_path="uploads/abc.jpg")
+        assert index.add_if_absent(record) is None
+        assert index.get("abc.jpg").refs == 0
+        assert index.add_if_absent(ImageRecord(id="new.jpg")) is not None
+        assert index.get("new.jpg") is not None
+
+    def test_reconcile_with_disk(self, index, tmp_path):
+        """Reconciliation adds, links and removes records to match disk"""
+        uploads = tmp_path / "uploads"
+        processed = tmp_path / "processed"
+        uploads.mkdir()
+        processed.mkdir()
+        (uploads / "a.jpg").write_bytes(b"a")
+        (uploads / "b.png").write_bytes(b"bb")
+        (processed / "processed_a.jpg").write_bytes(b"pa")
+        index.add(ImageRecord(id="gone.jpg", original_path="x/gone.jpg",
+                              uploaded_at=1000.0))
+
+        stats = index.reconcile(uploads, processed)
+        assert stats == {"added": 2, "updated": 1, "removed": 1}
+
+        record = index.get("a.jpg")
+        assert record.processed_path == str(processed / "processed_a.jpg")
+        assert record.size == 1
+        assert index.get("b.png").content_type == "image/png"
+        assert index.get("gone.jpg") is None
+
+        (processed / "processed_a.jpg").unlink()
+        index.reconcile(uploads, processed)
+        assert index.get("a.jpg").processed_path is None
+
+    def test_reconcile_checks_storage_outside_the_lock(self, index,
+                                                       tmp_path,
+                                                       monkeypatch):
+        """Storage checks let other writers in, and records changed while
+        they ran are left alone"""
+        uploads = tmp_path / "uploads"
+        processed = tmp_path / "processed"
+        uploads.mkdir()
+        processed.mkdir()
+        for name in ("a.jpg", "b.jpg", "c.jpg"):
+            index.add(ImageRecord(id=name, original_path=f"x/{name}",
+                                  uploaded_at=1000.0))
+        storage = get_storage()
+        checked = []
+
+        def exists(key):
+            checked.append(key)
+            # Another thread re-points b.jpg while its file is checked
+            writer = threading.Thread(target=index.update, args=(
+                "b.jpg",), kwargs={"original_path": "y/b.jpg"})
+            writer.start()
+            writer.join(timeout=1)
+            assert not writer.is_alive()
+            return False
+
+        monkeypatch.setattr(storage, "exists", exists)
+        stats = index.reconcile(uploads, processed, storage, batch_size=2)
+        assert checked == ["x/a.jpg", "x/b.jpg", "x/c.jpg"]
+        assert stats["removed"] == 2
+        assert index.get("b.jpg").original_path == "y/b.jpg"
+
+    def test_reconcile_keeps_uploads_still_being_stored(self, index,
+                                                        tmp_path):
+        """A registered upload whose original is not in place yet keeps
+        its record"""
+        uploads = tmp_path / "uploads"
+        processed = tmp_path / "processed"
+        uploads.mkdir()
+        processed.mkdir()
+        record, _ = index.register_upload(ImageRecord(
+            id="abc.jpg", original_path=str(uploads / "abc.jpg"),
+            hash="abc"))
+
+        assert index.reconcile(uploads, processed)["removed"] == 0
+        assert index.get("abc.jpg") is not None
+        assert index.reconcile(uploads, processed,
+                               grace_seconds=0)["removed"] == 1
+
+    def test_processed_counter_is_maintained(self, index):
+        """The processed-image total tracks inserts, updates and deletes"""
+        index.add(ImageRecord(id="a.jpg", processed_path="p/a.jpg"))
+        index.add(ImageRecord(id="b.jpg", original_path="u/b.jpg"))
+        assert index.count_processed() == 1
+
+        index.set_processed("b.jpg", "p/b.jpg")
+        index.add(ImageRecord(id="a.jpg", processed_path="p/a2.jpg"))
+        assert index.count_processed() == 2
+
+        index.update("a.jpg", processed_path=None)
+        index.delete("b.jpg")
+        assert index.count_processed() == 0
+
+    def test_keyset_listing_uses_index(self, index):
+        """Cursor pages seek through the ordering index"""
+        for i in range(5):
+            index.add(ImageRecord(id=f"{i}.jpg", processed_path=f"p/{i}.jpg",
+                                  uploaded_at=1000.0 + i))
+
+        first = index.list_processed(2)
+        assert [r.id for r in first] == ["4.jpg", "3.jpg"]
+        after = (first[-1].uploaded_at, first[-1].id)
+        assert [r.id for r in index.list_processed(2, after=after)] == \
+            ["2.jpg", "1.jpg"]
+
+        plan = index._conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM images "
+            "WHERE processed_path IS NOT NULL AND (uploaded_at, id) < (?, ?) "
+            "ORDER BY uploaded_at DESC, id DESC LIMIT 2", after).fetchall()
+        assert "idx_images_processed_order" in " ".join(
+            str(row[-1]) for row in plan)
+
+    def test_register_upload_counts_references(self, index):
+        """Uploads with known content add references to the stored image"""
+        record, duplicate = index.register_upload(ImageRecord(
+            id="h.jpg", original_path="uploads/h.jpg", hash="h"))
+        assert not duplicate
+        record, duplicate = index.register_upload(ImageRecord(
+            id="h.png", original_path="uploads/h.png", hash="h"))
+        assert duplicate and record.id == "h.jpg" and record.refs == 2
+        assert index.get("h.png") is None
+
+        assert index.release("h.jpg") == 1
+        assert index.release("h.jpg") == 0
+        assert index.release("missing.jpg") == 0
+
+    def test_released_image_is_not_revived(self, index):
+        """Uploads never resolve to an image whose purge is pending"""
+        index.register_upload(ImageRecord(
+            id="h.jpg", original_path="uploads/h.jpg", hash="h"))
+        assert index.release("h.jpg") == 0
+
+        record, duplicate = index.register_upload(ImageRecord(
+            id="h.jpg", original_path="uploads/h.jpg", hash="h"))
+        assert not duplicate
+        assert record.id.startswith("h-") and record.id.endswith(".jpg")
+        assert record.original_path == f"uploads/{record.id}"
+        assert index.get("h.jpg").refs == 0
+
+        assert index.tombstone(record.id).refs == 0
+        assert index.delete_released(record.id)
+        assert index.delete_released("h.jpg")
+        assert index.count() == 0
+
+    def test_detections_round_trip_and_cascade(self, index):
+        """Detections are stored compactly and removed with their image"""
+        index.add(ImageRecord(id="abc.jpg", original_path="uploads/abc.jpg"))
+        index.set_detections(DetectionRecord(
+            image_id="abc.jpg", detector_key="azure:h", width=64, height=48,
+            boxes=[{"label": "cat", "score": 0.91234, "x": 1.04, "y": 2.0,
+                    "w": 10.0, "h": 12.0}]))
+
+        detection = index.get_detections("abc.jpg")
+        assert detection.detector_key == "azure:h"
+        assert (detection.width, detection.height) == (64, 48)
+        assert detection.boxes == [{"label": "cat", "score": 0.9123,
+                                    "x": 1.0, "y": 2.0, "w": 10.0,
+                                    "h": 12.0}]
+
+        index.delete("abc.jpg")
+        assert index.get_detections("abc.jpg") is None
+
+
+class TestIndexedRoutes:
+    """Routes keep the index up to date"""
+
+    @pytest.fixture(autouse=True)
+    def isolated_storage(self, tmp_path, monkeypatch, index):
+        self.uploads = tmp_path / "uploads"
+        self.processed = tmp_path / "processed"
+        self.uploads.mkdir()
+        self.processed.mkdir()
+        monkeypatch.setattr(upload_module, "UPLOAD_DIR", self.uploads)
+        monkeypatch.setattr(detection_module, "UPLOAD_DIR", self.uploads)
+        monkeypatch.setattr(images_module, "UPLOADS_DIR", self.processed)
+        monkeypatch.setattr(images_module, "ORIGINAL_UPLOADS_DIR",
+                            self.uploads)
+        monkeypatch.setattr(image_index, "_index", index)
+        self.index = index
+
+    def test_upload_registers_and_delete_removes(self):
+        """Uploads are indexed and deletion removes the record and file"""
+        buffer = io.BytesIO()
+        Image.new("RGB", (8, 8), "blue").save(buffer, format="PNG")
+        response = client.post(
+            "/api/upload",
+            files={"files[]": ("photo.png", buffer.getvalue(), "image/png")},
+        )
+        assert response.status_code == 200
+        saved = response.json()["files"][0]["saved_filename"]
+
+        record = self.index.get(saved)
+        assert record.content_type == "image/png"
+        assert len(record.hash) == 64
+
+        # A second upload of the same content shares the image
+        response = client.post(
+            "/api/upload",
+            files={"files[]": ("copy.png", buffer.getvalue(), "image/png")},
+        )
+        assert response.json()["files"][0]["saved_filename"] == saved
+        response = client.delete(f"/api/images/{saved}")
+        assert response.json()["references_remaining"] == 1
+        assert (self.uploads / saved).exists()
+
+        response = client.delete(f"/api/images/{saved}")
+        assert response.status_code == 200
+        assert response.json()["original_deleted"] is True
+        assert self.index.get(saved) is None
+        assert not (self.uploads / saved).exists()
+
+    def test_delete_does_not_match_substrings(self):
+        """An ID that is only a substring of a filename is not deleted"""
+        (self.uploads / "abc123.jpg").write_bytes(b"x")
+        self.index.reconcile(self.uploads, self.processed)
+
+        response = client.delete("/api/images/abc")
+        assert response.status_code == 404
+        assert (self.uploads / "abc123.jpg").exists()
+
+    def test_cursor_pagination(self):
+        """Following next_cursor walks every processed image once"""
+        for i in range(5):
+            self.index.add(ImageRecord(
+                id=f"img{i}.jpg",
+                processed_path=str(self.processed / f"processed_img{i}.jpg"),
+                uploaded_at=1000.0 + i))
+
+        seen = []
+        response = client.get("/api/images?page_size=2").json()
+        while True:
+            assert response["total"] == 5
+            seen.extend(item["filename"] for item in response["items"])
+            if not response["next_cursor"]:
+                break
+            response = client.get(
+                f"/api/images?page_size=2&after={response['next_cursor']}"
+            ).json()
+
+        assert seen == [f"processed_img{i}.jpg" for i in range(4, -1, -1)]
+        assert client.get("/api/images?after=%25%25").status_code == 400
+
+    def test_detection_unknown_image(self):
+        """Detection on an unknown ID returns 404"""
+        response = client.get("/api/detections/missing.jpg")
+        assert response.status_code == 404
@@ -0,0 +1,108 @@
+import asyncio
+import io
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import app.routes.detection as detection_module
+from app.main import app
+from app.utils import detection_cache, image_index, render_pool
+from app.utils.detection_cache import DetectionCache
+from app.utils.image_index import ImageIndex
+from app.utils.image_preprocessing import prepare_for_detection
+from app.utils.render_pool import RenderPool
+
+client = TestClient(app)
+
+
+def make_image(size, format="JPEG", mode="RGB"):
+    """Create an in-memory image of the given size"""
+    buffer = io.BytesIO()
+    Image.new(mode, size, "blue").save(buffer, format=format)
+    return buffer.getvalue()
+
+
+class TestPrepareForDetection:
+    """Test suite for downscaling images before detection"""
+
+    def test_small_image_is_sent_unchanged(self):
+        """Images within the limit are passed through as-is"""
+        data = make_image((200, 100))
+        prepared = prepare_for_detection(data, max_dimension=1024)
+        assert prepared.data is data
+        assert not prepared.resized
+
+    def test_large_jpeg_is_downscaled(self):
+        """The longest side is reduced and scale factors are recorded"""
+        data = make_image((4000, 3000))
+        prepared = prepare_for_detection(data, max_dimension=1000)
+        image = Image.open(io.BytesIO(prepared.data))
+        assert image.format == "JPEG"
+        assert image.size == (1000, 750)
+        assert prepared.scale_x == pytest.approx(4.0)
+        assert prepared.scale_y == pytest.approx(4.0)
+
+    def test_png_with_alpha_is_reencoded_as_jpeg(self):
+        """Non-JPEG uploads are converted to a compact JPEG"""
+        data = make_image((2000, 500), format="PNG", mode="RGBA")
+        prepared = prepare_for_detection(data, max_dimension=1000)
+        image = Image.open(io.BytesIO(prepared.data))
+        assert (image.format, image.mode, image.size) == \
+            ("JPEG", "RGB", (1000, 250))
+
+    def test_short_side_stays_above_azure_minimum(self):
+        """Very long images are not reduced below 50 pixels"""
+        data = make_image((5000, 100))
+        prepared = prepare_for_detection(data, max_dimension=1000)
+        assert Image.open(io.BytesIO(prepared.data)).size == (2500, 50)
+
+    def test_disabled_or_undecodable(self):
+        """A zero limit or unreadable bytes send the original"""
+        data = make_image((3000, 3000))
+        assert prepare_for_detection(data, max_dimension=0).data is data
+        assert prepare_for_detection(b"not an image",
+                                     max_dimension=10).data == b"not an image"
+
+
+class TestDetectionDownscaling:
+    """Azure receives the downscaled image; boxes use original coordinates"""
+
+    @pytest.fixture(autouse=True)
+    def isolated_dirs(self, tmp_path, monkeypatch):
+        uploads = tmp_path / "uploads"
+        processed = tmp_path / "processed"
+        uploads.mkdir()
+        processed.mkdir()
+        monkeypatch.setattr(detection_module, "UPLOAD_DIR", uploads)
+        monkeypatch.setattr(detection_module, "PROCESSED_DIR", processed)
+        self.cache = DetectionCache(tmp_path / "cache")
+        monkeypatch.setattr(detection_cache, "_cache", self.cache)
+        monkeypatch.setattr(image_index, "_index",
+                            ImageIndex(tmp_path / "index.db"))
+        monkeypatch.setattr(render_pool, "_pool", RenderPool(mode="thread"))
+        self.uploads = uploads
+        self.sent_sizes = []
+
+        async def fake_azure(image_data):
+            self.sent_sizes.append(Image.open(io.BytesIO(image_data)).size)
+            return {"objects": [{"rectangle": {"x": 10, "y": 20, "w": 30,
+                                               "h": 40},
+                                 "object": "cat", "confidence": 0.9}]}
+
+        monkeypatch.setattr(detection_module, "run_detector", fake_azure)
+
+    def test_boxes_are_rescaled_to_original(self):
+        """Rectangles from the downscaled copy are mapped back"""
+        data = make_image((2048, 1024))
+        (self.uploads / "big.jpg").write_bytes(data)
+
+        assert client.get("/api/detections/big.jpg").status_code == 200
+        assert self.sent_sizes == [(1024, 512)]
+
+        boxes = asyncio.run(
+            self.cache.get_boxes(self.cache.hash_image(data)))
+        assert boxes[0]["x"] == pytest.approx(20)
+        assert boxes[0]["y"] == pytest.approx(40)
+        assert boxes[0]["w"] == pytest.approx(60)
+        assert boxes[0]["h"] == pytest.approx(80)
@@ -0,0 +1,76 @@
+import io
+
+from PIL import Image, ImageDraw
+
+from app.routes.detection import BoundingBox, draw_bounding_boxes_on_image
+from app.utils.image_processing import PALETTE, box_geometry, \
+    draw_bounding_boxes, draw_boxes
+
+
+def box(x, y, w, h, label="person", score=0.9):
+    return BoundingBox(label=label, x=x, y=y, w=w, h=h, score=score)
+
+
+def make_jpeg(size=(200, 150)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "black").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class TestBoxGeometry:
+    """Test suite for the batch geometry pass"""
+
+    def test_outline_matches_imagedraw(self):
+        """Outline strips cover the same pixels as ImageDraw.rectangle"""
+        expected = Image.new("L", (100, 100))
+        ImageDraw.Draw(expected).rectangle([10, 20, 60, 70], outline=255,
+                                           width=3)
+        actual = Image.new("L", (100, 100))
+        for rect in box_geometry([box(10, 20, 50, 50)], 100, 100)[0].outline:
+            actual.paste(255, rect)
+        assert actual.tobytes() == expected.tobytes()
+
+    def test_boxes_are_clipped_to_the_image(self):
+        """Boxes partly or fully outside the image are clipped or dropped"""
+        partial, outside, empty = box_geometry(
+            [box(-20, 80, 50, 50), box(300, 300, 10, 10), box(5, 5, -3, 4)],
+            100, 100)
+        for rect in partial.outline:
+            assert 0 <= rect[0] < rect[2] <= 100
+            assert 0 <= rect[1] < rect[3] <= 100
+        assert outside.outline == [] and outside.fill is None
+        assert empty.outline == [] and empty.fill is None
+
+    def test_colors_cycle_through_palette(self):
+        """Every box gets the next palette color"""
+        boxes = [box(0, 0, 5, 5) for _ in range(len(PALETTE) + 1)]
+        colors = [g.color for g in box_geometry(boxes, 10, 10)]
+        assert colors[:len(PALETTE)] == list(PALETTE)
+        assert colors[-1] == PALETTE[0]
+
+
+class TestDrawBoxes:
+    """Test suite for painting boxes onto images"""
+
+    def test_outline_only_by_default(self):
+        """Without a fill the inside of the box is untouched"""
+        image = Image.new("RGB", (100, 100), "black")
+        draw_boxes(image, [box(10, 40, 50, 50)], fill_alpha=0)
+        assert image.getpixel((11, 41)) == (255, 0, 0)
+        assert image.getpixel((35, 65)) == (0, 0, 0)
+
+    def test_alpha_fill_is_blended(self):
+        """A translucent fill mixes the box color with the image"""
+        image = Image.new("RGB", (100, 100), (0, 0, 200))
+        draw_boxes(image, [box(10, 40, 50, 50)], fill_alpha=0.5)
+        red, green, blue = image.getpixel((35, 65))
+        assert 120 <= red <= 135
+        assert green == 0
+        assert 95 <= blue <= 105
+
+    def test_every_renderer_produces_the_same_image(self):
+        """Routes and the utility API share one engine"""
+        image_data = make_jpeg()
+        boxes = [box(10, 30, 80, 60), box(100, 5, 50, 40, label="dog")]
+        assert draw_bounding_boxes(image_data, boxes) == \
+            draw_bounding_boxes_on_image(image_data, boxes)
@@ -25,6 +25,12 @@ class TestImagesAPI:
         self.original_original_uploads_dir = images_module.ORIGINAL_UPLOADS_DIR
         images_module.UPLOADS_DIR = self.test_uploads_dir
         images_module.ORIGINAL_UPLOADS_DIR = self.test_original_uploads_dir
+
+        # Use a throwaway image index
+        import app.utils.image_index as index_module
+        self.original_index = index_module._index
+        self.test_index_path = Path("test_image_index.db")
+        index_module._index = index_module.ImageIndex(self.test_index_path)
     
     def teardown_method(self):
         """Clean up after each test"""
@@ -32,6 +38,12 @@ class TestImagesAPI:
         import app.routes.images as images_module
         images_module.UPLOADS_DIR = self.original_uploads_dir
         images_module.ORIGINAL_UPLOADS_DIR = self.original_original_uploads_dir
+
+        import app.utils.image_index as index_module
+        index_module._index.close()
+        index_module._index = self.original_index
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{self.test_index_path}{suffix}").unlink(missing_ok=True)
         
         # Clean up test files
         import shutil
@@ -49,6 +61,11 @@ class TestImagesAPI:
         with open(test_file, "wb") as f:
             # Create a minimal fake image file
             f.write(b"fake image content")
+
+        # Register the file the same way startup reconciliation does
+        import app.utils.image_index as index_module
+        index_module._index.reconcile(self.test_original_uploads_dir,
+                                      self.test_uploads_dir)
         return test_file
     
     def test_list_images_empty(self):
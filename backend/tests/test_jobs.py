@@ -0,0 +1,194 @@
+import asyncio
+import io
+import sqlite3
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import app.routes.detection as detection_module
+from app.main import app
+from app.utils import detection_cache, image_index, render_pool
+from app.utils.detection_cache import DetectionCache
+from app.utils.image_index import ImageIndex
+from app.utils.jobs import FAILED, SUCCEEDED, InMemoryJobBackend, Job, \
+    JobManager
+from app.utils.render_pool import RenderPool
+
+
+def test_job_manager_runs_and_records_failures():
+    """Jobs run in the background and failures are captured"""
+    manager = JobManager(InMemoryJobBackend(), workers=2)
+
+    async def double(job):
+        return {"value": job.payload["n"] * 2}
+
+    async def broken(job):
+        raise RuntimeError("boom")
+
+    manager.register("double", double)
+    manager.register("broken", broken)
+
+    async def scenario():
+        ok = await manager.submit("double", {"n": 21})
+        bad = await manager.submit("broken", {})
+        for _ in range(100):
+            if ok.finished_at and bad.finished_at:
+                break
+            await asyncio.sleep(0.01)
+        await manager.stop()
+        return ok, bad
+
+    ok, bad = asyncio.run(scenario())
+    assert ok.status == SUCCEEDED
+    assert ok.result == {"value": 42}
+    assert bad.status == FAILED
+    assert bad.status_code == 500
+
+
+def test_workers_survive_backend_errors():
+    """A backend error is logged and the worker keeps running jobs"""
+    class FlakyBackend(InMemoryJobBackend):
+        failures = 1
+
+        async def dequeue(self):
+            if self.failures:
+                self.failures -= 1
+                raise sqlite3.OperationalError("database is locked")
+            return await super().dequeue()
+
+    manager = JobManager(FlakyBackend(), workers=1, poll_interval=0.01)
+
+    async def double(job):
+        return {"value": job.payload["n"] * 2}
+
+    manager.register("double", double)
+
+    async def scenario():
+        job = await manager.submit("double", {"n": 4})
+        for _ in range(100):
+            if job.finished_at:
+                break
+            await asyncio.sleep(0.01)
+        running = all(not task.done() for task in manager._tasks)
+        await manager.stop()
+        return job, running
+
+    job, running = asyncio.run(scenario())
+    assert job.status == SUCCEEDED
+    assert job.result == {"value": 8}
+    assert running
+
+
+def test_finished_jobs_are_bounded():
+    """Finished jobs release their input and only the newest are kept"""
+    backend = InMemoryJobBackend(max_finished=2)
+
+    async def scenario():
+        jobs = []
+        for n in range(3):
+            job = Job(kind="detect", payload={}, data=b"image bytes")
+            await backend.enqueue(job)
+            await backend.dequeue()
+            job.status = SUCCEEDED
+            job.finished_at = time.time()
+            await backend.save(job)
+            jobs.append(job)
+        return jobs, [await backend.get(job.id) for job in jobs]
+
+    jobs, stored = asyncio.run(scenario())
+    assert all(job.data is None for job in jobs)
+    assert stored[0] is None
+    assert stored[1:] == jobs[1:]
+
+
+class TestDetectionJobs:
+    """Test suite for job-based detection endpoints"""
+
+    @pytest.fixture(autouse=True)
+    def isolated_storage(self, tmp_path, monkeypatch):
+        self.uploads = tmp_path / "uploads"
+        processed = tmp_path / "processed"
+        self.uploads.mkdir()
+        processed.mkdir()
+
+        async def fake_azure(image_data):
+            await asyncio.sleep(0.05)
+            return {"objects": []}
+
+        monkeypatch.setattr(detection_module, "UPLOAD_DIR", self.uploads)
+        monkeypatch.setattr(detection_module, "PROCESSED_DIR", processed)
+        monkeypatch.setattr(detection_module, "run_detector", fake_azure)
+        monkeypatch.setattr(detection_cache, "_cache",
+                            DetectionCache(tmp_path / "cache"))
+        monkeypatch.setattr(image_index, "_index",
+                            ImageIndex(tmp_path / "index.db"))
+        monkeypatch.setattr(render_pool, "_pool", RenderPool(mode="thread"))
+
+        buffer = io.BytesIO()
+        Image.new("RGB", (16, 16), "white").save(buffer, format="JPEG")
+        (self.uploads / "photo.jpg").write_bytes(buffer.getvalue())
+
+    def test_job_lifecycle_with_polling_and_events(self):
+        """A job is accepted immediately, then polled and streamed to done"""
+        with TestClient(app) as client:
+            response = client.post("/api/detections/photo.jpg/jobs")
+            assert response.status_code == 202
+            created = response.json()
+            assert created["status"] == "queued"
+
+            with client.stream("GET", created["events_url"]) as stream:
+                events = [line[len("event: "):]
+                          for line in stream.iter_lines()
+                          if line.startswith("event: ")]
+            assert events[-1] == "succeeded"
+
+            job = client.get(created["status_url"]).json()
+            assert job["status"] == "succeeded"
+            assert job["result"]["processed_image_url"].startswith(
+                "/api/processed_uploads/processed_photo.jpg?v=")
+
+    def test_unknown_image_and_job(self):
+        """Unknown images and jobs return 404"""
+        with TestClient(app) as client:
+            assert client.post(
+                "/api/detections/missing.jpg/jobs").status_code == 404
+            assert client.get("/api/jobs/nope").status_code == 404
+
+    def test_upload_with_detect_starts_job_from_memory(self, monkeypatch):
+        """detect=true queues detection fed with the uploaded bytes"""
+        import app.routes.upload as upload_module
+        monkeypatch.setattr(upload_module, "UPLOAD_DIR", self.uploads)
+
+        reads = []
+        real_open = open
+
+        def tracking_open(path, mode="r", *args, **kwargs):
+            if "r" in mode and str(path).startswith(str(self.uploads)):
+                reads.append(path)
+            return real_open(path, mode, *args, **kwargs)
+
+        monkeypatch.setattr("builtins.open", tracking_open)
+
+        buffer = io.BytesIO()
+        Image.new("RGB", (16, 16), "black").save(buffer, format="PNG")
+        with TestClient(app) as client:
+            response = client.post(
+                "/api/upload?detect=true",
+                files=[("files[]", ("a.png", buffer.getvalue(), "image/png")),
+                       ("files[]", ("notes.txt", b"hello", "text/plain"))],
+            )
+            assert response.status_code == 200
+            image_entry, text_entry = response.json()["files"]
+            assert "detection_job_id" not in text_entry
+
+            status_url = image_entry["detection_status_url"]
+            for _ in range(100):
+                job = client.get(status_url).json()
+                if job["status"] in ("succeeded", "failed"):
+                    break
+                time.sleep(0.02)
+
+        assert job["status"] == "succeeded"
+        assert reads == []
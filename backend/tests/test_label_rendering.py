@@ -0,0 +1,82 @@
+import io
+
+from PIL import Image
+
+from app.routes.detection import BoundingBox, render_detection_image
+from app.utils import label_rendering
+from app.utils.label_rendering import LabelRenderer, get_label_renderer, \
+    load_font
+
+
+def make_jpeg(size=(320, 240)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "gray").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class TestLabelRenderer:
+    """Test suite for cached label sprites"""
+
+    def test_sprites_are_cached_by_label_score_and_color(self):
+        """The same label is rasterized once"""
+        renderer = LabelRenderer(load_font(size=16))
+        first = renderer.sprite("person", 0.871, "#FF0000")
+        assert renderer.sprite("person", 0.874, "#FF0000") is first
+        assert renderer.sprite("person", 0.88, "#FF0000") is not first
+        assert renderer.sprite("person", 0.871, "#00FF00") is not first
+        assert renderer.stats() == {"sprites": 3, "hits": 1, "misses": 3}
+
+    def test_cache_is_bounded(self):
+        """Least recently used sprites are evicted"""
+        renderer = LabelRenderer(load_font(size=16), max_sprites=2)
+        for label in ("a", "b", "c"):
+            renderer.sprite(label, 0.5, "#FF0000")
+        assert renderer.stats()["sprites"] == 2
+
+    def test_sprite_has_background_and_text(self):
+        """Sprites are the label color with white text on top"""
+        sprite = LabelRenderer(load_font(size=16)).sprite(
+            "car", 0.5, "#0000FF")
+        colors = {color for _, color in sprite.getcolors(1 << 16)}
+        assert (0, 0, 255) in colors
+        assert (255, 255, 255) in colors
+
+    def test_label_goes_below_when_no_room_above(self):
+        """Labels for boxes at the top edge are placed under the box"""
+        renderer = LabelRenderer(load_font(size=16))
+        image = Image.new("RGB", (200, 200), "black")
+        renderer.draw_label(image, "dog", 0.9, "#00FF00", 10, 0, 50, gap=5)
+        assert image.getpixel((10, 55)) == (0, 255, 0)
+        assert image.getpixel((10, 40)) == (0, 0, 0)
+
+    def test_missing_font_falls_back(self):
+        """An unknown font path falls back to the built-in font"""
+        font = load_font("/no/such/font.ttf", 24)
+        assert font.getbbox("Ag")[3] > 0
+
+    def test_renderer_configured_from_environment(self, monkeypatch):
+        """Font size comes from LABEL_FONT_SIZE and is loaded once"""
+        monkeypatch.setattr(label_rendering, "_renderer", None)
+        monkeypatch.setenv("LABEL_FONT_SIZE", "30")
+        renderer = get_label_renderer()
+        assert renderer is get_label_renderer()
+        large = renderer.sprite("person", 0.5, "#FF0000")
+
+        monkeypatch.setattr(label_rendering, "_renderer", None)
+        monkeypatch.setenv("LABEL_FONT_SIZE", "12")
+        small = get_label_renderer().sprite("person", 0.5, "#FF0000")
+        assert large.height > small.height
+
+
+def test_render_with_many_boxes():
+    """Dozens of boxes render, reusing sprites for repeated labels"""
+    boxes = [BoundingBox(label=f"object{i % 4}", x=i * 5, y=20 + i * 3,
+                         w=40, h=30, score=0.75) for i in range(40)]
+    renderer = get_label_renderer()
+    hits = renderer.hits
+
+    data, timings = render_detection_image(make_jpeg(), boxes)
+    assert Image.open(io.BytesIO(data)).size == (320, 240)
+    assert set(timings) == {"decode", "draw", "encode"}
+    # 4 labels x 10 colors repeat every 20 boxes
+    assert renderer.hits - hits >= 20
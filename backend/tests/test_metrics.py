@@ -0,0 +1,132 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+import app.routes.detection as detection_module
+from app.main import app
+from app.utils import detection_cache, detectors, http_client, image_index, \
+    render_pool
+from app.utils.detection_cache import DetectionCache
+from app.utils.detectors import AzureDetector, FakeDetector
+from app.utils.image_index import ImageIndex
+from app.utils.metrics import EventLoopLagMonitor
+from app.utils.render_pool import RenderPool
+from app.utils.resilience import RetryPolicy
+from tests.test_detection_cache import make_jpeg
+
+client = TestClient(app)
+
+
+def sample(name, **labels):
+    """Current value of a metric sample (0 if not recorded yet)"""
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+class TestMetricsEndpoint:
+    """Test suite for GET /metrics and the request middleware"""
+
+    def test_exposition_format(self):
+        """Metrics are served in the Prometheus text format"""
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "http_requests_total" in response.text
+
+    def test_requests_are_labelled_by_route_template(self):
+        """Requests are grouped by route, not by concrete URL"""
+        route = "/api/jobs/{job_id}"
+        before = sample("http_requests_total", method="GET", route=route,
+                        status="404")
+        client.get("/api/jobs/one")
+        client.get("/api/jobs/two")
+
+        assert sample("http_requests_total", method="GET", route=route,
+                      status="404") == before + 2
+        assert sample("http_request_duration_seconds_count", method="GET",
+                      route=route) >= 2
+        assert sample("http_requests_in_flight", method="GET",
+                      route=route) == 0
+
+        client.get("/no/such/path")
+        assert sample("http_requests_total", method="GET",
+                      route="unmatched", status="404") >= 1
+
+
+class TestPipelineMetrics:
+    """Detection stages, Azure calls and caches are instrumented"""
+
+    @pytest.fixture(autouse=True)
+    def isolated_dirs(self, tmp_path, monkeypatch):
+        self.uploads = tmp_path / "uploads"
+        processed = tmp_path / "processed"
+        self.uploads.mkdir()
+        processed.mkdir()
+        monkeypatch.setattr(detection_module, "UPLOAD_DIR", self.uploads)
+        monkeypatch.setattr(detection_module, "PROCESSED_DIR", processed)
+        monkeypatch.setattr(detection_cache, "_cache",
+                            DetectionCache(tmp_path / "cache"))
+        monkeypatch.setattr(image_index, "_index",
+                            ImageIndex(tmp_path / "index.db"))
+        monkeypatch.setattr(render_pool, "_pool", RenderPool(mode="thread"))
+        monkeypatch.setattr(detectors, "_detector", FakeDetector())
+
+    def test_stage_histograms(self):
+        """Every stage of a detection is timed"""
+        stages = ("resolve", "read", "preprocess", "detect", "normalize",
+                  "render", "decode", "draw", "encode", "save")
+        before = {stage: sample("detection_stage_duration_seconds_count",
+                                stage=stage) for stage in stages}
+        (self.uploads / "photo.jpg").write_bytes(make_jpeg())
+
+        assert client.get("/api/detections/photo.jpg").status_code == 200
+        for stage in stages:
+            assert sample("detection_stage_duration_seconds_count",
+                          stage=stage) == before[stage] + 1, stage
+
+    def test_cache_lookups_exported(self):
+        """Cache hit/miss counters of the shared cache are exported"""
+        (self.uploads / "photo.jpg").write_bytes(make_jpeg())
+        (self.uploads / "copy.jpg").write_bytes(make_jpeg())
+        client.get("/api/detections/photo.jpg")
+        client.get("/api/detections/copy.jpg")
+
+        text = client.get("/metrics").text
+        assert 'detection_cache_lookups_total{item="boxes",result="hit"} ' \
+               '1.0' in text
+        assert 'detection_cache_lookups_total{item="boxes",result="miss"} ' \
+               '1.0' in text
+        assert "render_pool_pending 0.0" in text
+
+    def test_azure_status_codes(self, monkeypatch):
+        """Azure responses are counted by status code"""
+        monkeypatch.setenv("VISION_ENDPOINT", "https://vision.test")
+        monkeypatch.setenv("VISION_KEY", "secret")
+        before = sample("azure_requests_total", status="429")
+
+        async def detect():
+            monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(
+                transport=httpx.MockTransport(
+                    lambda request: httpx.Response(429))))
+            await AzureDetector(
+                retry_policy=RetryPolicy(max_retries=0)).detect(b"image")
+
+        with pytest.raises(Exception):
+            asyncio.run(detect())
+        assert sample("azure_requests_total", status="429") == before + 1
+
+
+def test_event_loop_lag_is_measured():
+    """A blocked event loop shows up as lag"""
+    before = sample("event_loop_lag_seconds_count")
+
+    async def run():
+        monitor = EventLoopLagMonitor(interval=0.01)
+        monitor.start()
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+
+    asyncio.run(run())
+    assert sample("event_loop_lag_seconds_count") > before
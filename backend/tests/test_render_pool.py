@@ -0,0 +1,65 @@
+import asyncio
+import io
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import app.routes.detection as detection_module
+from app.main import app
+from app.utils import detection_cache, image_index, render_pool
+from app.utils.detection_cache import DetectionCache
+from app.utils.image_index import ImageIndex
+from app.utils.render_pool import RenderPool, RenderPoolSaturated
+
+client = TestClient(app)
+
+
+def add(a, b):
+    return a + b
+
+
+class TestRenderPool:
+    """Test suite for the bounded render pool"""
+
+    @pytest.mark.parametrize("mode", ["thread", "process"])
+    def test_runs_jobs(self, mode):
+        """Jobs run in the configured executor"""
+        pool = RenderPool(mode=mode, workers=2, initializer=None)
+        try:
+            assert asyncio.run(pool.run(add, 2, 3)) == 5
+            assert pool.stats()["completed"] == 1
+        finally:
+            pool.shutdown()
+
+    def test_rejects_when_saturated(self):
+        """No more than max_pending jobs are accepted"""
+        pool = RenderPool(mode="thread", workers=1, max_pending=0,
+                          initializer=None)
+        with pytest.raises(RenderPoolSaturated):
+            asyncio.run(pool.run(add, 1, 1))
+        assert pool.stats()["rejected"] == 1
+
+    def test_detection_returns_429_when_saturated(self, tmp_path, monkeypatch):
+        """Detection answers 429 with Retry-After when rendering is full"""
+        uploads = tmp_path / "uploads"
+        uploads.mkdir()
+        buffer = io.BytesIO()
+        Image.new("RGB", (16, 16), "green").save(buffer, format="JPEG")
+        (uploads / "img.jpg").write_bytes(buffer.getvalue())
+
+        async def fake_azure(image_data):
+            return {"objects": []}
+
+        monkeypatch.setattr(detection_module, "UPLOAD_DIR", uploads)
+        monkeypatch.setattr(detection_module, "run_detector", fake_azure)
+        monkeypatch.setattr(detection_cache, "_cache",
+                            DetectionCache(tmp_path / "cache"))
+        monkeypatch.setattr(image_index, "_index",
+                            ImageIndex(tmp_path / "index.db"))
+        monkeypatch.setattr(render_pool, "_pool",
+                            RenderPool(mode="thread", max_pending=0))
+
+        response = client.get("/api/detections/img.jpg/image")
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "1"
@@ -0,0 +1,232 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app.utils import http_client, rate_limiter
+from app.utils.detectors import AzureDetector, create_azure_detector
+from app.utils.rate_limiter import TokenBucket
+from app.utils.resilience import CircuitBreaker, CircuitOpenError, \
+    RetryPolicy, hedged, parse_retry_after
+
+
+class TestRetryPolicy:
+    """Test suite for backoff delays"""
+
+    def test_backoff_is_jittered_and_capped(self):
+        """Delays stay within the exponential envelope and the cap"""
+        policy = RetryPolicy(base_delay=0.5, max_delay=2.0)
+        for attempt, ceiling in ((0, 0.5), (1, 1.0), (2, 2.0), (6, 2.0)):
+            delays = [policy.delay(attempt) for _ in range(50)]
+            assert all(0 <= delay <= ceiling for delay in delays)
+            assert len(set(delays)) > 1
+
+    def test_retry_after_takes_precedence(self):
+        """The server's Retry-After is used, up to the configured maximum"""
+        policy = RetryPolicy(max_retry_after=5.0)
+        assert policy.delay(0, retry_after=2.0) == 2.0
+        assert policy.delay(0, retry_after=60.0) == 5.0
+
+    def test_parse_retry_after(self):
+        """Both delay-seconds and HTTP-date forms are understood"""
+        assert parse_retry_after("3") == 3.0
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("soon") is None
+        in_ten = parse_retry_after(formatdate(time.time() + 10, usegmt=True))
+        assert 8 <= in_ten <= 10
+
+
+class TestCircuitBreaker:
+    """Test suite for the circuit breaker states"""
+
+    def test_opens_after_consecutive_failures(self):
+        """Calls are rejected once the failure threshold is reached"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.before_call()
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+        assert breaker.stats()["state"] == "open"
+        assert breaker.stats()["rejected"] == 1
+
+    def test_half_open_probe(self):
+        """After the timeout a single probe decides whether to close"""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        breaker.record_failure()
+        time.sleep(0.02)
+
+        breaker.before_call()
+        assert breaker.state == "half_open"
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+
+        breaker.record_failure()
+        assert breaker.state == "open"
+        time.sleep(0.02)
+        breaker.before_call()
+        breaker.record_success()
+        assert breaker.state == "closed"
+        breaker.before_call()
+
+
+class TestHedging:
+    """Test suite for hedged calls"""
+
+    def test_slow_call_is_hedged(self):
+        """A second call is started after the delay and the faster wins"""
+        calls = []
+
+        async def call():
+            calls.append(time.monotonic())
+            await asyncio.sleep(1.0 if len(calls) == 1 else 0.01)
+            return len(calls)
+
+        started = time.monotonic()
+        assert asyncio.run(hedged(call, 0.02)) == 2
+        assert time.monotonic() - started < 0.5
+
+    def test_fast_call_is_not_hedged(self):
+        """Calls finishing before the delay run once"""
+        calls = []
+
+        async def call():
+            calls.append(1)
+            return "ok"
+
+        assert asyncio.run(hedged(call, 0.5)) == "ok"
+        assert len(calls) == 1
+
+    def test_failure_is_raised(self):
+        """An error is raised when no call succeeds"""
+        async def call():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            asyncio.run(hedged(call, 0.01))
+
+
+class TestAzureResilience:
+    """Test suite for retries and fail-fast around Azure"""
+
+    @pytest.fixture(autouse=True)
+    def azure_env(self, monkeypatch):
+        monkeypatch.setenv("VISION_ENDPOINT", "https://vision.test")
+        monkeypatch.setenv("VISION_KEY", "secret")
+        self.limiter = TokenBucket(rate=1000)
+        monkeypatch.setattr(rate_limiter, "_azure_limiter", self.limiter)
+        self.monkeypatch = monkeypatch
+
+    def detect(self, detector, responses):
+        """Run a detection against a queue of mocked Azure responses"""
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        async def run():
+            self.monkeypatch.setattr(
+                http_client, "_client",
+                httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+            return await detector.detect(b"image")
+
+        return asyncio.run(run()), calls
+
+    def test_transient_errors_are_retried(self):
+        """503s and connection errors are retried until Azure answers"""
+        detector = AzureDetector(
+            retry_policy=RetryPolicy(base_delay=0.001))
+        result, calls = self.detect(detector, [
+            httpx.Response(503),
+            httpx.ConnectError("refused"),
+            httpx.Response(200, json={"objects": []}),
+        ])
+
+        assert result == {"objects": []}
+        assert len(calls) == 3
+        assert detector.stats()["retries"] == 2
+        assert detector.stats()["circuit_breaker"]["state"] == "closed"
+
+    def test_throttling_honors_retry_after(self):
+        """A 429 pauses the shared limiter for the Retry-After delay"""
+        detector = AzureDetector()
+        started = time.monotonic()
+        result, calls = self.detect(detector, [
+            httpx.Response(429, headers={"Retry-After": "0.1"}),
+            httpx.Response(200, json={"objects": []}),
+        ])
+
+        assert result == {"objects": []}
+        assert time.monotonic() - started >= 0.1
+        assert self.limiter.stats()["deferred"] == 1
+
+    def test_throttling_never_opens_the_circuit(self):
+        """A burst of 429s queues concurrent detections instead of failing
+        them fast"""
+        detector = AzureDetector(
+            retry_policy=RetryPolicy(max_retries=3, base_delay=0.001),
+            circuit_breaker=CircuitBreaker(failure_threshold=2))
+        responses = [httpx.Response(429, headers={"Retry-After": "0.05"})
+                     for _ in range(6)]
+
+        def handler(request):
+            if responses:
+                return responses.pop(0)
+            return httpx.Response(200, json={"objects": []})
+
+        async def burst():
+            self.monkeypatch.setattr(
+                http_client, "_client",
+                httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+            return await asyncio.gather(
+                *(detector.detect(b"image") for _ in range(3)))
+
+        assert asyncio.run(burst()) == [{"objects": []}] * 3
+        breaker = detector.stats()["circuit_breaker"]
+        assert breaker["opened"] == 0
+        assert breaker["rejected"] == 0
+
+    def test_client_errors_are_not_retried(self):
+        """A 400 is returned as a 502 right away"""
+        detector = AzureDetector(retry_policy=RetryPolicy(base_delay=0.001))
+        with pytest.raises(HTTPException) as error:
+            self.detect(detector, [httpx.Response(400)])
+        assert error.value.status_code == 502
+        assert detector.stats()["retries"] == 0
+
+    def test_open_circuit_fails_fast(self):
+        """Once the breaker opens, Azure is not called at all"""
+        detector = AzureDetector(
+            retry_policy=RetryPolicy(max_retries=1, base_delay=0.001),
+            circuit_breaker=CircuitBreaker(failure_threshold=2))
+        with pytest.raises(HTTPException) as error:
+            self.detect(detector, [httpx.Response(500), httpx.Response(500)])
+        assert error.value.status_code == 502
+
+        with pytest.raises(HTTPException) as error:
+            self.detect(detector, [])
+        assert error.value.status_code == 503
+        assert int(error.value.headers["Retry-After"]) >= 1
+        assert detector.stats()["circuit_breaker"]["rejected"] == 1
+
+    def test_settings_from_environment(self):
+        """Retry, breaker and hedging settings are read from the env"""
+        self.monkeypatch.setenv("AZURE_MAX_RETRIES", "5")
+        self.monkeypatch.setenv("AZURE_CIRCUIT_FAILURE_THRESHOLD", "7")
+        self.monkeypatch.setenv("AZURE_HEDGE_DELAY_MS", "250")
+        detector = create_azure_detector()
+        assert detector.retry_policy.max_retries == 5
+        assert detector.circuit_breaker.failure_threshold == 7
+        assert detector.hedge_delay == 0.25
+
+        self.monkeypatch.setenv("AZURE_HEDGE_DELAY_MS", "auto")
+        assert create_azure_detector().hedge_percentile == 0.95
@@ -0,0 +1,218 @@
+import asyncio
+import multiprocessing
+
+import pytest
+
+from app.utils import jobs as jobs_module
+from app.utils import shared_state
+from app.utils.jobs import FAILED, RUNNING, SUCCEEDED, InMemoryJobBackend, Job, \
+    JobManager, SqliteJobBackend
+from app.utils.rate_limiter import SharedTokenBucket
+from app.utils.shared_state import SharedSingleFlight, SharedState
+
+
+def _try_lease(db_path: str) -> bool:
+    state = SharedState(db_path)
+    try:
+        return state.acquire_lease("key", 60)
+    finally:
+        state.close()
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two connections to one database, standing in for two workers"""
+    states = [SharedState(tmp_path / "shared.db") for _ in range(2)]
+    yield states
+    for state in states:
+        state.close()
+
+
+class TestSharedState:
+    """Test suite for leases and token buckets shared between workers"""
+
+    def test_lease_is_exclusive_until_released_or_expired(self, workers):
+        """Only one worker holds a lease; it passes on release or expiry"""
+        first, second = workers
+        assert first.acquire_lease("a", 60)
+        assert first.acquire_lease("a", 60)  # Renewal by the holder
+        assert not second.acquire_lease("a", 60)
+
+        first.release_lease("a")
+        assert second.acquire_lease("a", -1)  # Already expired
+        assert first.acquire_lease("a", 60)
+        assert first.stats()["leases"] == 1
+
+    def test_lease_is_exclusive_across_processes(self, tmp_path):
+        """Worker processes racing for a lease get exactly one winner"""
+        db_path = str(tmp_path / "shared.db")
+        SharedState(db_path).close()
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(4) as pool:
+            assert sorted(pool.map(_try_lease, [db_path] * 4)) == \
+                [False, False, False, True]
+
+    def test_token_bucket_is_shared(self, workers):
+        """Tokens taken by one worker are gone for the others"""
+        first, second = workers
+        assert first.take_tokens("azure", rate=1, capacity=2) == 0
+        assert second.take_tokens("azure", rate=1, capacity=2) == 0
+        assert second.take_tokens("azure", rate=1, capacity=2) == \
+            pytest.approx(1, abs=0.05)
+
+        first.hold_tokens("azure", rate=1, capacity=2, seconds=5)
+        assert first.take_tokens("azure", rate=1, capacity=2) == \
+            pytest.approx(7, abs=0.05)
+
+    def test_shared_token_bucket_waits(self, workers):
+        """The limiter sleeps for the wait computed in shared state"""
+        limiter = SharedTokenBucket(workers[0], "azure", rate=100, capacity=1)
+
+        async def scenario():
+            await limiter.acquire()
+            await limiter.acquire()
+
+        asyncio.run(scenario())
+        assert limiter.stats()["acquired"] == 2
+        assert limiter.stats()["waited_seconds"] == pytest.approx(0.01,
+                                                                  abs=0.005)
+
+
+class TestSharedSingleFlight:
+    """Work runs once across workers"""
+
+    def test_waiting_worker_uses_stored_result(self, workers):
+        """A worker that finds the key leased takes the stored result"""
+        stored = {}
+        calls = []
+        groups = [SharedSingleFlight(state, poll_interval=0.01)
+                  for state in workers]
+
+        async def work(worker):
+            calls.append(worker)
+            await asyncio.sleep(0.05)
+            stored["result"] = f"from {worker}"
+            return stored["result"]
+
+        async def stored_result():
+            return stored.get("result")
+
+        async def scenario():
+            return await asyncio.gather(*(
+                group.do("image", lambda n=n: work(n), cached=stored_result)
+                for n, group in enumerate(groups)))
+
+        results = asyncio.run(scenario())
+        assert len(calls) == 1
+        assert results == [f"from {calls[0]}"] * 2
+        assert sum(group.waited for group in groups) == 1
+        assert workers[0].stats()["leases"] == 0
+
+
+class TestSqliteJobBackend:
+    """Jobs are shared by all workers"""
+
+    def test_jobs_are_claimed_once(self, workers):
+        """A queued job is claimed by exactly one worker"""
+        origin = SqliteJobBackend(workers[0])
+        other = SqliteJobBackend(workers[1])
+
+        async def scenario():
+            theirs = Job(kind="detection", payload={"image_id": "b.jpg"},
+                         data=b"bytes")
+            mine = Job(kind="detection", payload={"image_id": "a.jpg"},
+                       data=b"bytes")
+            await origin.enqueue(theirs)
+            await origin.enqueue(mine)
+
+            claimed = await other.dequeue()
+            assert claimed.id == theirs.id and claimed.data is None
+            assert claimed.status == RUNNING
+            assert (await origin.dequeue()).data == b"bytes"
+            assert await origin.dequeue() is None
+            assert await origin.queued_count() == 0
+
+            # Finishing a job drops the input held for the job the other
+            # worker claimed
+            mine.status = SUCCEEDED
+            await origin.save(mine)
+            assert origin._data == {}
+
+            claimed.status = SUCCEEDED
+            claimed.result = {"objects": 2}
+            await other.save(claimed)
+            return await origin.get(theirs.id)
+
+        job = asyncio.run(scenario())
+        assert job.status == SUCCEEDED
+        assert job.result == {"objects": 2}
+
+    def test_job_submitted_on_one_worker_runs_on_another(self, workers):
+        """A worker picks up jobs submitted elsewhere by polling"""
+        submitter = SqliteJobBackend(workers[0])
+        runner = JobManager(SqliteJobBackend(workers[1]), workers=1,
+                            poll_interval=0.01)
+
+        async def double(job):
+            return {"value": job.payload["n"] * 2}
+
+        runner.register("double", double)
+
+        async def scenario():
+            runner.start()
+            job = Job(kind="double", payload={"n": 21})
+            await submitter.enqueue(job)
+            for _ in range(200):
+                current = await submitter.get(job.id)
+                if current.status == SUCCEEDED:
+                    break
+                await asyncio.sleep(0.01)
+            await runner.stop()
+            return current
+
+        job = asyncio.run(scenario())
+        assert job.status == SUCCEEDED
+        assert job.result == {"value": 42}
+
+    def test_jobs_of_stopped_workers_are_recovered(self, workers):
+        """Running jobs without heartbeats are requeued, then failed"""
+        backend = SqliteJobBackend(workers[0], stale_seconds=60,
+                                   max_attempts=2)
+        rescuer = SqliteJobBackend(workers[1], stale_seconds=60,
+                                   max_attempts=2)
+
+        def stop_worker():
+            # The worker holding the job sends no heartbeat for too long
+            workers[0].execute(
+                "UPDATE jobs SET heartbeat_at = heartbeat_at - 120")
+            rescuer._next_recovery = 0.0
+
+        async def scenario():
+            job = Job(kind="detection", payload={})
+            await backend.enqueue(job)
+            assert (await backend.dequeue()).id == job.id
+
+            stop_worker()
+            assert (await rescuer.dequeue()).id == job.id  # Second attempt
+            stop_worker()
+            assert await rescuer.dequeue() is None  # Out of attempts
+            return await backend.get(job.id)
+
+        job = asyncio.run(scenario())
+        assert job.status == FAILED
+        assert job.status_code == 500
+
+    def test_backend_follows_configuration(self, tmp_path, monkeypatch):
+        """Several server workers switch the job queue to shared state"""
+        monkeypatch.setenv("WEB_CONCURRENCY", "4")
+        monkeypatch.setenv("SHARED_STATE_PATH", str(tmp_path / "s.db"))
+        monkeypatch.setattr(shared_state, "_state", None)
+        monkeypatch.setattr(jobs_module, "_manager", None)
+        assert isinstance(jobs_module.get_job_manager().backend,
+                          SqliteJobBackend)
+        shared_state._state.close()
+
+        monkeypatch.setenv("SHARED_STATE_BACKEND", "memory")
+        monkeypatch.setattr(jobs_module, "_manager", None)
+        assert isinstance(jobs_module.get_job_manager().backend,
+                          InMemoryJobBackend)
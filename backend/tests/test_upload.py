@@ -0,0 +1,207 @@
+import asyncio
+import hashlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.routes.upload as upload_module
+from app.main import app
+from app.utils import image_index
+from app.utils.image_index import ImageIndex, ImageRecord
+
+client = TestClient(app)
+
+
+class TestStreamingUpload:
+    """Test suite for the streaming upload endpoint"""
+
+    @pytest.fixture(autouse=True)
+    def isolated_storage(self, tmp_path, monkeypatch):
+        self.uploads = tmp_path / "uploads"
+        self.uploads.mkdir()
+        self.index = ImageIndex(tmp_path / "index.db")
+        monkeypatch.setattr(upload_module, "UPLOAD_DIR", self.uploads)
+        monkeypatch.setattr(upload_module, "UPLOAD_CHUNK_SIZE", 4)
+        monkeypatch.setattr(image_index, "_index", self.index)
+        yield
+        self.index.close()
+
+    def test_file_streamed_in_chunks(self):
+        """Content larger than the chunk size is stored intact and hashed"""
+        content = b"0123456789abcdef!"
+        response = client.post(
+            "/api/upload",
+            files={"files[]": ("data.bin", content, "application/octet-stream")},
+        )
+        assert response.status_code == 200
+
+        saved = response.json()["files"][0]
+        assert saved["size"] == len(content)
+        assert (self.uploads / saved["saved_filename"]).read_bytes() == content
+        record = self.index.get(saved["saved_filename"])
+        assert record.hash == hashlib.sha256(content).hexdigest()
+        assert list(self.uploads.glob(".*.part")) == []
+
+    def test_content_addressed_deduplication(self):
+        """Re-uploading content resolves to the stored image"""
+        content = b"same bytes"
+        first = client.post(
+            "/api/upload",
+            files={"files[]": ("a.JPG", content, "image/jpeg")},
+        ).json()["files"][0]
+        second = client.post(
+            "/api/upload",
+            files=[("files[]", ("b.jpeg", content, "image/jpeg")),
+                   ("files[]", ("c.jpg", content, "image/jpeg"))],
+        ).json()["files"]
+
+        digest = hashlib.sha256(content).hexdigest()
+        assert first["saved_filename"] == f"{digest}.jpg"
+        assert first["duplicate"] is False
+        assert [f["saved_filename"] for f in second] == \
+            [first["saved_filename"]] * 2
+        assert all(f["duplicate"] for f in second)
+        assert [p.name for p in self.uploads.iterdir()] == [f"{digest}.jpg"]
+        assert self.index.get(first["saved_filename"]).refs == 3
+
+    def test_file_size_limit(self, monkeypatch):
+        """A file over the per-file limit is rejected without leftovers"""
+        monkeypatch.setattr(upload_module, "MAX_FILE_SIZE", 10)
+        response = client.post(
+            "/api/upload",
+            files={"files[]": ("big.bin", b"x" * 11, "application/octet-stream")},
+        )
+        assert response.status_code == 413
+        assert list(self.uploads.iterdir()) == []
+        assert self.index.count() == 0
+
+    def test_request_size_limit(self, monkeypatch):
+        """Files that together exceed the request limit are all discarded"""
+        monkeypatch.setattr(upload_module, "MAX_REQUEST_SIZE", 15)
+        response = client.post(
+            "/api/upload",
+            files=[("files[]", ("a.bin", b"a" * 10, "application/octet-stream")),
+                   ("files[]", ("b.bin", b"b" * 10, "application/octet-stream"))],
+        )
+        assert response.status_code == 413
+        assert list(self.uploads.iterdir()) == []
+        assert self.index.count() == 0
+
+    def test_failed_request_releases_duplicates(self, monkeypatch):
+        """A rejected request keeps blobs that other uploads still use"""
+        client.post(
+            "/api/upload",
+            files={"files[]": ("a.bin", b"a" * 10, "application/octet-stream")},
+        )
+        monkeypatch.setattr(upload_module, "MAX_REQUEST_SIZE", 15)
+        response = client.post(
+            "/api/upload",
+            files=[("files[]", ("a.bin", b"a" * 10, "application/octet-stream")),
+                   ("files[]", ("b.bin", b"b" * 10, "application/octet-stream"))],
+        )
+        assert response.status_code == 413
+        assert len(list(self.uploads.iterdir())) == 1
+        assert self.index.count() == 1
+        assert self.index.get(
+            hashlib.sha256(b"a" * 10).hexdigest() + ".bin").refs == 1
+
+    def test_upload_during_delete_keeps_its_file(self, monkeypatch):
+        """Content re-uploaded while its image is being deleted survives"""
+        import app.routes.images as images_module
+
+        content = b"same bytes"
+        digest = hashlib.sha256(content).hexdigest()
+        first = client.post(
+            "/api/upload",
+            files={"files[]": ("a.jpg", content, "image/jpeg")},
+        ).json()["files"][0]
+
+        uploaded = []
+        real_purge = images_module.purge_image
+
+        def purge_after_upload(record):
+            # The upload lands between the release and the file removal
+            staged = self.uploads / ".staged.part"
+            staged.write_bytes(content)
+            uploaded.append(upload_module.store_blob(
+                str(staged), digest, ".jpg", len(content), "image/jpeg"))
+            return real_purge(record)
+
+        monkeypatch.setattr(images_module, "purge_image", purge_after_upload)
+        response = client.delete(f"/api/images/{first['saved_filename']}")
+        assert response.status_code == 200
+
+        record, duplicate = uploaded[0]
+        assert not duplicate and record.id != first["saved_filename"]
+        assert self.index.get(first["saved_filename"]) is None
+        assert self.index.get(record.id).refs == 1
+        with open(record.original_path, "rb") as stored:
+            assert stored.read() == content
+
+
+    def test_duplicate_completes_a_missing_original(self):
+        """A duplicate of an upload whose file is not in place yet stores
+        its identical copy instead of dropping it"""
+        content = b"same bytes"
+        digest = hashlib.sha256(content).hexdigest()
+        record, duplicate = self.index.register_upload(ImageRecord(
+            id=f"{digest}.jpg", original_path=str(
+                self.uploads / f"{digest}.jpg"), hash=digest))
+        assert not duplicate
+
+        staged = self.uploads / ".staged.part"
+        staged.write_bytes(content)
+        again, duplicate = upload_module.store_blob(
+            str(staged), digest, ".jpg", len(content), "image/jpeg")
+        assert duplicate and again.id == record.id
+        assert not staged.exists()
+        with open(record.original_path, "rb") as stored:
+            assert stored.read() == content
+
+
+class TestUploadSizeLimitMiddleware:
+    """Oversized upload bodies are refused while they arrive"""
+
+    def run(self, headers, chunks):
+        consumed = []
+        sent = []
+        remaining = list(chunks)
+
+        async def receive():
+            body = remaining.pop(0)
+            consumed.append(body)
+            return {"type": "http.request", "body": body,
+                    "more_body": bool(remaining)}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "POST", "path": "/api/upload",
+                 "raw_path": b"/api/upload", "query_string": b"",
+                 "root_path": "", "scheme": "http", "http_version": "1.1",
+                 "server": ("testserver", 80), "client": ("test", 1),
+                 "headers": [(b"content-type",
+                              b"multipart/form-data; boundary=xyz"),
+                             *headers]}
+        asyncio.run(app(scope, receive, send))
+        return sent[0]["status"], len(consumed)
+
+    def test_body_is_cut_off_at_the_limit(self, monkeypatch):
+        """A chunked body is rejected once it passes the limit"""
+        monkeypatch.setattr(upload_module, "MAX_REQUEST_SIZE", 0)
+        monkeypatch.setattr(upload_module, "MULTIPART_OVERHEAD", 1000)
+        head = (b"--xyz\r\nContent-Disposition: form-data; name=\"files[]\"; "
+                b"filename=\"big.bin\"\r\n\r\n")
+        chunks = [head] + [b"x" * 500] * 20 + [b"\r\n--xyz--\r\n"]
+        status, consumed = self.run([], chunks)
+        assert status == 413
+        assert consumed < 5
+
+    def test_declared_length_is_refused_before_reading(self, monkeypatch):
+        """A Content-Length over the limit is refused without reading"""
+        monkeypatch.setattr(upload_module, "MAX_REQUEST_SIZE", 0)
+        monkeypatch.setattr(upload_module, "MULTIPART_OVERHEAD", 1000)
+        status, consumed = self.run([(b"content-length", b"5000")],
+                                    [b"x" * 5000])
+        assert status == 413
+        assert consumed == 0
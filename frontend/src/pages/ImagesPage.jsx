@@ -189,7 +189,7 @@ export function ImagesPage() {
                                 
                                 <div className="aspect-w-1 aspect-h-1">
                                     <img
-                                        src={image.url}
+                                        src={image.thumbnail_url || image.url}
                                         alt={image.filename}
                                         className="object-cover w-full h-full"
                                         loading="lazy"